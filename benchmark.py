@@ -0,0 +1,550 @@
+"""Бенчмарк и нагрузочный тест сервиса: задержки по этапам и end-to-end, пропускная способность, память.
+
+Запуск: python benchmark.py [--quick] [--real] [--scenarios stages,models,http]
+                            [--output benchmark_results.json] [--baseline old.json] [--threshold 0.15]
+
+По умолчанию работает офлайн: вместо нейросетей - маленькие модели на numpy с тем же
+интерфейсом, что у AIDetectorModel и AITextDetector (процессор, токенизатор, бэкенд).
+--real берет настоящие модели (нужны torch/transformers и веса).
+Результаты пишутся в JSON. С --baseline медианы/p95 и пропускная способность
+сравниваются с прошлым прогоном; регрессия больше threshold дает код выхода 1.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+IMAGE_SIZES = [(640, 480), (1920, 1080), (4000, 3000)]
+TEXT_LENGTHS = [200, 2000, 20000]
+CONCURRENCY = [1, 8, 32]
+WORDS = (
+    "the model text image detector neural network generated human written sample "
+    "photo camera light scene language output probability system people city"
+).split()
+
+
+# --- Модели-заглушки ---
+
+def np_softmax(logits):
+    logits = np.asarray(logits, dtype=np.float32)
+    e = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+class _Array(np.ndarray):
+    # Как тензор: .to(device) ничего не делает
+    def to(self, device):
+        return self
+
+
+class _Encoding(dict):
+    def to(self, device):
+        return self
+
+
+class StandInProcessor:
+    """Как AutoImageProcessor: resize до 224, нормализация, NCHW float32"""
+
+    def __call__(self, images, return_tensors=None):
+        batch = np.stack([
+            np.asarray(image.convert("RGB").resize((224, 224), Image.BILINEAR), dtype=np.float32)
+            for image in images
+        ])
+        batch = (batch / 255.0 - 0.5) / 0.5
+        return {"pixel_values": batch.transpose(0, 3, 1, 2)}
+
+
+class StandInImageBackend:
+    name = "stand-in"
+
+    def __init__(self, hidden=512, seed=0):
+        rng = np.random.default_rng(seed)
+        self.w1 = rng.standard_normal((3 * 56 * 56, hidden), dtype=np.float32) * 0.01
+        self.w2 = rng.standard_normal((hidden, 2), dtype=np.float32) * 0.1
+
+    def __call__(self, inputs):
+        x = inputs["pixel_values"]
+        n = x.shape[0]
+        pooled = x.reshape(n, 3, 56, 4, 56, 4).mean(axis=(3, 5)).reshape(n, -1)
+        return np.tanh(pooled @ self.w1) @ self.w2
+
+
+class StandInTokenizer:
+    """Как токенизатор HF: слова -> id по хэшу, окна с перекрытием, offsets"""
+
+    model_input_names = ["input_ids", "attention_mask"]
+
+    def __init__(self, vocab_size=30522):
+        self.vocab_size = vocab_size
+
+    def __call__(self, text, return_tensors=None, truncation=False, max_length=512, padding=False,
+                 stride=0, return_overflowing_tokens=False, return_offsets_mapping=False):
+        texts = [text] if isinstance(text, str) else list(text)
+        body = max_length - 2
+        rows = []
+        for t in texts:
+            spans = [(m.start(), m.end()) for m in re.finditer(r"\w+|[^\w\s]", t)]
+            if return_overflowing_tokens and len(spans) > body:
+                step = body - stride
+                rows.extend((t, spans[i:i + body]) for i in range(0, len(spans) - stride, step))
+            else:
+                rows.append((t, spans[:body] if truncation else spans))
+
+        width = max(len(spans) for _, spans in rows) + 2
+        ids = np.zeros((len(rows), width), dtype=np.int64)
+        mask = np.zeros((len(rows), width), dtype=np.int64)
+        offsets = np.zeros((len(rows), width, 2), dtype=np.int64)
+        for r, (t, spans) in enumerate(rows):
+            ids[r, 0], ids[r, len(spans) + 1] = 0, 2
+            mask[r, :len(spans) + 2] = 1
+            for c, (a, b) in enumerate(spans, start=1):
+                ids[r, c] = 3 + zlib.crc32(t[a:b].encode()) % (self.vocab_size - 3)
+                offsets[r, c] = (a, b)
+        if return_tensors is None and isinstance(text, str) and not return_overflowing_tokens:
+            # Без return_tensors HF возвращает списки без паддинга
+            length = len(rows[0][1]) + 2
+            return _Encoding(input_ids=ids[0, :length].tolist(), attention_mask=mask[0, :length].tolist())
+        encoded = _Encoding(input_ids=ids.view(_Array), attention_mask=mask.view(_Array))
+        if return_offsets_mapping:
+            encoded["offset_mapping"] = offsets.view(_Array)
+        return encoded
+
+    def pad(self, encodings, return_tensors=None):
+        width = max(len(e["input_ids"]) for e in encodings)
+        ids = np.ones((len(encodings), width), dtype=np.int64)
+        mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for r, e in enumerate(encodings):
+            ids[r, :len(e["input_ids"])] = e["input_ids"]
+            mask[r, :len(e["attention_mask"])] = e["attention_mask"]
+        return _Encoding(input_ids=ids.view(_Array), attention_mask=mask.view(_Array))
+
+
+class StandInTextBackend:
+    name = "stand-in"
+
+    def __init__(self, vocab_size=30522, dim=64, layers=4, seed=1):
+        rng = np.random.default_rng(seed)
+        self.embeddings = rng.standard_normal((vocab_size, dim), dtype=np.float32) * 0.1
+        self.layers = [rng.standard_normal((dim, dim), dtype=np.float32) * 0.2 for _ in range(layers)]
+        self.head = rng.standard_normal((dim, 2), dtype=np.float32)
+
+    def __call__(self, inputs):
+        mask = np.asarray(inputs["attention_mask"])[..., None]
+        hidden = self.embeddings[np.asarray(inputs["input_ids"])]
+        for weight in self.layers:
+            hidden = np.tanh(hidden @ weight)
+        pooled = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+        return pooled @ self.head
+
+
+def stand_in_models():
+    """Подкладывает заглушки в model/text_model до импорта main"""
+    import model
+    import text_model
+
+    class StandInImageModel(model.AIDetectorModel):
+        def __init__(self):
+            super().__init__(autoload=False)
+            self.model_name = "stand-in/image"
+            self.model_version = "stand-in"
+
+        def load(self):
+            with self._load_lock:
+                self.processor = StandInProcessor()
+                self.backend = StandInImageBackend()
+                self.ready, self.state = True, "ready"
+            return True
+
+        def _predict_full(self, images):
+            probs = np_softmax(self.backend(self.processor(images=images, return_tensors="np")))
+            return [self._build_result(image, *self._scores(p)) for image, p in zip(images, probs)]
+
+    class StandInTextDetector(text_model.AITextDetector):
+        def load(self):
+            with self._load_lock:
+                self.model_name = "stand-in/text"
+                self.device = None
+                self.tokenizer = StandInTokenizer()
+                self.backend = StandInTextBackend()
+                self.is_loaded, self.state = True, "ready"
+            return True
+
+    model.ai_model = StandInImageModel()
+    text_model.AITextDetector = StandInTextDetector
+    text_model._softmax = np_softmax
+
+
+# --- Входные данные и измерения ---
+
+def make_photo(width, height, seed=0):
+    # Шум поверх градиента, чтобы картинка была похожа на фото, а не на заливку
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 25, (height, width, 3)).astype(np.float32)
+    return Image.fromarray(np.clip(gradient + noise, 0, 255).astype(np.uint8), "RGB")
+
+
+def make_jpeg(width, height, seed=0):
+    buffer = io.BytesIO()
+    make_photo(width, height, seed).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def make_text(length, seed=0):
+    rng = np.random.default_rng(seed)
+    words, size = [], 0
+    while size < length:
+        words.append(WORDS[rng.integers(len(WORDS))])
+        if rng.random() < 0.08:
+            words[-1] += "."
+        size += len(words[-1]) + 1
+    return " ".join(words)[:length]
+
+
+def summarize(times, count=None, wall=None):
+    times = sorted(times)
+    pick = lambda q: times[min(len(times) - 1, int(q * len(times)))] * 1000
+    result = {
+        "n": len(times),
+        "mean_ms": round(statistics.fmean(times) * 1000, 3),
+        "p50_ms": round(pick(0.5), 3),
+        "p95_ms": round(pick(0.95), 3),
+        "p99_ms": round(pick(0.99), 3),
+    }
+    if wall:
+        result["throughput_per_s"] = round((count or len(times)) / wall, 2)
+    return result
+
+
+class PeakRSS:
+    """Пиковая RSS процесса за время блока (опрос /proc/self/statm)"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            # macOS/прочие: только пик за все время процесса
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _poll(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / 1024 / 1024, 1)
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    value = fn(*args)
+    return value, time.perf_counter() - started
+
+
+# --- Сценарии ---
+
+def bench_stages(main, args):
+    """Этапы /upload по отдельности на картинках разного размера"""
+    from utils.imaging import decode_for_model, decode_image
+    from utils.watermark import add_watermark
+
+    ai_model = main.ai_model
+    ai_model.load()
+    results = {}
+    for width, height in args.image_sizes:
+        contents = make_jpeg(width, height)
+        stages = {name: [] for name in ("decode", "preprocess", "forward", "watermark", "encode", "log", "total")}
+        with PeakRSS() as memory:
+            for i in range(args.stage_runs):
+                started = time.perf_counter()
+                image, t = timed(decode_for_model, contents, main.MODEL_INPUT_SIDE, main.MAX_IMAGE_PIXELS)
+                stages["decode"].append(t)
+                inputs, t = timed(lambda: ai_model.processor(images=[image.convert("RGB")], return_tensors="pt"))
+                stages["preprocess"].append(t)
+                _, t = timed(ai_model.backend, inputs)
+                stages["forward"].append(t)
+                # Водяной знак рисуется на полноразмерной картинке, ее декодирование входит в этап
+                stamped, t = timed(lambda: add_watermark(decode_image(contents, main.MAX_IMAGE_PIXELS),
+                                                         "Прошел проверку на AI)"))
+                stages["watermark"].append(t)
+                buffer = io.BytesIO()
+                _, t = timed(lambda: stamped.save(buffer, format="JPEG", quality=95))
+                stages["encode"].append(t)
+                _, t = timed(main.log_detection, {"type": "image", "benchmark": True, "run": i})
+                stages["log"].append(t)
+                stages["total"].append(time.perf_counter() - started)
+        key = f"{width}x{height}"
+        results[key] = {name: summarize(times) for name, times in stages.items()}
+        results[key]["peak_rss_mb"] = memory.peak_mb
+        print(f"  {key:>10}: " + ", ".join(
+            f"{name} {results[key][name]['p50_ms']:.1f}" for name in stages) + " мс (медианы)")
+    main.journal.flush()
+    return results
+
+
+def bench_models(main, args):
+    """Классы моделей напрямую, без HTTP и очередей"""
+    from utils.imaging import decode_for_model
+
+    results = {"image": {}, "text": {}}
+    image = decode_for_model(make_jpeg(640, 480), main.MODEL_INPUT_SIDE)
+    for batch_size in (1, 8):
+        images = [image] * batch_size
+        main.ai_model.predict_batch(images)  # прогрев
+        with PeakRSS() as memory:
+            started = time.perf_counter()
+            times = [timed(main.ai_model.predict_batch, images)[1] for _ in range(args.model_runs)]
+            wall = time.perf_counter() - started
+        results["image"][f"batch_{batch_size}"] = {
+            **summarize(times, args.model_runs * batch_size, wall), "peak_rss_mb": memory.peak_mb
+        }
+
+    detector = main.text_detector
+    for length in args.text_lengths:
+        text = make_text(length)
+        detector.predict(text)
+        with PeakRSS() as memory:
+            started = time.perf_counter()
+            times = [timed(detector.predict, text)[1] for _ in range(args.model_runs)]
+            wall = time.perf_counter() - started
+        results["text"][f"predict_{length}"] = {**summarize(times, wall=wall), "peak_rss_mb": memory.peak_mb}
+
+        texts = [make_text(length, seed) for seed in range(16)]
+        started = time.perf_counter()
+        times = [timed(detector.predict_batch, texts)[1] for _ in range(max(1, args.model_runs // 4))]
+        results["text"][f"batch16_{length}"] = summarize(times, len(times) * 16, time.perf_counter() - started)
+
+        if length >= 2000:
+            started = time.perf_counter()
+            times = [timed(detector.predict_long, text)[1] for _ in range(max(1, args.model_runs // 4))]
+            results["text"][f"long_{length}"] = summarize(times, wall=time.perf_counter() - started)
+
+    for kind, entries in results.items():
+        for name, entry in entries.items():
+            print(f"  {kind:>5} {name:>14}: p50 {entry['p50_ms']:.1f} мс, {entry['throughput_per_s']:.1f} шт/с")
+    return results
+
+
+def start_server(app):
+    import uvicorn
+    from utils.prefork import bind_socket
+
+    sock = bind_socket("127.0.0.1", 0)
+    server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+    thread = threading.Thread(target=server.run, kwargs={"sockets": [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+async def load_test(url, make_request, total, concurrency):
+    import httpx
+
+    limit = asyncio.Semaphore(concurrency)
+    times, errors = [], {}
+    async with httpx.AsyncClient(base_url=url, timeout=300,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        async def one(i):
+            async with limit:
+                started = time.perf_counter()
+                try:
+                    response = await make_request(client, i)
+                    status = response.status_code
+                except Exception as e:
+                    status = type(e).__name__
+                times.append(time.perf_counter() - started)
+                if status != 200:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        wall = time.perf_counter() - started
+    return {**summarize(times, total, wall), "errors": errors}
+
+
+def bench_http(main, args):
+    """/upload и /detect-text через настоящий HTTP-сервер под разной конкурентностью"""
+    server, thread, url = start_server(main.app)
+    results = {"upload_scores": {}, "upload_json": {}, "detect_text": {}}
+    try:
+        for width, height in args.image_sizes:
+            contents = make_jpeg(width, height)
+            for mode in ("scores", "json"):
+                async def request(client, i, mode=mode):
+                    files = {"file": ("bench.jpg", contents, "image/jpeg")}
+                    return await client.post("/upload", params={"mode": mode}, files=files)
+
+                for concurrency in args.concurrency:
+                    with PeakRSS() as memory:
+                        entry = asyncio.run(load_test(url, request, args.requests, concurrency))
+                    entry["peak_rss_mb"] = memory.peak_mb
+                    results[f"upload_{mode}"][f"{width}x{height}_c{concurrency}"] = entry
+                    print(f"  /upload {mode:>6} {width}x{height} c={concurrency:<3}: p50 {entry['p50_ms']:.1f} мс, "
+                          f"p95 {entry['p95_ms']:.1f} мс, {entry['throughput_per_s']:.1f} запр/с, ошибки {entry['errors']}")
+
+        # Каждый запрос - новый текст, иначе после первого ответа все идет из кэша;
+        # mixed - короткие и длинные тексты вперемешку, как в боте
+        for length in (*args.text_lengths, "mixed"):
+            for concurrency in args.concurrency:
+                async def request(client, i, length=length, seed=concurrency * 1_000_000):
+                    size = args.text_lengths[i % len(args.text_lengths)] if length == "mixed" else length
+                    return await client.post("/detect-text", json={"text": make_text(size, seed + i)})
+
+                with PeakRSS() as memory:
+                    entry = asyncio.run(load_test(url, request, args.requests, concurrency))
+                entry["peak_rss_mb"] = memory.peak_mb
+                results["detect_text"][f"{length}_c{concurrency}"] = entry
+                print(f"  /detect-text {length:>6} c={concurrency:<3}: p50 {entry['p50_ms']:.1f} мс, "
+                      f"p95 {entry['p95_ms']:.1f} мс, {entry['throughput_per_s']:.1f} запр/с, ошибки {entry['errors']}")
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+    return results
+
+
+# --- Сравнение с прошлым прогоном ---
+
+def flatten(tree, prefix=""):
+    for key, value in tree.items():
+        path = f"{prefix}/{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, path)
+        else:
+            yield path, value
+
+
+def compare(results, baseline, threshold, min_delta_ms=1.0):
+    """Список регрессий: задержка выросла или пропускная способность упала больше threshold.
+
+    Рост задержки меньше min_delta_ms не считается: на долях миллисекунды это шум.
+    """
+    old = dict(flatten(baseline["scenarios"]))
+    regressions = []
+    for path, value in flatten(results["scenarios"]):
+        before = old.get(path)
+        if not isinstance(before, (int, float)) or not isinstance(value, (int, float)) or before <= 0:
+            continue
+        if path.endswith(("/p50_ms", "/p95_ms")) and value > before * (1 + threshold) \
+                and value - before >= min_delta_ms:
+            regressions.append((path, before, value))
+        elif path.endswith("/throughput_per_s") and value < before * (1 - threshold):
+            regressions.append((path, before, value))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", default="stages,models,http")
+    parser.add_argument("--real", action="store_true", help="настоящие модели вместо заглушек")
+    parser.add_argument("--quick", action="store_true", help="меньше размеров и запросов")
+    parser.add_argument("--requests", type=int, default=64, help="запросов на каждую точку HTTP-теста")
+    parser.add_argument("--stage-runs", type=int, default=10)
+    parser.add_argument("--model-runs", type=int, default=20)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument("--min-delta-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    args.image_sizes, args.text_lengths, args.concurrency = IMAGE_SIZES, TEXT_LENGTHS, CONCURRENCY
+    if args.quick:
+        args.image_sizes, args.text_lengths, args.concurrency = IMAGE_SIZES[:2], TEXT_LENGTHS[:2], CONCURRENCY[:2]
+        args.requests, args.stage_runs, args.model_runs = 16, 5, 10
+
+    # Журнал, очередь задач и прочие файлы - во временной папке; кэш и индекс
+    # почти-дубликатов и хранилище загрузок выключены, чтобы каждый запрос доходил
+    # до модели, а лимит на клиента - потому что вся нагрузка идет с одного адреса
+    workdir = tempfile.mkdtemp(prefix="detector-bench-")
+    os.environ.update(UPLOAD_DIR=workdir, JOBS_DB=os.path.join(workdir, "jobs.db"),
+                      CACHE_TTL="0", PHASH_INDEX="0", ADMISSION="0", UPLOAD_STORE="0")
+    os.environ.pop("CACHE_DB", None)
+    if not args.real:
+        stand_in_models()
+    import main as service
+    # text_model включает INFO для всех логгеров, httpx писал бы строку на каждый запрос
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    service.ai_model.load()
+    service.text_detector.load()
+    print(f"Модели: {'настоящие' if args.real else 'заглушки'}, файлы: {workdir}")
+
+    scenarios = {}
+    runners = {"stages": bench_stages, "models": bench_models, "http": bench_http}
+    for name in args.scenarios.split(","):
+        print(f"\n=== {name} ===")
+        scenarios[name] = runners[name](service, args)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "commit": git_commit(),
+            "models": "real" if args.real else "stand-in",
+            "quick": args.quick,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        },
+        "scenarios": scenarios,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ Результаты: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+        print(f"Сравнение с {args.baseline} (коммит {baseline['meta'].get('commit')}), порог {args.threshold:.0%}:")
+        for path, before, after in regressions:
+            print(f"  ❌ {path}: {before} -> {after}")
+        if regressions:
+            sys.exit(1)
+        print("  ✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Сравнение бэкендов инференса: расхождение с float32, задержка и пропускная способность.
+
+Запуск: python benchmark_backends.py [--model image|text|all] [--backends torch,int8,onnx] [--runs 20]
+Модели скачиваются с Hugging Face при первом запуске.
+"""
+import argparse
+import statistics
+import time
+
+import torch
+from PIL import Image
+from transformers import (AutoImageProcessor, AutoModelForImageClassification,
+                          AutoModelForSequenceClassification, AutoTokenizer)
+
+from utils.backends import BACKENDS, TorchBackend, build_backend, check_parity, onnx_path_for
+
+IMAGE_MODEL = "umm-maybe/AI-image-detector"
+TEXT_MODEL = "Hello-SimpleAI/chatgpt-detector-roberta"
+SAMPLE_TEXT = (
+    "Large language models can produce fluent text on almost any topic, "
+    "which makes it hard to tell whether a paragraph was written by a person. "
+) * 8
+
+
+def image_inputs(batch_size):
+    processor = AutoImageProcessor.from_pretrained(IMAGE_MODEL)
+    images = [Image.effect_noise((640, 480), 40 + i).convert("RGB") for i in range(batch_size)]
+    return processor(images=images, return_tensors="pt")
+
+
+def text_inputs(batch_size):
+    tokenizer = AutoTokenizer.from_pretrained(TEXT_MODEL)
+    return tokenizer([SAMPLE_TEXT] * batch_size, return_tensors="pt",
+                     truncation=True, max_length=512, padding=True)
+
+
+def measure(backend, inputs, runs):
+    backend(inputs)  # прогрев
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        backend(inputs)
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def run(kind, model, make_inputs, model_name, dynamic_axes, backends, runs):
+    print(f"\n=== {kind}: {model_name} (torch threads: {torch.get_num_threads()}) ===")
+    reference = TorchBackend(model)
+    single, batch = make_inputs(1), make_inputs(8)
+    for name in backends:
+        backend = build_backend(name, model, dict(single), onnx_path=onnx_path_for(model_name),
+                                dynamic_axes=dynamic_axes, tolerance=1.0)
+        if backend.name != name:
+            print(f"{name:>8}: недоступен")
+            continue
+        diff = check_parity(reference, backend, batch)
+        latency = measure(backend, single, runs)
+        batch_latency = measure(backend, batch, max(1, runs // 4))
+        print(f"{name:>8}: расхождение {diff:.5f} | batch=1 {latency * 1000:7.1f} мс | "
+              f"batch=8 {batch_latency * 1000:7.1f} мс, {8 / batch_latency:6.1f} шт/с")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", choices=["image", "text", "all"], default="all")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    backends = [b for b in args.backends.split(",") if b]
+
+    if args.model in ("image", "all"):
+        model = AutoModelForImageClassification.from_pretrained(IMAGE_MODEL).eval()
+        run("image", model, image_inputs, IMAGE_MODEL, {"pixel_values": {0: "batch"}}, backends, args.runs)
+    if args.model in ("text", "all"):
+        model = AutoModelForSequenceClassification.from_pretrained(TEXT_MODEL).eval()
+        axes = {name: {0: "batch", 1: "sequence"} for name in ("input_ids", "attention_mask")}
+        run("text", model, text_inputs, TEXT_MODEL, axes, backends, args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Бенчмарк водяного знака на 12 Мп фото: старая отрисовка vs кэш штампов.
+
+Запуск: python benchmark_watermark.py [--runs 10] [--width 4000 --height 3000]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+from utils import watermark
+from utils.watermark import add_watermark
+
+TEXTS = ["Прошел проверку на AI)", "Не прошел проверку на AI!"]
+
+
+def legacy_add_watermark(image: Image.Image, text: str) -> Image.Image:
+    # Прежняя реализация: шрифт, лицо и оверлей на весь кадр при каждом вызове
+    img = image.copy().convert("RGBA")
+    width, height = img.size
+    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+
+    font_size = max(20, width // 30)
+
+    font = None
+    for path in watermark.FONT_PATHS:
+        try:
+            font = ImageFont.truetype(path, size=font_size)
+            break
+        except: continue
+    if not font: font = ImageFont.load_default()
+
+    face_img = None
+    if os.path.exists(watermark.FACE_PATH):
+        face_img = Image.open(watermark.FACE_PATH).convert("RGBA")
+        face_size = font_size + 20
+        face_img = face_img.resize((face_size, face_size), Image.Resampling.LANCZOS)
+        mask = Image.new("L", (face_size, face_size), 0)
+        ImageDraw.Draw(mask).ellipse((0, 0, face_size, face_size), fill=255)
+        circular_face = Image.new("RGBA", (face_size, face_size), (0, 0, 0, 0))
+        circular_face.paste(face_img, (0, 0), mask=mask)
+        face_img = circular_face
+
+    padding = 20
+    bbox = draw.textbbox((0, 0), text, font=font)
+    x_text = width - (bbox[2] - bbox[0]) - padding
+    y_text = height - (bbox[3] - bbox[1]) - padding
+
+    if face_img:
+        face_x = int(x_text - face_img.width - 15)
+        face_y = int(y_text - (face_img.height // 4))
+        overlay.paste(face_img, (face_x, face_y), face_img)
+
+    draw.text((x_text + 1, y_text + 1), text, fill=(0, 0, 0, 180), font=font)
+    draw.text((x_text, y_text), text, fill=(255, 255, 255, 220), font=font)
+
+    return Image.alpha_composite(img, overlay).convert("RGB")
+
+
+def make_photo(width, height):
+    # Шум поверх градиента, чтобы картинка была похожа на фото, а не на заливку
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    noise = rng.normal(0, 25, (height, width, 3)).astype(np.float32)
+    pixels = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels, "RGB")
+
+
+def bench(fn, image, runs):
+    times = []
+    for i in range(runs):
+        started = time.perf_counter()
+        fn(image, TEXTS[i % len(TEXTS)])
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return times[len(times) // 2], sum(times) / len(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    args = parser.parse_args()
+
+    image = make_photo(args.width, args.height)
+    print(f"Фото {args.width}x{args.height} ({args.width * args.height / 1e6:.1f} Мп), прогонов: {args.runs}")
+
+    for text in TEXTS:
+        diff = ImageChops.difference(legacy_add_watermark(image, text), add_watermark(image, text))
+        if diff.getbbox() is not None:
+            raise SystemExit(f"❌ Результат отличается от старой реализации: {text}")
+    print("✅ Результат совпадает со старой реализацией попиксельно")
+
+    legacy_median, legacy_mean = bench(legacy_add_watermark, image, args.runs)
+    new_median, new_mean = bench(add_watermark, image, args.runs)
+    print(f"  Старая отрисовка: медиана {legacy_median * 1000:.1f} мс, среднее {legacy_mean * 1000:.1f} мс")
+    print(f"  Кэш штампов:      медиана {new_median * 1000:.1f} мс, среднее {new_mean * 1000:.1f} мс")
+    print(f"  Ускорение: x{legacy_median / new_median:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,59 @@
-import logging, io, requests, base64, aiosqlite
+import logging, io
+import math
 import os
 from dotenv import load_dotenv
 load_dotenv()
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, ContextTypes, filters
+from utils.admission import AdmissionController
+from utils.detector_client import DetectorClient
+from utils.stats_store import StatsStore
 
 # --- КОНФИГУРАЦИЯ ---
 TOKEN = os.getenv("BOT_TOKEN")
-SERVER_URL = "http://127.0.0.1:8000"
+SERVER_URL = os.getenv("SERVER_URL", "http://127.0.0.1:8000")
 DB_NAME = "bot_data.db"
+# Telegram Bot API отдает ботам файлы не больше 20 МБ
+MAX_MEDIA_BYTES = 20 * 1024 * 1024
+
+# Один клиент с пулом соединений на весь бот. DETECTOR_UDS - путь к Unix-сокету
+# сервера, если бот и сервер на одной машине (main.py задает его, когда запускает бота)
+detector = DetectorClient(
+    SERVER_URL,
+    uds=os.getenv("DETECTOR_UDS") or None,
+    max_connections=int(os.getenv("DETECTOR_MAX_CONNECTIONS", 20)),
+    retries=int(os.getenv("DETECTOR_RETRIES", 3)),
+)
+
+# Лимит на пользователя: проверки сверх BOT_USER_RATE в секунду (с запасом BOT_USER_BURST)
+# отклоняются до скачивания файла. Сервер по tg:<id> ведет свой лимит и очередь к модели
+user_limits = AdmissionController(
+    rate=float(os.getenv("BOT_USER_RATE", 0.5)),
+    burst=float(os.getenv("BOT_USER_BURST", 5)),
+)
 
 logging.basicConfig(level=logging.INFO)
 
-# --- БАЗА ДАННЫХ (Оставляем как было) ---
-async def init_db():
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute('''CREATE TABLE IF NOT EXISTS users 
-            (id INTEGER PRIMARY KEY, checks_count INTEGER DEFAULT 0)''')
-        await db.execute('''CREATE TABLE IF NOT EXISTS global_stats 
-            (name TEXT PRIMARY KEY, value INTEGER DEFAULT 0)''')
-        await db.execute("INSERT OR IGNORE INTO global_stats (name, value) VALUES ('total_checks', 0)")
-        await db.commit()
+# --- БАЗА ДАННЫХ ---
+# Одно соединение на весь бот, счетчики пишутся в базу пачками раз в STATS_FLUSH_INTERVAL секунд
+stats_store = StatsStore(DB_NAME, flush_interval=float(os.getenv("STATS_FLUSH_INTERVAL", 2)))
 
 async def update_user_stats(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        await db.execute("INSERT OR IGNORE INTO users (id) VALUES (?)", (user_id,))
-        await db.execute("UPDATE users SET checks_count = checks_count + 1 WHERE id = ?", (user_id,))
-        await db.execute("UPDATE global_stats SET value = value + 1 WHERE name = 'total_checks'")
-        await db.commit()
+    stats_store.record_check(user_id)
 
 async def get_stats(user_id):
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT checks_count FROM users WHERE id = ?", (user_id,)) as cursor:
-            user_row = await cursor.fetchone()
-        async with db.execute("SELECT value FROM global_stats WHERE name = 'total_checks'") as cursor:
-            global_row = await cursor.fetchone()
-        return (user_row[0] if user_row else 0), (global_row[0] if global_row else 0)
+    return await stats_store.get_user_checks(user_id), stats_store.total_checks()
+
+def client_of(update: Update):
+    return f"tg:{update.effective_user.id}"
+
+async def admit(update: Update, cost=1):
+    """False и ответ пользователю, если он превысил лимит проверок"""
+    wait = user_limits.admit(client_of(update), cost)
+    if wait:
+        await update.message.reply_text(f"⏳ Слишком много проверок подряд. Подожди {math.ceil(wait)} с.")
+        return False
+    return True
 
 # --- ОБРАБОТЧИКИ ---
 
@@ -50,6 +68,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "👋 Привет! Я AI Detector.\n\n"
         "🔸 Пришли мне **ФОТО**, и я найду на нем следы ИИ.\n"
+        "🔸 Пришли мне **ГИФКУ** или **ВИДЕО**, и я проверю кадры.\n"
         "🔸 Пришли мне **ТЕКСТ**, и я скажу, кто его написал.",
         reply_markup=reply_markup
     )
@@ -67,6 +86,7 @@ async def show_global_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # === ОБРАБОТКА ФОТО (Клиент к API) ===
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.photo: return
+    if not await admit(update): return
     status_msg = await update.message.reply_text("⏳ Анализирую фото через сервер...")
 
     try:
@@ -74,21 +94,19 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         photo_bytes = await photo_file.download_as_bytearray()
         
         # Отправляем на сервер FastAPI
-        files = {'file': ('img.jpg', io.BytesIO(photo_bytes), 'image/jpeg')}
-        # Используем таймаут, чтобы бот не вис
-        response = requests.post(f"{SERVER_URL}/upload", files=files, timeout=60)
+        # mode=binary: сервер отдает сам JPEG, оценки - в заголовках (без base64)
+        # Запрос асинхронный: пока сервер думает, бот обслуживает других пользователей
+        response = await detector.upload_image(photo_bytes, mode="binary", timeout=60, client=client_of(update))
         
         if response.status_code == 200:
-            data = response.json()
-            ai_val = data.get("ai_probability", 0)
+            ai_val = float(response.headers.get("X-AI-Probability", 0))
             if ai_val <= 1.0: ai_val *= 100 # Корректировка процентов
             
             verdict = "⚠️ СКОРЕЕ ВСЕГО ИИ" if ai_val > 50 else "✅ ЭТО ЧЕЛОВЕК"
-            img_b64 = data.get("image_base64")
 
-            if img_b64:
+            if response.content:
                 await update_user_stats(update.effective_user.id)
-                final_img = io.BytesIO(base64.b64decode(img_b64))
+                final_img = io.BytesIO(response.content)
                 await update.message.reply_photo(
                     photo=final_img,
                     caption=f"📊 **Результат:**\nИИ: `{ai_val:.1f}%` \nВердикт: **{verdict}**",
@@ -100,6 +118,48 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception as e:
         await status_msg.edit_text(f"❌ Ошибка соединения: {e}")
 
+# === ОБРАБОТКА ГИФОК И ВИДЕО: сервер проверяет выборку кадров ===
+async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Гифки Telegram присылает как animation (обычно уже перекодированные в MP4)
+    media = update.message.animation or update.message.video or update.message.video_note
+    if media is None: return
+    if media.file_size and media.file_size > MAX_MEDIA_BYTES:
+        await update.message.reply_text("Файл слишком большой: бот может скачать не больше 20 МБ.")
+        return
+    # Ролик - несколько кадров через модель, поэтому дороже фото
+    if not await admit(update, cost=4): return
+    status_msg = await update.message.reply_text("⏳ Проверяю кадры...")
+
+    try:
+        media_file = await media.get_file()
+        media_bytes = await media_file.download_as_bytearray()
+        response = await detector.detect_media(
+            media_bytes,
+            filename=getattr(media, "file_name", None) or "media.mp4",
+            content_type=getattr(media, "mime_type", None) or "video/mp4",
+            client=client_of(update),
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            ai_val = float(data.get("ai_probability", 0)) * 100
+            verdict = "⚠️ СКОРЕЕ ВСЕГО ИИ" if ai_val > 50 else "✅ ЭТО ЧЕЛОВЕК"
+            share = float(data.get("ai_frames_share", 0)) * 100
+            await update_user_stats(update.effective_user.id)
+            await status_msg.edit_text(
+                f"🎞 **Результат по {data.get('frames_analyzed', 0)} кадрам:**\n"
+                f"ИИ: `{ai_val:.1f}%`\n"
+                f"Кадров, похожих на ИИ: `{share:.0f}%`\n"
+                f"Вердикт: **{verdict}**",
+                parse_mode="Markdown"
+            )
+        elif response.status_code == 415:
+            await status_msg.edit_text("❌ Сервер не умеет читать этот формат видео.")
+        else:
+            await status_msg.edit_text(f"❌ Сервер вернул ошибку: {response.status_code}")
+    except Exception as e:
+        await status_msg.edit_text(f"❌ Ошибка соединения: {e}")
+
 # === НОВАЯ ФУНКЦИЯ: ОБРАБОТКА ТЕКСТА (Клиент к API) ===
 async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_text = update.message.text
@@ -115,14 +175,12 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text("Текст слишком короткий для анализа (минимум 10 символов).")
         return
 
+    if not await admit(update): return
     status_msg = await update.message.reply_text("⏳ Читаю текст...")
 
     try:
-        # Формируем JSON для отправки на API
-        payload = {"text": user_text}
-        
         # Стучимся в твой FastAPI (main.py)
-        response = requests.post(f"{SERVER_URL}/detect-text", json=payload, timeout=30)
+        response = await detector.detect_text(user_text, timeout=30, client=client_of(update))
         
         if response.status_code == 200:
             data = response.json()
@@ -148,10 +206,22 @@ async def handle_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 # --- ЗАПУСК ---
 async def post_init(application):
-    await init_db()
+    await stats_store.open()
+
+async def post_shutdown(application):
+    await detector.aclose()
+    await stats_store.close()
 
 def main():
-    app = ApplicationBuilder().token(TOKEN).post_init(post_init).build()
+    # concurrent_updates: апдейты разных пользователей обрабатываются параллельно
+    app = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(int(os.getenv("BOT_CONCURRENT_UPDATES", 64)))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     # Команды
     app.add_handler(CommandHandler("start", start))
@@ -162,6 +232,7 @@ def main():
     
     # Обработчики контента
     app.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    app.add_handler(MessageHandler(filters.ANIMATION | filters.VIDEO | filters.VIDEO_NOTE, handle_media))
     
     # ВАЖНО: Этот хэндлер ловит ВЕСЬ остальной текст и считает его запросом на проверку
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text_message))
@@ -84,7 +84,7 @@ class _HomeScreenState extends State<HomeScreen> with SingleTickerProviderStateM
         setState(() { _selectedImage = File(pickedFile.path); _isLoading = true; });
       }
       try {
-        var request = http.MultipartRequest('POST', Uri.parse('$serverUrl/upload'));
+        var request = http.MultipartRequest('POST', Uri.parse('$serverUrl/upload?mode=scores'));
         request.files.add(http.MultipartFile.fromBytes('file', await pickedFile.readAsBytes(), filename: pickedFile.name));
         var res = await http.Response.fromStream(await request.send());
         if (res.statusCode == 200) {
@@ -2,41 +2,224 @@ from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
+import asyncio
+import random
+import zipfile
 from PIL import Image
 import io
 import os
 import base64
 import json
+import atexit
 from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
 from pathlib import Path
 import uvicorn
 
-try:
-    from utils.watermark import add_watermark
-except ImportError:
-    from utils.watermark import add_watermark
 from model import ai_model 
-from text_model import AITextDetector
+from text_model import AITextDetector, PROCESSING_ERROR
+from utils.batching import BatchScheduler, TextBatchScheduler
+from utils.body_limit import BodyLimitMiddleware
+from utils.cascade import find_ai_markers
+from utils.registry import ModelRegistry
+from utils.executor import BoundedExecutor, Overloaded
+from utils.imaging import ImageTooLarge, decode_for_model, watermark_upload
+from utils.cache import ResultCache, image_key, media_key, text_key
+from utils.media import AGGREGATES, STRATEGIES, UnsupportedMedia, aggregate_scores, media_kind, sample_frames
+from utils.phash import NearDuplicateIndex, phash
+from utils.journal import DetectionJournal
+from utils.upload_store import UploadStore, content_hash
+from utils.responses import SCORE_HEADERS, choose_mode, jpeg_response, multipart_response
+from utils.prefork import bind_socket, bind_unix_socket, memory_usage, serve_prefork
+from utils.admission import (
+    AdmissionController, AdmissionMiddleware, current_client, parse_trusted_proxies, parse_weights,
+)
+from utils.metrics import CONTENT_TYPE, REGISTRY, counter, gauge
+from utils.tracing import RequestMetricsMiddleware, span
+from utils.jobs import FINISHED, PRIORITY_BULK, PRIORITY_INTERACTIVE, PRIORITY_NORMAL, JobRunner, JobStore
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+# LAZY_MODEL_LOADING=1 - модели грузятся только при первом запросе к ним
+LAZY_MODEL_LOADING = os.environ.get("LAZY_MODEL_LOADING", "0") == "1"
+model_loader = ThreadPoolExecutor(max_workers=2, thread_name_prefix="model-loader")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not LAZY_MODEL_LOADING:
+        # Порт открывается сразу, а обе модели грузятся параллельно в фоне
+        for detector in (*model_registry.detectors(), text_detector):
+            if hasattr(detector, "load"):
+                model_loader.submit(detector.load)
+    if phash_index is not None:
+        # Только записи журнала после сохраненной позиции, не весь журнал
+        added = await asyncio.to_thread(phash_index.sync_from_journal, journal)
+        if added:
+            print(f"🔎 В индекс почти-дубликатов добавлено {added} записей из журнала")
+    job_runner.start()
+    yield
+    await job_runner.stop()
+    # Воркер prefork выходит через os._exit, и atexit в нем не срабатывает:
+    # очереди журнала, хранилища загрузок и кэша дописываются здесь
+    await asyncio.to_thread(close_stores)
 
 # 1. Инициализация приложения
-app = FastAPI(title="AI Detector Hub")
+app = FastAPI(title="AI Detector Hub", lifespan=lifespan)
+
+# Лимиты загрузки и размер, до которого картинка декодируется для модели
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 30 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 60_000_000))
+MODEL_INPUT_SIDE = int(os.environ.get("MODEL_INPUT_SIDE", 448))
+# Защита PIL от "бомб": все, что больше, не декодируется вовсе
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Длинные тексты: максимум окон на запрос, перекрытие окон и размер батча окон
+MAX_TEXT_WINDOWS = int(os.environ.get("MAX_TEXT_WINDOWS", 32))
+TEXT_WINDOW_OVERLAP = int(os.environ.get("TEXT_WINDOW_OVERLAP", 64))
+TEXT_WINDOW_BATCH = int(os.environ.get("TEXT_WINDOW_BATCH", 8))
+
+# Пакетные запросы: максимум элементов, общий размер файлов (и распакованных
+# zip) и размер пачки текстов для модели. Каждый файл - не больше MAX_UPLOAD_BYTES
+MAX_BATCH_ITEMS = int(os.environ.get("MAX_BATCH_ITEMS", 1000))
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", 512 * 1024 * 1024))
+TEXT_BATCH_SIZE = int(os.environ.get("TEXT_BATCH_SIZE", 16))
+
+# Тело больше лимита отклоняется 413 на входе, а не после разбора всей формы.
+# Запас BODY_OVERHEAD - на заголовки частей multipart и поля формы
+BODY_OVERHEAD = int(os.environ.get("BODY_OVERHEAD", 1024 * 1024))
+app.add_middleware(
+    BodyLimitMiddleware,
+    limits={
+        **{path: MAX_UPLOAD_BYTES + BODY_OVERHEAD for path in ("/upload", "/detect-media", "/jobs/image")},
+        "/batch/images": MAX_BATCH_BYTES + BODY_OVERHEAD,
+    },
+)
+# ADMISSION=1 - лимит на клиента (X-API-Key, X-Client-Id или IP): ADMISSION_RATE
+# запросов в секунду с запасом ADMISSION_BURST, лишние - 429. По умолчанию выключен.
+# Лимит считается в каждом воркере отдельно: при WORKERS > 1 клиент получает до
+# WORKERS x ADMISSION_RATE. ADMISSION_API_KEYS="ключ:вес,..." - больше лимит и доля
+# в очереди к модели. TRUSTED_PROXIES - от кого принимать X-Client-Id: по умолчанию
+# "unix" (бот через DETECTOR_UDS), для бота по TCP - "127.0.0.1,::1,unix"
+ADMISSION = os.environ.get("ADMISSION", "0") == "1"
+admission = AdmissionController(
+    rate=float(os.environ.get("ADMISSION_RATE", 5)),
+    burst=float(os.environ.get("ADMISSION_BURST", 20)),
+    weights=parse_weights(os.environ.get("ADMISSION_API_KEYS")),
+)
+# Запрос стоит токен на входе; кадры ролика и элементы пакета сверх первого
+# доплачиваются после разбора (charge_work), когда известен объем работы
+ADMISSION_COSTS = {
+    path: 1 for path in (
+        "/upload", "/detect-text", "/detect-media", "/batch/images", "/batch/texts", "/jobs/image", "/jobs/text",
+    )
+} if ADMISSION else {}
+app.add_middleware(
+    AdmissionMiddleware,
+    controller=admission,
+    costs=ADMISSION_COSTS,
+    trusted_proxies=parse_trusted_proxies(os.environ.get("TRUSTED_PROXIES", "unix")),
+)
+
+def charge_work(units):
+    """Доплата клиента токенами за входы модели сверх первого"""
+    if ADMISSION and units > 1:
+        admission.charge(current_client()[0], units - 1)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # Разрешает запросы со всех устройств
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[*SCORE_HEADERS, "Server-Timing"],
+)
+# /metrics и время этапов запроса; TRACING=1 - этапы в заголовке Server-Timing,
+# TRACE_SLOW_MS - печатать разбивку запросов дольше N мс
+app.add_middleware(
+    RequestMetricsMiddleware,
+    tracing=os.environ.get("TRACING", "1") == "1",
+    slow_ms=float(os.environ.get("TRACE_SLOW_MS", 0)),
 )
 text_detector = AITextDetector()
 
+# Микро-батчинг: одновременные запросы /upload идут в модель одним батчем
+def make_image_batcher(batch_fn, name):
+    return BatchScheduler(
+        batch_fn,
+        max_batch_size=int(os.environ.get("BATCH_MAX_SIZE", 8)),
+        max_wait_ms=float(os.environ.get("BATCH_MAX_WAIT_MS", 10)),
+        name=name,
+        max_queue=int(os.environ.get("BATCH_MAX_QUEUE", 64)),
+        retry_after=int(os.environ.get("RETRY_AFTER", 1)),
+    )
+
+image_batcher = make_image_batcher(ai_model.predict_batch, "image")
+
+# Реестр детекторов изображений: "default" - основная модель, остальные модели
+# и ансамбли описываются в JSON-файле MODEL_CONFIG (см. utils/registry.py)
+model_registry = ModelRegistry(make_image_batcher)
+model_registry.register("default", ai_model, image_batcher)
+if os.environ.get("MODEL_CONFIG"):
+    with open(os.environ["MODEL_CONFIG"], "r", encoding="utf-8") as f:
+        model_registry.configure(json.load(f))
+
+# /detect-text: одновременные тексты идут в модель батчами из текстов близкой длины,
+# размер батча ограничен числом токенов с паддингом (TEXT_BATCHING=0 - по одному)
+TEXT_BATCHING = os.environ.get("TEXT_BATCHING", "1") == "1"
+text_batcher = TextBatchScheduler(
+    text_detector.predict_encoded,
+    length_fn=lambda encoding: len(encoding["input_ids"]),
+    max_tokens=int(os.environ.get("TEXT_BATCH_MAX_TOKENS", 4096)),
+    max_batch_size=int(os.environ.get("TEXT_BATCH_MAX_ITEMS", 64)),
+    max_wait_ms=float(os.environ.get("TEXT_BATCH_MAX_WAIT_MS", 5)),
+    name="text",
+    max_queue=int(os.environ.get("TEXT_BATCH_MAX_QUEUE", 256)),
+    retry_after=int(os.environ.get("RETRY_AFTER", 1)),
+)
+
+# CPU-работа (декодирование, водяной знак, JPEG) - в отдельном пуле (thread/process)
+cpu_pool = BoundedExecutor(
+    kind=os.environ.get("WORKER_POOL_KIND", "thread"),
+    workers=int(os.environ.get("WORKER_POOL_SIZE", os.cpu_count() or 1)),
+    max_pending=int(os.environ.get("WORKER_QUEUE_SIZE", 32)),
+    name="cpu",
+    retry_after=int(os.environ.get("RETRY_AFTER", 1)),
+)
+# Модели нельзя передать в другой процесс, поэтому текст всегда идет в потоки
+inference_pool = BoundedExecutor(
+    kind="thread",
+    workers=int(os.environ.get("INFERENCE_THREADS", 2)),
+    max_pending=int(os.environ.get("WORKER_QUEUE_SIZE", 32)),
+    name="inference",
+    retry_after=int(os.environ.get("RETRY_AFTER", 1)),
+)
+
+# GIF и видео: сколько кадров проверять (MEDIA_MAX_FRAMES - предел для параметра
+# frames), как их выбирать и как сводить оценки кадров в оценку ролика
+MEDIA_FRAME_BUDGET = int(os.environ.get("MEDIA_FRAME_BUDGET", 8))
+MEDIA_MAX_FRAMES = int(os.environ.get("MEDIA_MAX_FRAMES", 32))
+MEDIA_SAMPLING = os.environ.get("MEDIA_SAMPLING", "uniform")
+MEDIA_AGGREGATE = os.environ.get("MEDIA_AGGREGATE", "mean")
+
+# Кэш результатов: LRU в памяти + (опционально) SQLite на диске,
+# не больше CACHE_DB_MAX_ENTRIES записей на диске
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", 1024)),
+    ttl=float(os.environ.get("CACHE_TTL", 24 * 3600)),
+    db_path=os.environ.get("CACHE_DB") or None,
+    max_disk_entries=int(os.environ.get("CACHE_DB_MAX_ENTRIES", 100_000)),
+)
+
 BASE_DIR = Path(__file__).parent
 TEMPLATES_DIR = BASE_DIR / "templates"
 STATIC_DIR = BASE_DIR / "static"
-UPLOAD_DIR = BASE_DIR / "uploads"
-LOG_FILE = UPLOAD_DIR / "detections.json"
+UPLOAD_DIR = Path(os.environ.get("UPLOAD_DIR", str(BASE_DIR / "uploads")))
+LOG_FILE = UPLOAD_DIR / "detections.json"  # старый формат, переносится в журнал
+JOURNAL_DIR = UPLOAD_DIR / "journal"
+PHASH_INDEX_FILE = UPLOAD_DIR / "phash_index.jsonl"
 
 for folder in [TEMPLATES_DIR, STATIC_DIR, UPLOAD_DIR]:
     folder.mkdir(exist_ok=True)
@@ -44,86 +227,780 @@ for folder in [TEMPLATES_DIR, STATIC_DIR, UPLOAD_DIR]:
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
+OVERLOADED = counter("detector_overloaded_total", "Запросы, отклоненные из-за перегрузки (503)")
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    OVERLOADED.inc()
+    return JSONResponse(
+        status_code=503,
+        content={"success": False, "detail": "Сервер перегружен, повторите запрос позже"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 class TextRequest(BaseModel):
     text: str
+    # Длинный документ: проверка всех окон по 512 токенов и оценки по фрагментам
+    long_document: bool = False
+
+# Журнал детекций: JSONL только на дозапись, пишется фоновым потоком пачками
+journal = DetectionJournal(
+    JOURNAL_DIR,
+    max_bytes=int(os.environ.get("JOURNAL_MAX_BYTES", 50 * 1024 * 1024)),
+    flush_interval=float(os.environ.get("JOURNAL_FLUSH_INTERVAL", 1.0)),
+    exclude=("image_base64", "segments", "frames"),
+)
+journal.migrate_legacy(LOG_FILE)
+atexit.register(journal.close)
+
+# Хранилище загрузок: файлы по sha256 (дубликаты хранятся один раз), индекс с последним
+# результатом; старше UPLOAD_RETENTION_DAYS и сверх UPLOAD_STORE_MAX_BYTES удаляется
+upload_store = None
+if os.environ.get("UPLOAD_STORE", "1") != "0":
+    upload_store = UploadStore(
+        UPLOAD_DIR / "store",
+        max_bytes=int(os.environ.get("UPLOAD_STORE_MAX_BYTES", 2 * 1024 ** 3)),
+        max_age=float(os.environ.get("UPLOAD_RETENTION_DAYS", 30)) * 24 * 3600,
+        compact_interval=float(os.environ.get("UPLOAD_COMPACT_INTERVAL", 600)),
+    )
+    # Старые плоские загрузки копируются один раз и не удаляются (удалить:
+    # python -m utils.upload_store uploads --delete). При импорте, как и журнал:
+    # в родителе до fork, а не в lifespan каждого воркера
+    upload_store.migrate_legacy(UPLOAD_DIR)
+    atexit.register(upload_store.close)
+
+def close_stores():
+    """Дописывает на диск все, что стоит в очередях фоновых писателей"""
+    journal.close()
+    if upload_store is not None:
+        upload_store.close()
+    result_cache.close()
 
 def log_detection(data: dict):
-    logs = []
-    if LOG_FILE.exists():
-        try:
-            with open(LOG_FILE, "r", encoding="utf-8") as f:
-                logs = json.load(f)
-        except:
-            logs = []
     data["timestamp"] = datetime.now().isoformat()
-    logs.append(data)
-    with open(LOG_FILE, "w", encoding="utf-8") as f:
-        json.dump(logs, f, ensure_ascii=False, indent=2)
+    with span("log"):
+        journal.write(data)
+
+# Индекс почти-дубликатов: пережатые/уменьшенные копии уже проверенных фото
+phash_index = None
+if os.environ.get("PHASH_INDEX", "1") != "0":
+    phash_index = NearDuplicateIndex(
+        PHASH_INDEX_FILE,
+        max_distance=int(os.environ.get("PHASH_MAX_DISTANCE", 4)),
+        model_version=ai_model.model_version,
+    )
 
 @app.get("/")
 async def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+async def read_upload(file: UploadFile) -> bytes:
+    """Читает один файл формы по частям, не больше MAX_UPLOAD_BYTES.
+
+    Форму FastAPI к этому моменту уже разобрал (большие части лежат во
+    временных файлах), поэтому лимит защищает память; слишком большое тело
+    целиком отсекает BodyLimitMiddleware еще до разбора.
+    """
+    chunks = []
+    size = 0
+    while True:
+        chunk = await file.read(1024 * 1024)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(413, detail=f"Файл больше {MAX_UPLOAD_BYTES} байт")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def detect_image(image: Image.Image, model_name: str, contents: Optional[bytes] = None):
+    """Метаданные -> кэш -> индекс почти-дубликатов -> модель. Возвращает (result, phash)"""
+    # Первый этап каскада: явная метка генератора в файле, модель не нужна
+    if ai_model.cascade and model_name == "default" and contents is not None:
+        with span("metadata"):
+            # Функция модуля, а не метод модели: в пуле процессов модель не передать через pickle
+            marker = await cpu_pool.run(find_ai_markers, contents)
+        if marker is not None:
+            result = ai_model.metadata_result(image, marker)
+            if random.random() < ai_model.audit_rate:
+                try:
+                    inference_pool.submit(ai_model.audit_metadata, image, result["ai_probability"])
+                except Overloaded:
+                    pass
+            return result, None
+    with span("cache"):
+        cache_key = await cpu_pool.run(image_key, image, model_registry.version(model_name))
+        result = await result_cache.fetch(cache_key)
+    image_hash = None
+    # Индекс почти-дубликатов хранит оценки только основной модели
+    use_index = phash_index is not None and model_name == "default"
+    if result is None and use_index:
+        with span("phash"):
+            image_hash = await cpu_pool.run(phash, image)
+            match = phash_index.search(image_hash)
+        if match is not None:
+            # Заимствованный вердикт помечается, чтобы не попасть в индекс повторно при синхронизации
+            result = {**match[0], "phash_match": True}
+    if result is None:
+        with span("inference"):
+            result = await model_registry.predict(model_name, image)
+        # Ответ без выпавших по таймауту моделей ансамбля не кэшируем
+        if result["model_version"] != "fallback" and not result.get("partial"):
+            result_cache.put(cache_key, result)
+            if use_index:
+                phash_index.add(image_hash, result)
+    return result, image_hash
+
+async def detect_media(contents: bytes, model_name: str, frames: Optional[int] = None,
+                       strategy: Optional[str] = None, aggregate: Optional[str] = None):
+    """Оценка GIF/видео по выборке кадров. Кадры идут в модель через батчер"""
+    budget = min(max(1, frames or MEDIA_FRAME_BUDGET), MEDIA_MAX_FRAMES)
+    strategy = strategy or MEDIA_SAMPLING
+    aggregate = aggregate or MEDIA_AGGREGATE
+    if strategy not in STRATEGIES or aggregate not in AGGREGATES:
+        raise ValueError(f"strategy: {', '.join(STRATEGIES)}; aggregate: {', '.join(AGGREGATES)}")
+
+    cache_key = media_key(contents, f"{model_registry.version(model_name)}|{budget}|{strategy}|{aggregate}")
+    result = await result_cache.fetch(cache_key)
+    if result is not None:
+        return result
+
+    with span("decode"):
+        sample = await cpu_pool.run(
+            sample_frames, contents, budget, strategy, MODEL_INPUT_SIDE, MAX_IMAGE_PIXELS
+        )
+    frames = sample.pop("frames")
+    charge_work(len(frames))
+    with span("inference"):
+        results = await asyncio.gather(*(model_registry.predict(model_name, f.pop("image")) for f in frames))
+
+    scored = []
+    for frame, frame_result in zip(frames, results):
+        if frame_result["model_version"] == "fallback":
+            frame["error"] = frame_result.get("error", "модель не ответила")
+            continue
+        frame["ai_probability"] = float(frame_result["ai_probability"])
+        scored.append(frame["ai_probability"])
+
+    ai_prob = aggregate_scores(scored, aggregate) if scored else 0.5
+    result = {
+        "real_probability": 1.0 - ai_prob,
+        "ai_probability": ai_prob,
+        "model_version": results[0]["model_version"] if scored else "fallback",
+        "media_kind": sample["kind"],
+        "media_length": sample["length"],
+        "sampling": {"strategy": strategy, "budget": budget, "aggregate": aggregate},
+        "frames_analyzed": len(scored),
+        "ai_frames_share": round(sum(p > 0.5 for p in scored) / len(scored), 4) if scored else 0.0,
+        "frames": frames,
+    }
+    # Кадры, на которых модель упала, делают оценку неполной - такую не кэшируем
+    if len(scored) == len(frames):
+        result_cache.put(cache_key, result)
+    return result
+
+async def analyze_upload(contents: bytes, watermark: bool = True, model: Optional[str] = None):
+    """Проверка загруженной картинки. Возвращает (response_data, jpeg_bytes или None)"""
+    model_name = model_registry.resolve(model)
+    version = model_registry.version(model_name)
+    digest = stored = entry = None
+    if upload_store is not None:
+        # Тот же файл уже проверяли этой моделью - ответ из индекса без декодирования
+        digest = await cpu_pool.run(content_hash, contents)
+        entry = await asyncio.to_thread(upload_store.lookup, digest)
+        if entry is not None and entry["result_version"] == version:
+            stored = entry["result"]
+    animated = stored is None and media_kind(contents) == "animation"
+    if stored is not None:
+        result, image_hash = stored, None
+    elif animated:
+        # Анимация оценивается по выборке кадров, водяной знак - на первом кадре
+        result, image_hash = await detect_media(contents, model_name), None
+    else:
+        # Для модели хватает уменьшенной копии, полный размер нужен только для водяного знака
+        with span("decode"):
+            image = await cpu_pool.run(decode_for_model, contents, MODEL_INPUT_SIDE, MAX_IMAGE_PIXELS)
+        result, image_hash = await detect_image(image, model_name, contents)
+        del image
+
+    # Русский текст для водяного знака
+    is_real = result["real_probability"] >= 0.5
+    watermark_text = "Прошел проверку на AI)" if is_real else "Не прошел проверку на AI!"
+
+    response_data = {
+        "type": "image",
+        "success": True,
+        "real_probability": float(result["real_probability"]),
+        "ai_probability": float(result["ai_probability"]),
+        "watermark": watermark_text,
+        "model_version": result["model_version"],
+        "model": model_name,
+        "phash": f"{image_hash:016x}" if image_hash is not None else None,
+        "sha256": digest,
+    }
+    for field in ("members", "cascade_stage", "provenance", "phash_match", "frames_analyzed", "ai_frames_share", "frames"):
+        if field in result:
+            response_data[field] = result[field]
+
+    # Клиентам, которым картинка не нужна, не тратим время на водяной знак и JPEG
+    jpeg_bytes = None
+    if watermark:
+        with span("watermark"):
+            jpeg_bytes = await cpu_pool.run(watermark_upload, contents, watermark_text, MAX_IMAGE_PIXELS)
+    if upload_store is not None:
+        # Повтор только обновляет время и счетчик в индексе. Результат анимации зависит
+        # от параметров выборки кадров, его в индекс не пишем
+        complete = (stored is None and not animated and result["model_version"] != "fallback"
+                    and not result.get("partial"))
+        upload_store.put(digest, contents, result if complete else None, version if complete else None,
+                         known=entry is not None)
+    log_detection(response_data)
+    return response_data, jpeg_bytes
+
 @app.post("/upload")
-async def upload_image(file: UploadFile = File(...)):
+async def upload_image(request: Request, file: UploadFile = File(...), mode: Optional[str] = None,
+                       model: Optional[str] = None):
     try:
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-
-        result = ai_model.predict(image)
-        
-        # Русский текст для водяного знака
-        is_real = result["real_probability"] >= 0.5
-        watermark_text = "Прошел проверку на AI)" if is_real else "Не прошел проверку на AI!"
-
-        # ВАЖНО: передаем 'image', а не 'img'
-        image_with_wm = add_watermark(image, watermark_text)
-
-        img_io = io.BytesIO()
-        image_with_wm.save(img_io, format="JPEG", quality=95)
-        img_base64 = base64.b64encode(img_io.getvalue()).decode('utf-8')
-
-        response_data = {
-            "type": "image",
-            "success": True,
-            "real_probability": float(result["real_probability"]),
-            "ai_probability": float(result["ai_probability"]),
-            "watermark": watermark_text,
-            "image_base64": img_base64
-        }
-        
-        log_detection(response_data)
+        mode = choose_mode(mode, request.headers.get("accept"))
+        model = model_registry.resolve(model)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(400, detail=e.args[0])
+
+    contents = await read_upload(file)
+    try:
+        response_data, jpeg_bytes = await analyze_upload(contents, watermark=mode != "scores", model=model)
+
+        if mode == "scores":
+            return response_data
+        if mode == "binary":
+            return jpeg_response(jpeg_bytes, response_data)
+        if mode == "multipart":
+            return multipart_response(jpeg_bytes, response_data)
+
+        response_data["image_base64"] = base64.b64encode(jpeg_bytes).decode('utf-8')
         return response_data
+    except Overloaded:
+        raise
+    except (ImageTooLarge, Image.DecompressionBombError) as e:
+        raise HTTPException(413, detail=str(e))
     except Exception as e:
         print(f"❌ Ошибка фото: {e}")
         raise HTTPException(500, detail=str(e))
 
+@app.post("/detect-media")
+async def detect_media_endpoint(file: UploadFile = File(...), model: Optional[str] = None,
+                                frames: Optional[int] = None, strategy: Optional[str] = None,
+                                aggregate: Optional[str] = None):
+    """GIF, короткое видео или картинка: оценка ролика целиком по выборке кадров"""
+    try:
+        model_name = model_registry.resolve(model)
+    except KeyError as e:
+        raise HTTPException(400, detail=e.args[0])
+
+    contents = await read_upload(file)
+    try:
+        result = await detect_media(contents, model_name, frames, strategy, aggregate)
+        if upload_store is not None:
+            digest = await cpu_pool.run(content_hash, contents)
+            known = await asyncio.to_thread(upload_store.lookup, digest) is not None
+            upload_store.put(digest, contents, known=known)
+    except Overloaded:
+        raise
+    except (ImageTooLarge, Image.DecompressionBombError) as e:
+        raise HTTPException(413, detail=str(e))
+    except UnsupportedMedia as e:
+        raise HTTPException(415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+    except Exception as e:
+        print(f"❌ Ошибка видео: {e}")
+        raise HTTPException(500, detail=str(e))
+
+    is_real = result["real_probability"] >= 0.5
+    response_data = {
+        "type": result["media_kind"],
+        "success": True,
+        **result,
+        "is_real": is_real,
+        "watermark": "Прошел проверку на AI)" if is_real else "Не прошел проверку на AI!",
+        "model": model_name,
+    }
+    del response_data["media_kind"]
+    log_detection(response_data)
+    return response_data
+
+async def detect_long_text(text: str):
+    cache_key = text_key(text, f"{text_detector.model_name}|long")
+    result = await result_cache.fetch(cache_key)
+    if result is None:
+        with span("text_inference"):
+            result = await inference_pool.run(
+                text_detector.predict_long, text, MAX_TEXT_WINDOWS, TEXT_WINDOW_OVERLAP, TEXT_WINDOW_BATCH
+            )
+        if text_detector.is_loaded and result["label"] != PROCESSING_ERROR:
+            result_cache.put(cache_key, result)
+    response_data = {
+        "type": "text",
+        "success": True,
+        "ai_score": result["ai_score"],
+        "label": result["label"],
+        "windows_total": result["windows_total"],
+        "windows_used": result["windows_used"],
+        "segments": result["segments"],
+    }
+    log_detection(response_data)
+    return response_data
+
+async def predict_text(text: str):
+    if not TEXT_BATCHING:
+        return await inference_pool.run(text_detector.predict, text)
+    # Токенизация в пуле потоков, модель - общим батчем с другими запросами
+    encoding, error = await inference_pool.run(text_detector.encode, text)
+    if error is not None:
+        return error
+    return await text_batcher.run(encoding)
+
+async def analyze_text(text: str, long_document: bool = False):
+    if long_document:
+        return await detect_long_text(text)
+
+    cache_key = text_key(text, text_detector.model_name)
+    cached = await result_cache.fetch(cache_key)
+    if cached is not None:
+        verdict, score_percent = cached
+    else:
+        with span("text_inference"):
+            verdict, score_percent = await predict_text(text)
+        # Ошибки модели не кэшируем
+        if text_detector.is_loaded and verdict != PROCESSING_ERROR:
+            result_cache.put(cache_key, [verdict, score_percent])
+    response_data = {
+        "type": "text",
+        "success": True,
+        "ai_score": score_percent,
+        "label": verdict
+    }
+    log_detection(response_data)
+    return response_data
+
 @app.post("/detect-text")
 async def detect_text(data: TextRequest):
     try:
-        verdict, score_percent = text_detector.predict(data.text)
-        response_data = {
-            "type": "text",
-            "success": True,
-            "ai_score": score_percent,
-            "label": verdict
-        }
-        log_detection(response_data)
-        return response_data
+        return await analyze_text(data.text, data.long_document)
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"❌ Ошибка текста: {e}")
         return {"success": False, "ai_score": 0.0, "label": "Ошибка"}
 
+def unpack_batch_files(uploads):
+    """Раскрывает zip-архивы в список (имя, байты); обычные файлы - как есть"""
+    items = []
+    total = 0
+    for name, contents in uploads:
+        if name.lower().endswith(".zip") or contents[:4] == b"PK\x03\x04":
+            with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+                for info in archive.infolist():
+                    if info.is_dir():
+                        continue
+                    if len(items) >= MAX_BATCH_ITEMS:
+                        raise HTTPException(413, detail=f"Больше {MAX_BATCH_ITEMS} файлов в пакете")
+                    if info.file_size > MAX_UPLOAD_BYTES:
+                        items.append((info.filename, None))
+                        continue
+                    # Распакованный архив тоже в пределах MAX_BATCH_BYTES
+                    total += info.file_size
+                    if total > MAX_BATCH_BYTES:
+                        raise HTTPException(413, detail=f"Пакет больше {MAX_BATCH_BYTES} байт")
+                    items.append((info.filename, archive.read(info)))
+        else:
+            total += len(contents)
+            if total > MAX_BATCH_BYTES:
+                raise HTTPException(413, detail=f"Пакет больше {MAX_BATCH_BYTES} байт")
+            items.append((name, contents))
+        if len(items) > MAX_BATCH_ITEMS:
+            raise HTTPException(413, detail=f"Больше {MAX_BATCH_ITEMS} файлов в пакете")
+    return items
+
+def ndjson(data: dict) -> bytes:
+    return (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
+
+@app.post("/batch/images")
+async def batch_images(files: List[UploadFile] = File(...), model: Optional[str] = None):
+    """Много картинок (multipart-список и/или zip) - ответ NDJSON по мере готовности"""
+    try:
+        model_name = model_registry.resolve(model)
+    except KeyError as e:
+        raise HTTPException(400, detail=e.args[0])
+    if len(files) > MAX_BATCH_ITEMS:
+        raise HTTPException(413, detail=f"Больше {MAX_BATCH_ITEMS} файлов в пакете")
+    # Лимит MAX_UPLOAD_BYTES - на каждый файл, на весь пакет - MAX_BATCH_BYTES
+    uploads, total = [], 0
+    for i, f in enumerate(files):
+        contents = await read_upload(f)
+        total += len(contents)
+        if total > MAX_BATCH_BYTES:
+            raise HTTPException(413, detail=f"Пакет больше {MAX_BATCH_BYTES} байт")
+        uploads.append((f.filename or f"file{i}", contents))
+    items = await cpu_pool.run(unpack_batch_files, uploads)
+    del uploads
+    charge_work(len(items))
+
+    # Не больше пары батчей модели одновременно: остальное ждет, а не переполняет очереди
+    limit = asyncio.Semaphore(image_batcher.max_batch_size * 2)
+
+    async def process(index, name, contents):
+        async with limit:
+            try:
+                if contents is None:
+                    raise ImageTooLarge(f"Файл больше {MAX_UPLOAD_BYTES} байт")
+                if media_kind(contents) == "animation":
+                    # Как в /upload: анимация оценивается по выборке кадров, а не по первому
+                    result, image_hash = await detect_media(contents, model_name), None
+                else:
+                    image = await cpu_pool.run(decode_for_model, contents, MODEL_INPUT_SIDE, MAX_IMAGE_PIXELS)
+                    result, image_hash = await detect_image(image, model_name, contents)
+                    del image
+                if result["model_version"] == "fallback":
+                    # Заглушка вместо оценки - ошибка элемента, как в /batch/texts
+                    raise RuntimeError(result.get("error") or "Модель не ответила")
+                data = {
+                    "type": "image",
+                    "batch": True,
+                    "success": True,
+                    "real_probability": float(result["real_probability"]),
+                    "ai_probability": float(result["ai_probability"]),
+                    "model_version": result["model_version"],
+                    "model": model_name,
+                    "phash": f"{image_hash:016x}" if image_hash is not None else None,
+                }
+                for field in ("phash_match", "frames_analyzed", "ai_frames_share"):
+                    if field in result:
+                        data[field] = result[field]
+                log_detection(data)
+                return {"index": index, "name": name, **data}
+            except Exception as e:
+                return {"index": index, "name": name, "success": False, "error": str(e) or type(e).__name__}
+
+    async def stream():
+        tasks = [asyncio.ensure_future(process(i, name, data)) for i, (name, data) in enumerate(items)]
+        failed = 0
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            failed += not line["success"]
+            yield ndjson(line)
+        yield ndjson({"done": True, "total": len(tasks), "failed": failed})
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/batch/texts")
+async def batch_texts(request: Request):
+    """JSON-массив строк или {"texts": [...]} - ответ NDJSON по мере готовности пачек"""
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(400, detail="Ожидается JSON")
+    texts = payload.get("texts") if isinstance(payload, dict) else payload
+    if not isinstance(texts, list):
+        raise HTTPException(400, detail="Ожидается массив текстов или {\"texts\": [...]}")
+    if len(texts) > MAX_BATCH_ITEMS:
+        raise HTTPException(413, detail=f"Больше {MAX_BATCH_ITEMS} текстов в пакете")
+
+    def line(index, verdict, score):
+        # Все ошибочные вердикты модели начинаются с "Ошибка"
+        data = {"type": "text", "batch": True, "success": not verdict.startswith("Ошибка"),
+                "ai_score": score, "label": verdict}
+        log_detection(data)
+        return {"index": index, **data}
+
+    # Сначала кэш, остальное - пачками по TEXT_BATCH_SIZE в одном проходе модели
+    ready, pending = [], []
+    # Диск кэша - одним походом в поток на весь батч, а не по запросу на текст
+    keyed = [index for index, text in enumerate(texts) if isinstance(text, str)]
+    found = dict(zip(keyed, await result_cache.fetch_many(
+        [text_key(texts[index], text_detector.model_name) for index in keyed]
+    )))
+    for index, text in enumerate(texts):
+        cached = found.get(index)
+        if cached is not None:
+            ready.append(line(index, *cached))
+        else:
+            pending.append(index)
+
+    charge_work(len(pending))
+    limit = asyncio.Semaphore(inference_pool.workers)
+
+    async def process(chunk):
+        async with limit:
+            try:
+                results = await inference_pool.run(text_detector.predict_batch, [texts[i] for i in chunk], TEXT_BATCH_SIZE)
+            except Exception as e:
+                return [{"index": i, "success": False, "error": str(e) or type(e).__name__} for i in chunk]
+        lines = []
+        for i, (verdict, score) in zip(chunk, results):
+            if text_detector.is_loaded and verdict != PROCESSING_ERROR and isinstance(texts[i], str):
+                result_cache.put(text_key(texts[i], text_detector.model_name), [verdict, score])
+            lines.append(line(i, verdict, score))
+        return lines
+
+    async def stream():
+        failed = 0
+        for item in ready:
+            yield ndjson(item)
+        chunks = [pending[i:i + TEXT_BATCH_SIZE] for i in range(0, len(pending), TEXT_BATCH_SIZE)]
+        tasks = [asyncio.ensure_future(process(chunk)) for chunk in chunks]
+        for next_done in asyncio.as_completed(tasks):
+            for item in await next_done:
+                failed += not item["success"]
+                yield ndjson(item)
+        yield ndjson({"done": True, "total": len(texts), "failed": failed})
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+# --- Асинхронные задачи: ответ сразу с id, результат - опросом или через SSE ---
+
+async def run_image_job(payload: bytes, params: dict):
+    response_data, jpeg_bytes = await analyze_upload(
+        payload, watermark=params.get("watermark", False), model=params.get("model")
+    )
+    if jpeg_bytes is not None:
+        response_data["image_base64"] = base64.b64encode(jpeg_bytes).decode('utf-8')
+    return response_data
+
+async def run_text_job(payload: bytes, params: dict):
+    return await analyze_text(payload.decode("utf-8"), params.get("long_document", False))
+
+JOBS_DB = Path(os.environ.get("JOBS_DB", str(UPLOAD_DIR / "jobs.db")))
+JOB_TTL = float(os.environ.get("JOB_TTL", 3600))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+# Чем больше вход, тем ниже приоритет по умолчанию
+INTERACTIVE_IMAGE_BYTES = 2 * 1024 * 1024
+INTERACTIVE_TEXT_CHARS = 2000
+
+# JOB_LEASE - на сколько секунд задача закрепляется за воркером; пока она
+# выполняется, аренда продлевается, после смерти процесса задачу возьмет другой
+job_store = JobStore(
+    JOBS_DB,
+    lease=float(os.environ.get("JOB_LEASE", 300)),
+    retention=float(os.environ.get("JOB_RETENTION", 24 * 3600)),
+)
+job_runner = JobRunner(
+    job_store,
+    {"image": run_image_job, "text": run_text_job},
+    workers=int(os.environ.get("JOB_WORKERS", 2)),
+)
+
+async def submit_job(kind, payload, params, priority):
+    # SQLite может ждать блокировку другого процесса - не в event loop
+    job_id = await asyncio.to_thread(
+        job_store.submit, kind, payload, params, priority, ttl=JOB_TTL, max_attempts=JOB_MAX_ATTEMPTS
+    )
+    job_runner.notify()
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": "queued", "priority": priority},
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+@app.post("/jobs/image")
+async def submit_image_job(file: UploadFile = File(...), priority: Optional[int] = None,
+                           watermark: bool = False, model: Optional[str] = None):
+    try:
+        model = model_registry.resolve(model)
+    except KeyError as e:
+        raise HTTPException(400, detail=e.args[0])
+    contents = await read_upload(file)
+    if priority is None:
+        priority = PRIORITY_INTERACTIVE if len(contents) <= INTERACTIVE_IMAGE_BYTES else PRIORITY_NORMAL
+    return await submit_job("image", contents, {"watermark": watermark, "model": model}, priority)
+
+@app.post("/jobs/text")
+async def submit_text_job(data: TextRequest, priority: Optional[int] = None):
+    if priority is None:
+        short = len(data.text) <= INTERACTIVE_TEXT_CHARS and not data.long_document
+        priority = PRIORITY_INTERACTIVE if short else PRIORITY_BULK
+    return await submit_job("text", data.text.encode("utf-8"), {"long_document": data.long_document}, priority)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await asyncio.to_thread(job_store.get, job_id)
+    if job is None:
+        raise HTTPException(404, detail="Задача не найдена")
+    return job
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-Sent Events: событие при каждой смене статуса, поток закрывается по завершении"""
+    if await asyncio.to_thread(job_store.get, job_id) is None:
+        raise HTTPException(404, detail="Задача не найдена")
+
+    async def stream():
+        last_status = None
+        while True:
+            job = await asyncio.to_thread(job_store.get, job_id)
+            if job is None:
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield f"event: {last_status}\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if last_status in FINISHED:
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.get("/uploads/{digest}")
+async def get_upload(digest: str):
+    """Прошлая загрузка по sha256 файла: размер, время, число повторов, последний результат"""
+    if upload_store is None:
+        raise HTTPException(404, detail="Хранилище загрузок выключено")
+    if len(digest) != 64 or any(c not in "0123456789abcdefABCDEF" for c in digest):
+        raise HTTPException(400, detail="Нужен sha256 в hex (64 символа)")
+    entry = await asyncio.to_thread(upload_store.lookup, digest)
+    if entry is None:
+        raise HTTPException(404, detail="Такой файл не загружали")
+    return entry
+
 @app.get("/health")
+@app.get("/health/live")
 async def health():
+    # Liveness: процесс жив и обслуживает запросы, даже если модели еще грузятся
     return {"status": "online", "time": datetime.now().isoformat()}
 
+@app.get("/health/ready")
+async def readiness():
+    models = {"image": ai_model.status(), "text": text_detector.status()}
+    models.update({f"image:{name}": status for name, status in model_registry.status().items() if name != "default"})
+    # В ленивом режиме незагруженная модель тоже готова: загрузится на первом запросе
+    ok_states = ("ready", "not_loaded") if LAZY_MODEL_LOADING else ("ready",)
+    ready = all(m["state"] in ok_states for m in models.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "lazy": LAZY_MODEL_LOADING, "models": models},
+    )
+
+@app.get("/models")
+async def list_models():
+    return {
+        "default": model_registry.default,
+        "models": model_registry.status(),
+        "ensembles": {name: members for name, members in model_registry.ensembles.items()},
+    }
+
+@app.get("/stats")
+async def stats():
+    return {
+        "batching": image_batcher.stats(),
+        "text_batching": text_batcher.stats() if TEXT_BATCHING else None,
+        "models": model_registry.stats(),
+        "cascade": ai_model.cascade_stats.stats() if ai_model.cascade else None,
+        "pools": {"cpu": cpu_pool.stats(), "inference": inference_pool.stats()},
+        "admission": admission.stats() if ADMISSION else None,
+        "cache": result_cache.stats(),
+        "phash_index": phash_index.stats() if phash_index is not None else None,
+        "journal": journal.stats(),
+        "jobs": await asyncio.to_thread(job_store.stats),
+        "upload_store": await asyncio.to_thread(upload_store.stats) if upload_store is not None else None,
+        "process": {
+            "pid": os.getpid(),
+            "worker_id": os.environ.get("WORKER_ID"),
+            "memory_mb": memory_usage(),
+        },
+    }
+
+# Метрики, которые уже считают сами компоненты, собираются при каждом запросе /metrics
+def _by_model(field):
+    def collect():
+        batchers = dict(model_registry.stats()["batching"])
+        batchers["text"] = text_batcher.stats()
+        return {(name,): stats[field] for name, stats in batchers.items()}
+    return collect
+
+def _by_pool(field):
+    return lambda: {(name,): pool.stats()[field] for name, pool in (("cpu", cpu_pool), ("inference", inference_pool))}
+
+gauge("detector_batch_queue_depth", "Запросы в очереди батчера", ["model"], fn=_by_model("queue_depth"))
+counter("detector_batch_batches_total", "Батчи, отправленные в модель", ["model"], fn=_by_model("batches"))
+counter("detector_batch_items_total", "Запросы, прошедшие через батчер", ["model"], fn=_by_model("items"))
+counter("detector_batch_rejected_total", "Отказы батчера из-за полной очереди", ["model"], fn=_by_model("rejected"))
+gauge("detector_pool_pending", "Задачи в пуле (в работе и в очереди)", ["pool"], fn=_by_pool("pending"))
+counter("detector_pool_rejected_total", "Отказы пула из-за полной очереди", ["pool"], fn=_by_pool("rejected"))
+counter(
+    "detector_cache_requests_total", "Обращения к кэшу результатов", ["result"],
+    fn=lambda: {(key,): result_cache.stats()[key] for key in ("memory_hits", "disk_hits", "misses")},
+)
+gauge("detector_cache_entries", "Записи кэша в памяти", fn=lambda: result_cache.stats()["entries"])
+counter(
+    "detector_phash_lookups_total", "Поиски в индексе почти-дубликатов", ["result"],
+    fn=lambda: {} if phash_index is None else {
+        ("match",): phash_index.matches, ("miss",): phash_index.lookups - phash_index.matches,
+    },
+)
+gauge("detector_journal_pending", "Записи журнала, ожидающие сброса на диск", fn=lambda: journal.stats()["pending"])
+gauge("detector_jobs", "Фоновые задачи по статусам", ["status"],
+      fn=lambda: {(status,): count for status, count in job_store.stats().items()})
+counter("detector_cascade_total", "Ответы каскада по этапам", ["stage"],
+        fn=lambda: {(stage,): n for stage, n in ai_model.cascade_stats.stats()["by_stage"].items()})
+
+counter("detector_admission_total", "Решения лимита запросов по клиентам", ["result"],
+        fn=lambda: {(result,): admission.stats()[result] for result in ("admitted", "rejected")})
+gauge("detector_admission_clients", "Клиенты с ведром токенов", fn=lambda: admission.stats()["clients"])
+
+UPLOAD_STATS_MAX_AGE = float(os.environ.get("UPLOAD_STATS_MAX_AGE", 5))
+if upload_store is not None:
+    # Оба датчика читают один снимок: одно сканирование индекса на запрос /metrics
+    gauge("detector_upload_store_bytes", "Размер хранилища загрузок",
+          fn=lambda: upload_store.stats(max_age=UPLOAD_STATS_MAX_AGE)["bytes"])
+    gauge("detector_upload_store_entries", "Уникальные файлы в хранилище",
+          fn=lambda: upload_store.stats(max_age=UPLOAD_STATS_MAX_AGE)["entries"])
+    counter("detector_upload_store_duplicates_total", "Повторные загрузки того же файла",
+            fn=lambda: upload_store.duplicates)
+
+@app.get("/metrics")
+async def metrics():
+    # Среди собираемых метрик есть счетчики из SQLite (задачи, хранилище загрузок)
+    return Response(await asyncio.to_thread(REGISTRY.render), media_type=CONTENT_TYPE)
+
+def preload_models():
+    """Загрузка обеих моделей до fork воркеров (параллельно, как в lifespan)"""
+    # Отдельный пул, который завершается до fork: потоки не переживают fork
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="preload") as pool:
+        detectors = [d for d in (*model_registry.detectors(), text_detector) if hasattr(d, "load")]
+        list(pool.map(lambda detector: detector.load(), detectors))
+
 if __name__ == "__main__":
     import subprocess
-    # Это заставит Python запустить файл бота в фоновом режиме
-    subprocess.Popen(["python", "bot.py"]) 
-    
+    import tempfile
+
     # А это запустит твой сервер для Flutter
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    # DETECTOR_UDS - дополнительно слушать Unix-сокет для бота на той же машине.
+    # Бот ходит через него: X-Client-Id от unix-пира принимается по умолчанию,
+    # и у каждого пользователя Telegram свой лимит, а не общий на 127.0.0.1
+    sockets = [bind_socket("0.0.0.0", port)]
+    uds_path = os.environ.setdefault(
+        "DETECTOR_UDS", os.path.join(tempfile.gettempdir(), f"ai-detector-{port}.sock")
+    )
+    sockets.append(bind_unix_socket(uds_path))
+
+    # Это заставит Python запустить файл бота в фоновом режиме
+    # (после bind: бот получает DETECTOR_UDS через окружение и сразу может подключиться)
+    subprocess.Popen(["python", "bot.py"])
+    # WORKERS > 1 - модели грузятся один раз и делятся между воркерами через fork
+    workers = int(os.environ.get("WORKERS", 1))
+    if workers > 1 and ADMISSION:
+        print(f"⚠️ Лимит запросов считается в каждом из {workers} воркеров отдельно: "
+              f"до {workers * admission.rate:g} запросов/с на клиента")
+    if workers > 1:
+        serve_prefork(
+            app, "0.0.0.0", port, workers,
+            preload=preload_models,
+            threads_per_worker=int(os.environ.get("TORCH_THREADS", 0)) or None,
+            sockets=sockets,
+        )
+    else:
+        uvicorn.Server(uvicorn.Config(app)).run(sockets=sockets)
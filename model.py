@@ -1,68 +1,253 @@
-import torch
-from transformers import AutoImageProcessor, AutoModelForImageClassification
 from PIL import Image
-import torch.nn.functional as F
 import gc
+import os
+import random
+import threading
+import time
 from datetime import datetime
 
+from utils.cascade import CascadeStats, find_ai_markers
+from utils.metrics import counter, histogram
+from utils.tracing import span
+
+FORWARD_SECONDS = histogram("detector_model_forward_seconds", "Время прохода модели по батчу", ["model", "stage"])
+FALLBACKS = counter("detector_fallback_total", "Ответы-заглушки из-за ошибки или незагруженной модели", ["model"])
+
 class AIDetectorModel:
-    def __init__(self) -> None:
+    def __init__(self, autoload=False) -> None:
         self.model_version = "v2.0-AutoLoad"
         # Используем эту же модель, но через универсальные инструменты
         self.model_name = "umm-maybe/AI-image-detector"
-        
-        print(f"🚀 Загрузка нейросети {self.model_name}...")
+
+        # torch и веса грузятся в load(): сразу при autoload, в фоне или при первом запросе
+        self.ready = False
+        self.state = "not_loaded"  # not_loaded / loading / ready / failed
+        self.load_error = None
+        self.load_times = {}
+        self._load_lock = threading.Lock()
+
+        # Каскад: дешевый первый этап отвечает на очевидные случаи, полная модель - на остальные.
+        # Этапы: метки генератора в метаданных и (если задана) маленькая модель CASCADE_SCREEN_MODEL
+        self.cascade = os.environ.get("CASCADE", "0") == "1"
+        self.screen_model_name = os.environ.get("CASCADE_SCREEN_MODEL") or None
+        self.screen_ai_index = int(os.environ.get("CASCADE_SCREEN_AI_INDEX", 0))
+        # Ответ маленькой модели принимается, если ai_probability <= low или >= high
+        self.screen_low = float(os.environ.get("CASCADE_LOW", 0.1))
+        self.screen_high = float(os.environ.get("CASCADE_HIGH", 0.9))
+        self.metadata_score = float(os.environ.get("CASCADE_METADATA_SCORE", 0.99))
+        # Доля досрочных ответов, которые перепроверяются полной моделью для оценки дрейфа
+        self.audit_rate = float(os.environ.get("CASCADE_AUDIT_RATE", 0.02))
+        self.screen_backend = None
+        self.cascade_stats = CascadeStats()
+        if self.cascade:
+            self.model_version += f"+cascade:{self.screen_model_name or 'metadata'}"
+
+        if autoload:
+            self.load()
+
+    def load(self):
+        """Загружает модель один раз; параллельные вызовы ждут первую загрузку"""
+        with self._load_lock:
+            if self.state in ("ready", "failed"):
+                return self.ready
+            self.state = "loading"
+            started = time.perf_counter()
+            print(f"🚀 Загрузка нейросети {self.model_name}...")
+            try:
+                phase = time.perf_counter()
+                import torch
+                from transformers import AutoImageProcessor, AutoModelForImageClassification
+                from utils.backends import build_backend, onnx_path_for
+                self.load_times["import"] = round(time.perf_counter() - phase, 3)
+
+                # AutoImageProcessor и AutoModel сами подберут нужный конфиг (Swin/ViT)
+                phase = time.perf_counter()
+                self.processor = AutoImageProcessor.from_pretrained(self.model_name)
+                self.load_times["processor"] = round(time.perf_counter() - phase, 3)
+
+                phase = time.perf_counter()
+                self.model = AutoModelForImageClassification.from_pretrained(
+                    self.model_name,
+                    low_cpu_mem_usage=True,  # Экономит RAM при загрузке
+                    torch_dtype=torch.float32 # Используем стандартный тип для CPU
+                )
+                self.model.eval()
+                self.load_times["weights"] = round(time.perf_counter() - phase, 3)
+
+                # Бэкенд инференса выбирается через IMAGE_BACKEND: torch / int8 / compile / onnx
+                phase = time.perf_counter()
+                example = self.processor(images=Image.new("RGB", (224, 224)), return_tensors="pt")
+                self.backend = build_backend(
+                    os.environ.get("IMAGE_BACKEND", "torch"),
+                    self.model,
+                    dict(example),
+                    onnx_path=onnx_path_for(self.model_name),
+                    dynamic_axes={"pixel_values": {0: "batch"}},
+                    tolerance=float(os.environ.get("BACKEND_PARITY_TOLERANCE", 0.02)),
+                )
+                self.load_times["backend"] = round(time.perf_counter() - phase, 3)
+
+                if self.cascade and self.screen_model_name:
+                    phase = time.perf_counter()
+                    self._load_screen()
+                    self.load_times["screen"] = round(time.perf_counter() - phase, 3)
+                self.ready = True
+                self.state = "ready"
+                print("✅ Модель успешно загружена и готова!")
+            except Exception as e:
+                print(f"❌ Ошибка загрузки: {e}")
+                self.ready = False
+                self.state = "failed"
+                self.load_error = str(e)
+            self.load_times["total"] = round(time.perf_counter() - started, 3)
+            return self.ready
+
+    def _load_screen(self):
+        # Без маленькой модели каскад работает только по метаданным, основная модель не страдает
         try:
-            # AutoImageProcessor и AutoModel сами подберут нужный конфиг (Swin/ViT)
-            self.processor = AutoImageProcessor.from_pretrained(self.model_name)
-            self.model = AutoModelForImageClassification.from_pretrained(
-                self.model_name,
-                low_cpu_mem_usage=True,  # Экономит RAM при загрузке
-                torch_dtype=torch.float32 # Используем стандартный тип для CPU
-)
-            self.model.eval()
-            self.ready = True
-            print("✅ Модель успешно загружена и готова!")
+            from transformers import AutoImageProcessor, AutoModelForImageClassification
+            from utils.backends import build_backend, onnx_path_for
+
+            self.screen_processor = AutoImageProcessor.from_pretrained(self.screen_model_name)
+            screen_model = AutoModelForImageClassification.from_pretrained(self.screen_model_name)
+            screen_model.eval()
+            example = self.screen_processor(images=Image.new("RGB", (224, 224)), return_tensors="pt")
+            self.screen_backend = build_backend(
+                os.environ.get("CASCADE_SCREEN_BACKEND", "torch"),
+                screen_model,
+                dict(example),
+                onnx_path=onnx_path_for(self.screen_model_name),
+                dynamic_axes={"pixel_values": {0: "batch"}},
+                tolerance=float(os.environ.get("BACKEND_PARITY_TOLERANCE", 0.02)),
+            )
+            print(f"✅ Модель первого этапа {self.screen_model_name} готова")
         except Exception as e:
-            print(f"❌ Ошибка загрузки: {e}")
-            self.ready = False
+            print(f"⚠️ Модель первого этапа не загружена, каскад только по метаданным: {e}")
+            self.screen_backend = None
+
+    def status(self):
+        return {
+            "model": self.model_name,
+            "version": self.model_version,
+            "state": self.state,
+            "load_times": self.load_times,
+            "error": self.load_error,
+        }
 
     def predict(self, image: Image.Image):
+        return self.predict_batch([image])[0]
+
+    def predict_batch(self, images):
+        """Анализ нескольких изображений одним проходом модели"""
         if not self.ready:
-            return self.fallback(image, "Модель не была загружена")
+            self.load()
+        if not self.ready:
+            return [self.fallback(image, "Модель не была загружена") for image in images]
+
+        images = [image if image.mode == "RGB" else image.convert("RGB") for image in images]
+        if self.screen_backend is not None:
+            return self._predict_cascade(images)
+        results = self._predict_full(images)
+        if self.cascade:
+            self.cascade_stats.record("full", len(images))
+        return results
 
+    def _predict_full(self, images):
         try:
             gc.collect()
-            if image.mode != "RGB":
-                image = image.convert("RGB")
-            
-            inputs = self.processor(images=image, return_tensors="pt")
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                logits = outputs.logits
+            with span("preprocess"):
+                inputs = self.processor(images=images, return_tensors="pt")
+            with FORWARD_SECONDS.time(model=self.model_name, stage="full"):
+                logits = self.backend(inputs)
 
+            import torch.nn.functional as F
             probs = F.softmax(logits, dim=-1)
-            
-            # Классы модели: 0 - AI, 1 - Real
-            ai_prob = float(probs[0][0])
-            real_prob = float(probs[0][1])
-
-            return {
-                'real_probability': real_prob,
-                'ai_probability': ai_prob,
-                'is_real': real_prob > 0.5,
-                'confidence': max(ai_prob, real_prob),
-                'width': image.width,
-                'height': image.height,
-                'image_size': f"{image.width}x{image.height}",
-                'watermark': "Прошло проверку" if real_prob > 0.5 else "AI Генерация",
-                'model_version': self.model_version
-            }
+            return [self._build_result(image, *self._scores(p)) for image, p in zip(images, probs)]
         except Exception as e:
+            if len(images) > 1:
+                # Одна битая картинка не должна давать заглушку всему батчу
+                print(f"⚠️ Ошибка на батче из {len(images)}, проверяем по одной: {e}")
+                return [result for image in images for result in self._predict_full([image])]
             print(f"❌ Ошибка при анализе: {e}")
-            return self.fallback(image, str(e))
+            return [self.fallback(image, str(e)) for image in images]
+
+    def _predict_cascade(self, images):
+        """Маленькая модель на всем батче, полная - только на неуверенных и на выборке для аудита"""
+        try:
+            import torch.nn.functional as F
+            inputs = self.screen_processor(images=images, return_tensors="pt")
+            with FORWARD_SECONDS.time(model=self.screen_model_name, stage="screen"):
+                logits = self.screen_backend(inputs)
+            screen = F.softmax(logits, dim=-1)[:, self.screen_ai_index].tolist()
+        except Exception as e:
+            print(f"⚠️ Ошибка первого этапа, все идет в полную модель: {e}")
+            screen = [None] * len(images)
+
+        results = [None] * len(images)
+        escalate, audit = [], []
+        for i, ai_prob in enumerate(screen):
+            if ai_prob is not None and (ai_prob <= self.screen_low or ai_prob >= self.screen_high):
+                results[i] = self._build_result(images[i], ai_prob, 1.0 - ai_prob)
+                results[i]["cascade_stage"] = "screen"
+                if random.random() < self.audit_rate:
+                    audit.append(i)
+            else:
+                escalate.append(i)
+        self.cascade_stats.record("screen", len(images) - len(escalate))
+        self.cascade_stats.record("full", len(escalate))
+
+        # Аудит едет в том же проходе полной модели, что и неуверенные картинки
+        full_indices = escalate + audit
+        if full_indices:
+            full = self._predict_full([images[i] for i in full_indices])
+            for i, result in zip(full_indices, full):
+                if results[i] is None:
+                    result["cascade_stage"] = "full"
+                    results[i] = result
+                elif result["model_version"] != "fallback":
+                    self.cascade_stats.audit("screen", results[i]["ai_probability"], result["ai_probability"])
+        return results
+
+    def screen_metadata(self, contents: bytes):
+        """Первый этап каскада по сырому файлу: метка генератора или None"""
+        return find_ai_markers(contents) if self.cascade else None
+
+    def metadata_result(self, image, marker):
+        self.cascade_stats.record("metadata")
+        result = self._build_result(image, self.metadata_score, 1.0 - self.metadata_score)
+        result["cascade_stage"] = "metadata"
+        result["provenance"] = marker
+        return result
+
+    def audit_metadata(self, image, early_ai):
+        """Перепроверка досрочного ответа по метаданным полной моделью"""
+        if not self.ready:
+            return
+        image = image if image.mode == "RGB" else image.convert("RGB")
+        result = self._predict_full([image])[0]
+        if result["model_version"] != "fallback":
+            self.cascade_stats.audit("metadata", early_ai, result["ai_probability"])
+
+    def _scores(self, probs):
+        """(ai_prob, real_prob) из вероятностей классов одного изображения"""
+        # Классы модели: 0 - AI, 1 - Real
+        return float(probs[0]), float(probs[1])
+
+    def _build_result(self, image, ai_prob, real_prob):
+        return {
+            'real_probability': real_prob,
+            'ai_probability': ai_prob,
+            'is_real': real_prob > 0.5,
+            'confidence': max(ai_prob, real_prob),
+            'width': image.width,
+            'height': image.height,
+            'image_size': f"{image.width}x{image.height}",
+            'watermark': "Прошло проверку" if real_prob > 0.5 else "AI Генерация",
+            'model_version': self.model_version
+        }
 
     def fallback(self, image, error_msg):
+        FALLBACKS.inc(model=self.model_name)
         return {
             'real_probability': 0.5, 'ai_probability': 0.5,
             'is_real': True, 'confidence': 0.0,
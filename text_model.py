@@ -1,40 +1,114 @@
-import torch
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
-import torch.nn.functional as F
 import logging
+import os
+import threading
+import time
+
+from utils.metrics import counter, histogram
 
 # Настройка логирования, чтобы видеть ошибки в консоли
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Вердикт при сбое инференса (такие ответы не кэшируются)
+PROCESSING_ERROR = "Ошибка при обработке"
+
+FORWARD_SECONDS = histogram("detector_model_forward_seconds", "Время прохода модели по батчу", ["model", "stage"])
+FALLBACKS = counter("detector_fallback_total", "Ответы-заглушки из-за ошибки или незагруженной модели", ["model"])
+
+def _softmax(logits):
+    # torch импортируется лениво, вместе с загрузкой модели
+    import torch.nn.functional as F
+    return F.softmax(logits.float(), dim=-1)
+
 class AITextDetector:
-    def __init__(self):
+    def __init__(self, autoload=False):
         self.model_name = "Hello-SimpleAI/chatgpt-detector-roberta"
         self.is_loaded = False
-        
-        logger.info(f"🔄 Загрузка модели: {self.model_name}...")
-        try:
-            # Выбор устройства: GPU (cuda), Apple Silicon (mps) или CPU
-            if torch.cuda.is_available():
-                self.device = torch.device("cuda")
-            elif torch.backends.mps.is_available():
-                self.device = torch.device("mps") # Для Mac M1/M2
-            else:
-                self.device = torch.device("cpu")
-            
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-            self.model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
-            
-            self.model.to(self.device)
-            self.model.eval()
-            
-            logger.info(f"✅ Модель загружена на устройстве: {self.device}")
-            self.is_loaded = True
-        except Exception as e:
-            logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА ЗАГРУЗКИ: {e}")
-            self.is_loaded = False
 
-    def predict(self, text):
+        # torch и веса грузятся в load(): сразу при autoload, в фоне или при первом запросе
+        self.state = "not_loaded"  # not_loaded / loading / ready / failed
+        self.load_error = None
+        self.load_times = {}
+        self._load_lock = threading.Lock()
+        if autoload:
+            self.load()
+
+    def load(self):
+        """Загружает модель один раз; параллельные вызовы ждут первую загрузку"""
+        with self._load_lock:
+            if self.state in ("ready", "failed"):
+                return self.is_loaded
+            self.state = "loading"
+            started = time.perf_counter()
+            logger.info(f"🔄 Загрузка модели: {self.model_name}...")
+            try:
+                phase = time.perf_counter()
+                import torch
+                from transformers import AutoTokenizer, AutoModelForSequenceClassification
+                from utils.backends import build_backend, onnx_path_for
+                self.load_times["import"] = round(time.perf_counter() - phase, 3)
+
+                # Выбор устройства: GPU (cuda), Apple Silicon (mps) или CPU
+                if torch.cuda.is_available():
+                    self.device = torch.device("cuda")
+                elif torch.backends.mps.is_available():
+                    self.device = torch.device("mps") # Для Mac M1/M2
+                else:
+                    self.device = torch.device("cpu")
+
+                phase = time.perf_counter()
+                self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self.load_times["tokenizer"] = round(time.perf_counter() - phase, 3)
+
+                phase = time.perf_counter()
+                self.model = AutoModelForSequenceClassification.from_pretrained(self.model_name)
+                self.model.to(self.device)
+                self.model.eval()
+                self.load_times["weights"] = round(time.perf_counter() - phase, 3)
+
+                # Бэкенд инференса выбирается через TEXT_BACKEND: torch / int8 / compile / onnx
+                phase = time.perf_counter()
+                example = self.tokenizer(
+                    "Пример текста для проверки бэкенда.", return_tensors="pt"
+                ).to(self.device)
+                self.backend = build_backend(
+                    os.environ.get("TEXT_BACKEND", "torch"),
+                    self.model,
+                    dict(example),
+                    onnx_path=onnx_path_for(self.model_name),
+                    dynamic_axes={
+                        name: {0: "batch", 1: "sequence"} for name in example.keys()
+                    },
+                    tolerance=float(os.environ.get("BACKEND_PARITY_TOLERANCE", 0.02)),
+                    device=self.device,
+                )
+                self.load_times["backend"] = round(time.perf_counter() - phase, 3)
+
+                logger.info(f"✅ Модель загружена на устройстве: {self.device}")
+                self.is_loaded = True
+                self.state = "ready"
+            except Exception as e:
+                logger.error(f"❌ КРИТИЧЕСКАЯ ОШИБКА ЗАГРУЗКИ: {e}")
+                self.is_loaded = False
+                self.state = "failed"
+                self.load_error = str(e)
+            self.load_times["total"] = round(time.perf_counter() - started, 3)
+            return self.is_loaded
+
+    def status(self):
+        return {
+            "model": self.model_name,
+            "version": self.model_name,
+            "state": self.state,
+            "load_times": self.load_times,
+            "error": self.load_error,
+        }
+
+    def _validate(self, text):
+        """Возвращает (вердикт, 0.0) с ошибкой или None, если текст можно проверять"""
+        # Ленивая загрузка при первом запросе
+        if not self.is_loaded:
+            self.load()
         if not self.is_loaded:
             return "Ошибка: Модель не загружена", 0.0
 
@@ -44,6 +118,21 @@ class AITextDetector:
 
         if len(text.strip()) < 10:
             return "Текст слишком короткий (нужно > 10 символов)", 0.0
+        return None
+
+    @staticmethod
+    def _verdict(ai_probability):
+        # Формируем вердикт
+        if ai_probability > 80:
+            return "🤖 Это точно ИИ"
+        elif ai_probability > 50:
+            return "🤖 Скорее всего ИИ"
+        return "👤 Текст написал человек"
+
+    def predict(self, text):
+        error = self._validate(text)
+        if error:
+            return error
 
         try:
             # Токенизация
@@ -54,26 +143,155 @@ class AITextDetector:
                 max_length=512
             ).to(self.device)
 
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                logits = outputs.logits
+            with FORWARD_SECONDS.time(model=self.model_name, stage="text"):
+                logits = self.backend(inputs)
             
             # Получение вероятностей
-            probabilities = F.softmax(logits, dim=-1)
+            probabilities = _softmax(logits)
             
             # В этой модели индекс 1 - это AI, индекс 0 - Human
             ai_probability = probabilities[0][1].item() * 100
-            
-            # Формируем вердикт
-            if ai_probability > 80:
-                verdict = "🤖 Это точно ИИ"
-            elif ai_probability > 50:
-                verdict = "🤖 Скорее всего ИИ"
-            else:
-                verdict = "👤 Текст написал человек"
-                
-            return verdict, round(ai_probability, 1)
+            return self._verdict(ai_probability), round(ai_probability, 1)
 
         except Exception as e:
             logger.error(f"Ошибка анализа текста: {e}")
-            return "Ошибка при обработке", 0.0
\ No newline at end of file
+            FALLBACKS.inc(model=self.model_name)
+            return PROCESSING_ERROR, 0.0
+
+    def predict_batch(self, texts, batch_size=16):
+        """Проверка нескольких текстов: валидные идут в модель батчами с паддингом.
+
+        Возвращает список (вердикт, процент) в том же порядке, что и texts.
+        """
+        results = [self._validate(text) for text in texts]
+        pending = [i for i, result in enumerate(results) if result is None]
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            try:
+                inputs = self.tokenizer(
+                    [texts[i] for i in chunk],
+                    return_tensors="pt",
+                    truncation=True,
+                    max_length=512,
+                    padding=True,
+                ).to(self.device)
+                with FORWARD_SECONDS.time(model=self.model_name, stage="text_batch"):
+                    logits = self.backend(inputs)
+                probabilities = _softmax(logits)[:, 1].tolist()
+                for i, prob in zip(chunk, probabilities):
+                    ai_probability = prob * 100
+                    results[i] = (self._verdict(ai_probability), round(ai_probability, 1))
+            except Exception as e:
+                logger.error(f"Ошибка анализа пачки текстов: {e}")
+                FALLBACKS.inc(len(chunk), model=self.model_name)
+                for i in chunk:
+                    results[i] = (PROCESSING_ERROR, 0.0)
+        return results
+
+    def encode(self, text):
+        """Проверка и токенизация без паддинга для TextBatchScheduler.
+
+        Возвращает (encoding, None) или (None, (вердикт, 0.0)), если текст
+        не нужно отправлять в модель.
+        """
+        error = self._validate(text)
+        if error:
+            return None, error
+        encoding = self.tokenizer(text, truncation=True, max_length=512)
+        return {name: encoding[name] for name in self.tokenizer.model_input_names if name in encoding}, None
+
+    def predict_encoded(self, encodings):
+        """Прогон текстов из encode одним батчем с паддингом до самого длинного.
+
+        Возвращает список (вердикт, процент), как predict для каждого текста.
+        """
+        try:
+            inputs = self.tokenizer.pad(encodings, return_tensors="pt").to(self.device)
+            with FORWARD_SECONDS.time(model=self.model_name, stage="text_batch"):
+                logits = self.backend(inputs)
+            probabilities = _softmax(logits)[:, 1].tolist()
+            return [(self._verdict(prob * 100), round(prob * 100, 1)) for prob in probabilities]
+        except Exception as e:
+            logger.error(f"Ошибка анализа пачки текстов: {e}")
+            FALLBACKS.inc(len(encodings), model=self.model_name)
+            return [(PROCESSING_ERROR, 0.0)] * len(encodings)
+
+    def predict_long(self, text, max_windows=32, overlap=64, batch_size=8):
+        """Проверка длинного документа целиком, а не только первых 512 токенов.
+
+        Текст токенизируется один раз и режется на перекрывающиеся окна по
+        512 токенов (overlap токенов перекрытия). Окна прогоняются батчами по
+        batch_size, так что время растет с числом батчей, а не окон. Если окон
+        больше max_windows, берутся равномерно распределенные по тексту.
+        Возвращает оценку документа и оценки каждого фрагмента с позициями
+        в исходном тексте.
+        """
+        error = self._validate(text)
+        if error:
+            return {"label": error[0], "ai_score": error[1], "segments": [],
+                    "windows_total": 0, "windows_used": 0}
+
+        try:
+            encoded = self.tokenizer(
+                text,
+                return_tensors="pt",
+                truncation=True,
+                max_length=512,
+                stride=overlap,
+                padding=True,
+                return_overflowing_tokens=True,
+                return_offsets_mapping=True,
+            )
+            total = encoded["input_ids"].shape[0]
+            if total > max_windows:
+                step = (total - 1) / (max_windows - 1) if max_windows > 1 else 0
+                selected = sorted({round(i * step) for i in range(max_windows)})
+            else:
+                selected = list(range(total))
+
+            model_inputs = {
+                name: encoded[name][selected]
+                for name in self.tokenizer.model_input_names if name in encoded
+            }
+            probabilities = []
+            for start in range(0, len(selected), batch_size):
+                batch = {name: t[start:start + batch_size].to(self.device) for name, t in model_inputs.items()}
+                with FORWARD_SECONDS.time(model=self.model_name, stage="text_long"):
+                    logits = self.backend(batch)
+                probabilities.extend(_softmax(logits)[:, 1].tolist())
+
+            segments = []
+            weighted, weights = 0.0, 0
+            for row, prob in zip(selected, probabilities):
+                mask = encoded["attention_mask"][row]
+                spans = [
+                    (int(a), int(b)) for (a, b), m in zip(encoded["offset_mapping"][row].tolist(), mask.tolist())
+                    if m and b > a
+                ]
+                char_start = spans[0][0] if spans else 0
+                char_end = spans[-1][1] if spans else 0
+                score = prob * 100
+                segments.append({
+                    "start": char_start,
+                    "end": char_end,
+                    "ai_score": round(score, 1),
+                    "label": self._verdict(score),
+                    "preview": text[char_start:char_end][:80],
+                })
+                weighted += score * len(spans)
+                weights += len(spans)
+
+            ai_probability = weighted / weights if weights else 0.0
+            return {
+                "label": self._verdict(ai_probability),
+                "ai_score": round(ai_probability, 1),
+                "segments": segments,
+                "windows_total": total,
+                "windows_used": len(selected),
+            }
+
+        except Exception as e:
+            logger.error(f"Ошибка анализа длинного текста: {e}")
+            FALLBACKS.inc(model=self.model_name)
+            return {"label": PROCESSING_ERROR, "ai_score": 0.0, "segments": [],
+                    "windows_total": 0, "windows_used": 0}
@@ -0,0 +1,226 @@
+import contextvars
+import hashlib
+import ipaddress
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Клиент текущего запроса и его вес: по ним BatchScheduler делит очередь к модели
+_client = contextvars.ContextVar("detector_client", default=(None, 1.0))
+
+# Пир без адреса - соединение через Unix-сокет
+UNIX_PEER = "unix"
+
+
+def current_client():
+    """(id клиента, вес) текущего запроса или (None, 1.0) вне запроса"""
+    return _client.get()
+
+
+def api_key_client(key) -> str:
+    # Сам ключ не попадает ни в статистику, ни в логи
+    if isinstance(key, str):
+        key = key.encode()
+    return "key:" + hashlib.sha256(key).hexdigest()[:16]
+
+
+def parse_trusted_proxies(spec):
+    """'127.0.0.1,10.0.0.0/8,unix' -> список сетей и/или UNIX_PEER"""
+    trusted = []
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        trusted.append(UNIX_PEER if part == UNIX_PEER else ipaddress.ip_network(part, strict=False))
+    return trusted
+
+
+def _is_trusted(host, trusted_proxies):
+    if host is None:
+        return UNIX_PEER in trusted_proxies
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(net != UNIX_PEER and address in net for net in trusted_proxies)
+
+
+def client_id(scope, trusted_proxies=()) -> str:
+    """Ключ клиента: X-API-Key, X-Client-Id (tg:<id> от бота) или IP.
+
+    X-Client-Id принимается только от пиров из trusted_proxies (см.
+    parse_trusted_proxies): иначе любой клиент за тем же прокси мог бы
+    выдать себя за другого и уйти от своего лимита.
+    """
+    headers = dict(scope.get("headers") or ())
+    key = headers.get(b"x-api-key")
+    if key:
+        return api_key_client(key)
+    peer = scope.get("client")
+    host = peer[0] if peer else None
+    forwarded = headers.get(b"x-client-id")
+    if forwarded and _is_trusted(host, trusted_proxies):
+        return forwarded.decode("latin-1")[:64]
+    return f"ip:{host or 'local'}"
+
+
+def parse_weights(spec):
+    """'ключ:вес,ключ:вес' (API-ключи) -> {id клиента: вес}"""
+    weights = {}
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        key, _, weight = part.rpartition(":")
+        weights[api_key_client(key)] = float(weight)
+    return weights
+
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst про запас"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost, now):
+        """0.0, если токены списаны, иначе через сколько секунд их хватит"""
+        self._refill(now)
+        cost = min(cost, self.burst)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def charge(self, cost, now):
+        """Списывает cost без отказа; долг - не больше burst"""
+        self._refill(now)
+        self.tokens = max(-self.burst, self.tokens - cost)
+
+
+class AdmissionController:
+    """Лимит запросов на клиента: свой TokenBucket на каждый ключ.
+
+    Вес клиента (weights) умножает и скорость, и запас, и его долю в
+    очереди к модели. Храним не больше max_clients ведер: давно не
+    появлявшиеся клиенты вытесняются (их ведро все равно уже полное).
+
+    Ведра живут в памяти процесса: при WORKERS > 1 у каждого воркера свои,
+    и клиент, чьи соединения попали к разным воркерам, получает до
+    WORKERS x rate. Лимит задается с учетом этого.
+    """
+
+    def __init__(self, rate=5.0, burst=20.0, weights=None, max_clients=50_000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.weights = dict(weights or {})
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._admitted = 0
+        self._rejected = 0
+        self._charged = 0.0
+        self._rejected_by_client = {}
+
+    def weight(self, client):
+        return self.weights.get(client, 1.0)
+
+    def _bucket(self, client, now):
+        # Вызывается под self._lock
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            weight = self.weight(client)
+            bucket = self._buckets[client] = TokenBucket(self.rate * weight, self.burst * weight, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        return bucket
+
+    def charge(self, client, cost):
+        """Доплата за работу, объем которой стал известен после приема запроса.
+
+        Текущий запрос не отклоняется, но следующие ждут, пока долг не погасится.
+        """
+        if client is None or cost <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._bucket(client, now).charge(cost, now)
+            self._charged += cost
+
+    def admit(self, client, cost=1.0):
+        """0.0 - запрос принят, иначе Retry-After в секундах"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(client, now)
+            wait = bucket.take(cost, now)
+            if wait:
+                self._rejected += 1
+                self._rejected_by_client[client] = self._rejected_by_client.get(client, 0) + 1
+                if len(self._rejected_by_client) > 1000:
+                    self._rejected_by_client.clear()
+            else:
+                self._admitted += 1
+            return wait
+
+    def stats(self):
+        with self._lock:
+            top = sorted(self._rejected_by_client.items(), key=lambda kv: -kv[1])[:10]
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "clients": len(self._buckets),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "charged": self._charged,
+                "top_rejected": dict(top),
+            }
+
+
+class AdmissionMiddleware:
+    """ASGI-middleware: 429 до чтения тела запроса, если у клиента кончились токены.
+
+    costs - {путь: цена в токенах}; остальные пути не ограничиваются, но
+    клиент запоминается в контексте для справедливой очереди к модели.
+    trusted_proxies - от кого принимать X-Client-Id (см. client_id).
+    """
+
+    def __init__(self, app, controller: AdmissionController, costs, trusted_proxies=()):
+        self.app = app
+        self.controller = controller
+        self.costs = costs
+        self.trusted_proxies = trusted_proxies
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        client = client_id(scope, self.trusted_proxies)
+        token = _client.set((client, self.controller.weight(client)))
+        try:
+            cost = self.costs.get(scope["path"]) if scope["method"] != "OPTIONS" else None
+            wait = self.controller.admit(client, cost) if cost else 0.0
+            if wait:
+                body = json.dumps(
+                    {"success": False, "detail": "Слишком много запросов, повторите позже"},
+                    ensure_ascii=False,
+                ).encode()
+                await send({
+                    "type": "http.response.start",
+                    "status": 429,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"content-length", str(len(body)).encode()),
+                        (b"retry-after", str(max(1, math.ceil(wait))).encode()),
+                    ],
+                })
+                await send({"type": "http.response.body", "body": body})
+                return
+            await self.app(scope, receive, send)
+        finally:
+            _client.reset(token)
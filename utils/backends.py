@@ -0,0 +1,139 @@
+import os
+import time
+from pathlib import Path
+
+import torch
+import torch.nn.functional as F
+
+# torch   - обычный eager float32 (эталон)
+# int8    - динамическая int8-квантизация Linear-слоев (только CPU)
+# compile - torch.compile
+# onnx    - экспорт в ONNX и запуск через ONNX Runtime (нужен пакет onnxruntime)
+BACKENDS = ("torch", "int8", "compile", "onnx")
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model):
+        self.model = model
+
+    def __call__(self, inputs) -> torch.Tensor:
+        """Принимает вход процессора/токенизатора, возвращает logits"""
+        with torch.no_grad():
+            return self.model(**inputs).logits
+
+
+class Int8Backend(TorchBackend):
+    name = "int8"
+
+    def __init__(self, model):
+        quantized = torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        super().__init__(quantized)
+
+
+class CompileBackend(TorchBackend):
+    name = "compile"
+
+    def __init__(self, model):
+        # dynamic=True - чтобы не перекомпилировать на каждый размер батча
+        super().__init__(torch.compile(model, dynamic=True))
+
+
+class _LogitsOnly(torch.nn.Module):
+    # Экспортеру ONNX нужны позиционные тензоры на входе и тензор на выходе
+    def __init__(self, model, input_names):
+        super().__init__()
+        self.model = model
+        self.input_names = input_names
+
+    def forward(self, *tensors):
+        return self.model(**dict(zip(self.input_names, tensors))).logits
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model, example_inputs, onnx_path, dynamic_axes):
+        import onnxruntime as ort
+
+        self.input_names = list(example_inputs.keys())
+        onnx_path = Path(onnx_path)
+        if not onnx_path.exists():
+            onnx_path.parent.mkdir(parents=True, exist_ok=True)
+            print(f"📦 Экспорт в ONNX: {onnx_path}...")
+            export_kwargs = dict(
+                input_names=self.input_names,
+                output_names=["logits"],
+                dynamic_axes={**dynamic_axes, "logits": {0: "batch"}},
+                opset_version=17,
+            )
+            wrapper = _LogitsOnly(model, self.input_names).eval()
+            args = tuple(example_inputs[name] for name in self.input_names)
+            try:
+                torch.onnx.export(wrapper, args, str(onnx_path), dynamo=False, **export_kwargs)
+            except TypeError:
+                # Старые версии torch не знают параметр dynamo
+                torch.onnx.export(wrapper, args, str(onnx_path), **export_kwargs)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(onnx_path), options, providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, inputs) -> torch.Tensor:
+        feed = {name: inputs[name].cpu().numpy() for name in self.input_names}
+        logits = self.session.run(["logits"], feed)[0]
+        return torch.from_numpy(logits)
+
+
+def check_parity(reference, candidate, inputs):
+    """Максимальное расхождение вероятностей кандидата с эталоном float32"""
+    expected = F.softmax(reference(inputs).float(), dim=-1)
+    actual = F.softmax(candidate(inputs).float().to(expected.device), dim=-1)
+    return float((expected - actual).abs().max())
+
+
+def build_backend(kind, model, example_inputs, onnx_path=None, dynamic_axes=None,
+                  tolerance=0.02, device=None):
+    """Собирает бэкенд kind и сверяет его с eager float32 на example_inputs.
+
+    Если бэкенд не собрался или расходится с эталоном больше tolerance
+    (по вероятностям), возвращается обычный TorchBackend.
+    """
+    reference = TorchBackend(model)
+    if kind == "torch":
+        return reference
+    if kind not in BACKENDS:
+        print(f"⚠️ Неизвестный бэкенд {kind}, используем torch")
+        return reference
+
+    try:
+        started = time.perf_counter()
+        if kind in ("int8", "onnx") and device is not None and device.type != "cpu":
+            raise RuntimeError(f"бэкенд {kind} работает только на CPU")
+        if kind == "int8":
+            backend = Int8Backend(model)
+        elif kind == "compile":
+            backend = CompileBackend(model)
+        else:
+            backend = OnnxBackend(model, example_inputs, onnx_path, dynamic_axes or {})
+
+        diff = check_parity(reference, backend, example_inputs)
+        backend.parity_diff = diff
+        if diff > tolerance:
+            print(f"⚠️ Бэкенд {kind} расходится с float32 на {diff:.4f} (> {tolerance}), используем torch")
+            return reference
+        print(f"✅ Бэкенд {kind} готов за {time.perf_counter() - started:.1f} с, расхождение {diff:.5f}")
+        return backend
+    except Exception as e:
+        print(f"⚠️ Не удалось собрать бэкенд {kind}: {e}. Используем torch")
+        return reference
+
+
+def onnx_path_for(model_name):
+    cache_dir = Path(os.environ.get("ONNX_CACHE_DIR", "onnx_cache"))
+    return cache_dir / (model_name.replace("/", "__") + ".onnx")
@@ -0,0 +1,286 @@
+import asyncio
+import bisect
+import heapq
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from utils.admission import current_client
+from utils.executor import Overloaded
+
+
+class FairQueue:
+    """Очередь со справедливым обслуживанием клиентов (weighted fair queuing).
+
+    Каждому элементу присваивается виртуальное время окончания: старт - не
+    раньше текущего виртуального времени и окончания предыдущего элемента
+    того же клиента, длина - 1 / вес. Выдается элемент с наименьшим
+    временем, поэтому сотня запросов одного клиента не задерживает новый
+    запрос другого больше, чем на один элемент. Интерфейс - как у
+    queue.Queue (put/get/get_nowait/qsize).
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = 0
+        self._virtual = 0.0
+        self._finish = {}
+        self._queued = {}
+
+    def put(self, item, client=None, weight=1.0):
+        with self._cond:
+            start = max(self._virtual, self._finish.get(client, 0.0))
+            finish = start + 1.0 / max(weight, 1e-6)
+            self._finish[client] = finish
+            self._queued[client] = self._queued.get(client, 0) + 1
+            heapq.heappush(self._heap, (finish, self._seq, start, client, item))
+            self._seq += 1
+            self._cond.notify()
+
+    def get(self, block=True, timeout=None):
+        with self._cond:
+            if block:
+                if not self._cond.wait_for(lambda: self._heap, timeout):
+                    raise queue.Empty
+            elif not self._heap:
+                raise queue.Empty
+            _, _, start, client, item = heapq.heappop(self._heap)
+            self._virtual = max(self._virtual, start)
+            self._queued[client] -= 1
+            if not self._queued[client]:
+                # Клиент без очереди: его прошлые запросы не должны влиять на будущие
+                del self._queued[client]
+                del self._finish[client]
+            return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        with self._cond:
+            return len(self._heap)
+
+    def clients(self):
+        with self._cond:
+            return len(self._queued)
+
+
+class BatchScheduler:
+    """Собирает одновременные запросы в батчи и прогоняет их одним вызовом batch_fn.
+
+    batch_fn получает список элементов и должен вернуть список результатов
+    той же длины и в том же порядке. Если batch_fn упал на батче, элементы
+    прогоняются по одному, и исключение получают только те, на которых
+    оно повторилось. Если задан max_queue, при переполнении очереди submit
+    бросает Overloaded.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=8, max_wait_ms=10.0, name="batch",
+                 max_queue=None, retry_after=1):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+
+        # Справедливая очередь: один клиент не может занять модель (см. utils/admission.py)
+        self._queue = FairQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+        # Статистика
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes = {}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._rejected = 0
+        self._split_batches = 0
+
+    def submit(self, item) -> Future:
+        """Ставит элемент в очередь и возвращает Future с его результатом"""
+        if self.max_queue is not None and self._queue.qsize() >= self.max_queue:
+            with self._lock:
+                self._rejected += 1
+            raise Overloaded(self.name, self.retry_after)
+        self._ensure_started()
+        future = Future()
+        client, weight = current_client()
+        self._queue.put((item, future, time.perf_counter()), client, weight)
+        return future
+
+    async def run(self, item):
+        """То же, что submit, но для async-обработчиков"""
+        return await asyncio.wrap_future(self.submit(item))
+
+    def _ensure_started(self):
+        # После fork поток родителя не наследуется, поэтому проверяем pid
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._worker, name=f"{self.name}-batcher", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self):
+        # Ждем первый элемент сколько угодно, остальные - не дольше max_wait
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        # Запросы, которые отменили в очереди (например, по таймауту), не считаем
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        items = [item for item, _, _ in batch]
+        with self._lock:
+            size = len(batch)
+            self._batches += 1
+            self._items += size
+            self._batch_sizes[size] = self._batch_sizes.get(size, 0) + 1
+            for _, _, enqueued in batch:
+                wait = started - enqueued
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+
+        try:
+            results = self._call(items)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # Один битый элемент не должен ронять весь батч: повторяем по одному,
+            # ошибку получит только тот запрос, на котором она воспроизводится
+            with self._lock:
+                self._split_batches += 1
+            for (item, future, _) in batch:
+                try:
+                    future.set_result(self._call([item])[0])
+                except Exception as item_error:
+                    future.set_exception(item_error)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def _call(self, items):
+        results = self.batch_fn(items)
+        if len(results) != len(items):
+            raise RuntimeError(
+                f"batch_fn вернул {len(results)} результатов вместо {len(items)}"
+            )
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "queued_clients": self._queue.clients(),
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+                "avg_wait_ms": round(self._wait_total / self._items * 1000, 3) if self._items else 0.0,
+                "max_wait_ms_observed": round(self._wait_max * 1000, 3),
+                "rejected": self._rejected,
+                "split_batches": self._split_batches,
+            }
+
+
+class TextBatchScheduler(BatchScheduler):
+    """Батчер для текстов: группирует очередь по длине в токенах.
+
+    Элементы - уже токенизированные тексты, длину возвращает length_fn.
+    Собранные за max_wait_ms запросы (не больше max_batch_size) раскладываются
+    по корзинам длины bucket_edges, а внутри корзины режутся на батчи так,
+    чтобы батч с паддингом (самый длинный текст x число текстов) не превышал
+    max_tokens. Короткие корзины идут первыми: короткие сообщения не ждут
+    страницу текста и не дополняются до ее длины.
+    """
+
+    def __init__(self, batch_fn, length_fn=len, max_tokens=4096, max_batch_size=64,
+                 bucket_edges=(16, 32, 64, 128, 256, 512), **kwargs):
+        super().__init__(batch_fn, max_batch_size=max_batch_size, **kwargs)
+        self.length_fn = length_fn
+        self.max_tokens = max(1, int(max_tokens))
+        self.bucket_edges = tuple(sorted(bucket_edges))
+
+        self._tokens = 0
+        self._padded_tokens = 0
+        self._bucket_items = {}
+
+    def _bucket(self, length):
+        index = bisect.bisect_left(self.bucket_edges, length)
+        return self.bucket_edges[min(index, len(self.bucket_edges) - 1)]
+
+    def _plan(self, entries):
+        buckets = {}
+        for entry in entries:
+            length = self.length_fn(entry[0])
+            buckets.setdefault(self._bucket(length), []).append((length, entry))
+
+        batches = []
+        tokens = padded = 0
+        for edge in sorted(buckets):
+            batch, longest = [], 0
+            for length, entry in sorted(buckets[edge], key=lambda pair: pair[0]):
+                # Тексты отсортированы, поэтому новый элемент - самый длинный в батче
+                if batch and max(longest, length) * (len(batch) + 1) > self.max_tokens:
+                    batches.append(batch)
+                    padded += longest * len(batch)
+                    batch, longest = [], 0
+                batch.append(entry)
+                longest = max(longest, length)
+                tokens += length
+            batches.append(batch)
+            padded += longest * len(batch)
+
+        with self._lock:
+            self._tokens += tokens
+            self._padded_tokens += padded
+            for edge, items in buckets.items():
+                self._bucket_items[edge] = self._bucket_items.get(edge, 0) + len(items)
+        return batches
+
+    def _worker(self):
+        while True:
+            for batch in self._plan(self._collect()):
+                self._run_batch(batch)
+
+    def stats(self):
+        stats = super().stats()
+        with self._lock:
+            stats.update({
+                "max_tokens": self.max_tokens,
+                "tokens": self._tokens,
+                "padded_tokens": self._padded_tokens,
+                "padding_share": round(1 - self._tokens / self._padded_tokens, 4) if self._padded_tokens else 0.0,
+                "bucket_items": dict(sorted(self._bucket_items.items())),
+            })
+        return stats
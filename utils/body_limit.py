@@ -0,0 +1,77 @@
+import json
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class BodyLimitMiddleware:
+    """ASGI-middleware: 413, как только тело запроса превысило лимит пути.
+
+    limits - {путь: максимум байт тела}. Запрос с заголовком Content-Length
+    больше лимита отклоняется до чтения тела. Без заголовка (chunked) или
+    при неверном заголовке байты считаются по мере чтения: на первом куске
+    сверх лимита чтение обрывается, ответ приложения (FastAPI превращает
+    ошибку разбора формы в 400) подменяется на 413, а остаток тела не
+    читается вовсе.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            return await self._reject(send, limit)
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise BodyTooLarge(limit)
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # После превышения лимита ответ приложения не отправляется - вместо него 413
+            if exceeded:
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except BodyTooLarge:
+            pass
+        if exceeded and not started:
+            await self._reject(send, limit)
+
+    async def _reject(self, send, limit):
+        self.rejected += 1
+        body = json.dumps(
+            {"success": False, "detail": f"Тело запроса больше {limit} байт"},
+            ensure_ascii=False,
+        ).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from PIL import Image
+
+
+def image_key(image: Image.Image, model_version: str) -> str:
+    """Ключ кэша по декодированным пикселям и версии модели"""
+    h = hashlib.sha256()
+    h.update(f"image|{model_version}|{image.mode}|{image.width}x{image.height}|".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def media_key(contents: bytes, params: str) -> str:
+    """Ключ кэша для ролика: байты файла и параметры выборки/модели"""
+    h = hashlib.sha256()
+    h.update(f"media|{params}|".encode())
+    h.update(contents)
+    return h.hexdigest()
+
+
+def normalize_text(text: str) -> str:
+    # Одинаковый текст с разными пробелами/переносами считаем одним и тем же
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_key(text: str, model_name: str) -> str:
+    """Ключ кэша по нормализованному тексту и имени модели"""
+    payload = f"text|{model_name}|{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Двухуровневый кэш результатов детекции.
+
+    Первый уровень - LRU в памяти с ограничением по числу записей и TTL,
+    второй (если задан db_path) - таблица SQLite, которая переживает рестарт.
+    На диске хранится не больше max_disk_entries записей: каждые prune_every
+    вставок удаляются устаревшие по TTL и самые старые сверх лимита.
+    Значения должны сериализоваться в JSON.
+
+    put не ждет диска: запись идет фоновым потоком пачками, одна транзакция
+    на пачку (как в журнале). get читает диск в вызывающем потоке, поэтому
+    из event loop нужно звать fetch/fetch_many - они идут на диск в потоке
+    только при промахе памяти.
+    """
+
+    def __init__(self, max_entries=1024, ttl=24 * 3600, db_path=None,
+                 max_disk_entries=100_000, prune_every=256, max_batch=256):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        self.prune_every = max(1, int(prune_every))
+        self.max_batch = max_batch
+        self._puts_since_prune = 0
+
+        # _lock - память и счетчики, _db_lock - соединение SQLite: чтение диска
+        # и запись пачки не держат замок памяти
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._db = None
+        self._pid = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_pid = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        self.disk_writes = 0
+        self.disk_commits = 0
+
+        if db_path:
+            with self._db_lock:
+                self._connect()
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS results "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS results_created ON results (created)")
+                self._db.commit()
+                self._prune_disk()
+
+    def _connect(self):
+        # Соединение SQLite нельзя использовать после fork - в воркере открываем свое.
+        # Базу делят воркеры prefork: ждем чужую запись, а не падаем с "database is locked"
+        if self.db_path and self._pid != os.getpid():
+            self._db = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=5.0)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("PRAGMA busy_timeout=5000")
+            self._pid = os.getpid()
+        return self._db
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def _prune_disk(self):
+        # Вызывается под self._db_lock
+        removed = 0
+        if self.ttl is not None:
+            removed += self._db.execute(
+                "DELETE FROM results WHERE created < ?", (time.time() - self.ttl,)
+            ).rowcount
+        if self.max_disk_entries:
+            count = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_disk_entries:
+                removed += self._db.execute(
+                    "DELETE FROM results WHERE key IN "
+                    "(SELECT key FROM results ORDER BY created LIMIT ?)",
+                    (count - self.max_disk_entries,),
+                ).rowcount
+        self._db.commit()
+        self.disk_evictions += removed
+        self._puts_since_prune = 0
+
+    def _memory_get(self, key, now):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+        return None
+
+    def _disk_get(self, key, now):
+        if self.db_path:
+            with self._db_lock:
+                row = self._connect().execute(
+                    "SELECT value, created FROM results WHERE key = ?", (key,)
+                ).fetchone()
+            if row and not self._expired(row[1], now):
+                value = json.loads(row[0])
+                with self._lock:
+                    self._remember(key, value, row[1])
+                    self.disk_hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get(self, key):
+        """Значение из памяти или с диска (блокирующий вызов) либо None"""
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None:
+            return value
+        return self._disk_get(key, now)
+
+    def get_many(self, keys):
+        return [self.get(key) for key in keys]
+
+    async def fetch(self, key):
+        """То же, что get, но диск читается в потоке, не в event loop"""
+        now = time.time()
+        value = self._memory_get(key, now)
+        if value is not None or not self.db_path:
+            if value is None:
+                with self._lock:
+                    self.misses += 1
+            return value
+        return await asyncio.to_thread(self._disk_get, key, now)
+
+    async def fetch_many(self, keys):
+        """get для нескольких ключей одним походом в поток"""
+        if not self.db_path:
+            return self.get_many(keys)
+        return await asyncio.to_thread(self.get_many, keys)
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+        if self.db_path:
+            self._ensure_started()
+            self._queue.put((key, json.dumps(value, ensure_ascii=False), now))
+
+    def _ensure_started(self):
+        # После fork поток родителя не наследуется
+        if self._thread is not None and self._thread_pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._thread_pid != os.getpid():
+                self._thread_pid = os.getpid()
+                self._thread = threading.Thread(target=self._writer, name="result-cache", daemon=True)
+                self._thread.start()
+
+    def _writer(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._db_lock:
+                    self._connect().executemany(
+                        "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)", batch
+                    )
+                    self._db.commit()
+                    self.disk_writes += len(batch)
+                    self.disk_commits += 1
+                    self._puts_since_prune += len(batch)
+                    if self._puts_since_prune >= self.prune_every:
+                        self._prune_disk()
+            except Exception as e:
+                print(f"❌ Ошибка записи кэша на диск: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """Ждет, пока все поставленные записи окажутся на диске"""
+        if self._thread is not None and self._thread_pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        self.flush()
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(hits / total, 4) if total else 0.0,
+                "disk_tier": bool(self.db_path),
+                "disk_pending": self._queue.qsize(),
+                "disk_writes": self.disk_writes,
+                "disk_commits": self.disk_commits,
+                "max_disk_entries": self.max_disk_entries,
+                "disk_evictions": self.disk_evictions,
+            }
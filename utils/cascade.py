@@ -0,0 +1,85 @@
+import io
+import threading
+
+from PIL import Image
+
+# Генераторы, которые пишут себя в EXIF Software
+AI_SOFTWARE = (
+    "dall-e", "dall·e", "midjourney", "stable diffusion", "novelai", "firefly",
+    "imagen", "comfyui", "automatic1111", "invokeai", "leonardo", "ideogram", "flux",
+)
+# Текстовые чанки PNG, в которые UI для Stable Diffusion сохраняют промпт и граф
+PNG_TEXT_KEYS = ("parameters", "prompt", "workflow", "dream", "sd-metadata", "invokeai_metadata")
+# IPTC digitalSourceType из манифеста C2PA или XMP: изображение создано генеративной моделью
+DIGITAL_SOURCE_TYPES = (b"trainedAlgorithmicMedia", b"compositeWithTrainedAlgorithmicMedia")
+
+
+def find_ai_markers(contents: bytes):
+    """Явные метки генератора в метаданных файла или None.
+
+    Отсутствие меток ничего не доказывает (метаданные легко стереть),
+    поэтому этот этап умеет только досрочно признать картинку сгенерированной.
+    """
+    for source_type in DIGITAL_SOURCE_TYPES:
+        if source_type in contents:
+            return f"digitalSourceType:{source_type.decode()}"
+    try:
+        # Пиксели не декодируются: читаются только заголовок и метаданные
+        with Image.open(io.BytesIO(contents)) as image:
+            software = image.getexif().get(0x0131)
+            if isinstance(software, str) and any(name in software.lower() for name in AI_SOFTWARE):
+                return f"exif:Software={software.strip()}"
+            for key in PNG_TEXT_KEYS:
+                if key in image.info:
+                    return f"png:{key}"
+    except Exception:
+        return None
+    return None
+
+
+class CascadeStats:
+    """Доля досрочных ответов по этапам и расхождение с полной моделью.
+
+    Часть досрочных ответов (audit_rate) дополнительно проверяется полной
+    моделью: mean_abs_diff - среднее расхождение ai_probability,
+    disagreement_rate - доля случаев, когда вердикт (порог 0.5) разный.
+    """
+
+    STAGES = ("metadata", "screen", "full")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {stage: 0 for stage in self.STAGES}
+        self._audits = {}
+
+    def record(self, stage, count=1):
+        with self._lock:
+            self._counts[stage] += count
+
+    def audit(self, stage, early_ai, full_ai):
+        diff = abs(early_ai - full_ai)
+        with self._lock:
+            audit = self._audits.setdefault(stage, {"n": 0, "diff_total": 0.0, "diff_max": 0.0, "disagree": 0})
+            audit["n"] += 1
+            audit["diff_total"] += diff
+            audit["diff_max"] = max(audit["diff_max"], diff)
+            audit["disagree"] += (early_ai > 0.5) != (full_ai > 0.5)
+
+    def stats(self):
+        with self._lock:
+            total = sum(self._counts.values())
+            early = total - self._counts["full"]
+            return {
+                "total": total,
+                "by_stage": dict(self._counts),
+                "early_exit_share": round(early / total, 4) if total else 0.0,
+                "audits": {
+                    stage: {
+                        "n": a["n"],
+                        "mean_abs_diff": round(a["diff_total"] / a["n"], 4),
+                        "max_abs_diff": round(a["diff_max"], 4),
+                        "disagreement_rate": round(a["disagree"] / a["n"], 4),
+                    }
+                    for stage, a in self._audits.items()
+                },
+            }
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import random
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Коды, после которых запрос имеет смысл повторить
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class DetectorClient:
+    """Асинхронный клиент к серверу детектора с пулом keep-alive соединений.
+
+    Один httpx.AsyncClient на весь процесс: соединения переиспользуются,
+    число одновременных запросов ограничено max_connections, лишние ждут
+    свободного соединения не дольше pool_timeout. Сетевые ошибки и ответы
+    429/502/503/504 повторяются с экспоненциальной задержкой (Retry-After
+    от сервера имеет приоритет). Если задан uds, запросы идут через Unix
+    domain socket, а base_url нужен только для заголовка Host. client
+    уходит в X-Client-Id: по нему сервер считает лимиты и очередь к модели
+    (сервер принимает его только от адресов из TRUSTED_PROXIES).
+    """
+
+    def __init__(self, base_url="http://127.0.0.1:8000", uds=None, max_connections=20,
+                 max_keepalive=10, connect_timeout=5.0, pool_timeout=30.0,
+                 retries=3, backoff=0.5, max_backoff=10.0):
+        self.base_url = base_url
+        self.uds = uds
+        self.limits = httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_keepalive
+        )
+        self.connect_timeout = connect_timeout
+        self.pool_timeout = pool_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Создается лениво, уже внутри event loop бота
+        if self._client is None:
+            # Свой transport httpx не настраивает лимитами клиента - передаем их сами
+            transport = httpx.AsyncHTTPTransport(uds=self.uds, limits=self.limits) if self.uds else None
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                transport=transport,
+                limits=self.limits,
+                timeout=httpx.Timeout(30.0, connect=self.connect_timeout, pool=self.pool_timeout),
+            )
+        return self._client
+
+    def _delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), self.max_backoff)
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        # Разброс, чтобы повторы разных пользователей не приходили одновременно
+        return delay * random.uniform(0.5, 1.0)
+
+    async def request(self, method, path, timeout=None, client=None, **kwargs) -> httpx.Response:
+        """Запрос с повторами; после последней попытки возвращает ответ или пробрасывает ошибку"""
+        if client is not None:
+            kwargs["headers"] = {**kwargs.get("headers", {}), "X-Client-Id": client}
+        if timeout is not None:
+            kwargs["timeout"] = httpx.Timeout(timeout, connect=self.connect_timeout, pool=self.pool_timeout)
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.client.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError, httpx.PoolTimeout) as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self._delay(attempt)
+                logger.warning(f"⚠️ {method} {path}: {e!r}, повтор через {delay:.1f} с")
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.retries:
+                    return response
+                delay = self._delay(attempt, response)
+                logger.warning(f"⚠️ {method} {path}: {response.status_code}, повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+
+    async def upload_image(self, contents: bytes, filename="img.jpg", mode="binary", timeout=60.0,
+                           client=None, **params):
+        files = {"file": (filename, bytes(contents), "image/jpeg")}
+        return await self.request(
+            "POST", "/upload", params={"mode": mode, **params}, files=files, timeout=timeout, client=client
+        )
+
+    async def detect_media(self, contents: bytes, filename="media.mp4", content_type="video/mp4",
+                           timeout=120.0, client=None, **params):
+        files = {"file": (filename, bytes(contents), content_type)}
+        return await self.request(
+            "POST", "/detect-media", params=params, files=files, timeout=timeout, client=client
+        )
+
+    async def detect_text(self, text, timeout=30.0, client=None, **fields):
+        return await self.request(
+            "POST", "/detect-text", json={"text": text, **fields}, timeout=timeout, client=client
+        )
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
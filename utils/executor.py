@@ -0,0 +1,97 @@
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class Overloaded(Exception):
+    """Очередь задач заполнена - клиенту нужно повторить запрос позже"""
+
+    def __init__(self, name, retry_after=1):
+        super().__init__(f"Очередь '{name}' переполнена")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """Пул потоков или процессов с ограниченной очередью.
+
+    Если задач в работе и в очереди уже max_pending, submit сразу
+    бросает Overloaded вместо того, чтобы копить бесконечную очередь.
+    В режиме "process" функции и аргументы должны сериализоваться через pickle.
+    """
+
+    def __init__(self, kind="thread", workers=None, max_pending=32, name="cpu", retry_after=1):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Неизвестный тип пула: {kind}")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max(1, int(max_pending))
+        self.name = name
+        self.retry_after = retry_after
+
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._pending = 0
+        self._rejected = 0
+        self._completed = 0
+
+    def _get_pool(self):
+        # Пул создается лениво и пересоздается после fork
+        if self._pool is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix=f"{self.name}-pool"
+                )
+        return self._pool
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise Overloaded(self.name, self.retry_after)
+            self._pending += 1
+            pool = self._get_pool()
+
+        try:
+            if self.kind == "thread":
+                # Контекст запроса (трейс этапов) переезжает в поток вместе с задачей
+                future = pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+            else:
+                future = pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        """Выполняет fn в пуле, не блокируя event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
@@ -0,0 +1,66 @@
+import io
+
+from PIL import Image
+
+from utils.watermark import add_watermark
+
+
+class ImageTooLarge(ValueError):
+    """Картинка больше допустимого числа пикселей"""
+
+
+# Функции уровня модуля, чтобы их можно было отправить в пул процессов
+
+def _open(contents: bytes, max_pixels=None) -> Image.Image:
+    # Image.open читает только заголовок, поэтому размер проверяем до декодирования
+    image = Image.open(io.BytesIO(contents))
+    if max_pixels and image.width * image.height > max_pixels:
+        raise ImageTooLarge(
+            f"Слишком большое изображение: {image.width}x{image.height} "
+            f"(максимум {max_pixels} пикселей)"
+        )
+    return image
+
+
+def decode_image(contents: bytes, max_pixels=None) -> Image.Image:
+    """Декодирует загруженный файл в RGB в полном разрешении"""
+    return _open(contents, max_pixels).convert("RGB")
+
+
+def decode_for_model(contents: bytes, min_side=448, max_pixels=None) -> Image.Image:
+    """Дешевое декодирование для модели.
+
+    Процессор модели все равно уменьшает картинку до 224-384 px, поэтому JPEG
+    декодируется в draft-режиме (масштаб 1/2-1/8 прямо в декодере), а
+    остальные форматы после декодирования уменьшаются целочисленным reduce.
+    Меньшая сторона результата не меньше min_side.
+    """
+    image = _open(contents, max_pixels)
+    if image.format == "JPEG":
+        image.draft("RGB", (min_side, min_side))
+    return shrink_for_model(image, min_side)
+
+
+def shrink_for_model(image: Image.Image, min_side=448) -> Image.Image:
+    """RGB и целочисленное уменьшение, пока меньшая сторона не меньше min_side"""
+    image = image.convert("RGB")
+    factor = min(image.size) // min_side
+    if factor >= 2:
+        image = image.reduce(factor)
+    return image
+
+
+def watermark_jpeg(image: Image.Image, text: str, quality: int = 95) -> bytes:
+    """Накладывает водяной знак и кодирует результат в JPEG"""
+    image_with_wm = add_watermark(image, text)
+    img_io = io.BytesIO()
+    image_with_wm.save(img_io, format="JPEG", quality=quality)
+    return img_io.getvalue()
+
+
+def watermark_upload(contents: bytes, text: str, max_pixels=None, quality: int = 95) -> bytes:
+    """Полное декодирование + водяной знак + JPEG одним шагом.
+
+    Полноразмерная картинка живет только внутри этой функции.
+    """
+    return watermark_jpeg(decode_image(contents, max_pixels), text, quality)
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# Статусы задачи
+QUEUED, RUNNING, DONE, FAILED, EXPIRED = "queued", "running", "done", "failed", "expired"
+FINISHED = (DONE, FAILED, EXPIRED)
+
+# Приоритеты: интерактивные запросы обгоняют пакетные
+PRIORITY_INTERACTIVE = 10
+PRIORITY_NORMAL = 5
+PRIORITY_BULK = 0
+
+
+class JobStore:
+    """Очередь задач с результатами в SQLite.
+
+    Задачи переживают рестарт сервера. Очередь общая для всех процессов,
+    которые открыли один и тот же файл: захват задачи идет в транзакции
+    BEGIN IMMEDIATE, поэтому одну задачу не возьмут двое.
+
+    Захваченная задача арендуется на lease секунд; пока она выполняется,
+    владелец продлевает аренду через renew. Если процесс умер и аренда
+    истекла, housekeeping возвращает задачу в очередь. Методы блокирующие
+    (busy_timeout до 5 с) - из event loop их нужно вызывать через поток.
+    """
+
+    def __init__(self, path, lease=300, retention=24 * 3600):
+        self.path = str(path)
+        self.lease = lease
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                payload BLOB,
+                params TEXT,
+                result TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                available_at REAL NOT NULL,
+                expires_at REAL,
+                lease_until REAL
+            )"""
+        )
+        columns = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "lease_until" not in columns:
+            # База от версии без аренды
+            self._db.execute("ALTER TABLE jobs ADD COLUMN lease_until REAL")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, created)"
+        )
+
+    @property
+    def _db(self):
+        # Соединение SQLite нельзя использовать после fork - в воркере открываем свое
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._pid = os.getpid()
+        return self._conn
+
+    def submit(self, kind, payload: bytes, params=None, priority=PRIORITY_NORMAL,
+               ttl=3600, max_attempts=3):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, kind, priority, status, payload, params, max_attempts, "
+                "created, updated, available_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, priority, QUEUED, payload, json.dumps(params or {}),
+                 max_attempts, now, now, now, now + ttl if ttl else None),
+            )
+        return job_id
+
+    def claim(self, min_priority=None):
+        """Забирает самую приоритетную готовую задачу или возвращает None"""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                query = (
+                    "SELECT * FROM jobs WHERE status = ? AND available_at <= ? "
+                    "AND (expires_at IS NULL OR expires_at > ?)"
+                )
+                args = [QUEUED, now, now]
+                if min_priority is not None:
+                    query += " AND priority >= ?"
+                    args.append(min_priority)
+                row = self._db.execute(
+                    query + " ORDER BY priority DESC, created LIMIT 1", args
+                ).fetchone()
+                if row is None:
+                    self._db.execute("COMMIT")
+                    return None
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, updated = ?, lease_until = ? "
+                    "WHERE id = ?",
+                    (RUNNING, now, now + self.lease, row["id"]),
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        job = dict(row)
+        job["params"] = json.loads(job["params"] or "{}")
+        job["attempts"] += 1
+        return job
+
+    # Результат записывает только тот, кто держит задачу: attempts меняется при каждом
+    # захвате, поэтому воркер, у которого аренду отобрали, ничего не перезапишет
+    _OWNED = "id = ? AND status = 'running' AND attempts = ?"
+
+    def renew(self, job_id, attempts):
+        """Продлевает аренду задачи на lease секунд. False, если задача уже не наша"""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                f"UPDATE jobs SET updated = ?, lease_until = ? WHERE {self._OWNED}",
+                (now, now + self.lease, job_id, attempts),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, result, attempts):
+        with self._lock:
+            # Входные данные больше не нужны - освобождаем место
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, payload = NULL, updated = ?, lease_until = NULL "
+                f"WHERE {self._OWNED}",
+                (DONE, json.dumps(result, ensure_ascii=False), time.time(), job_id, attempts),
+            )
+
+    def fail(self, job_id, error, attempts, max_attempts, backoff=1.0):
+        now = time.time()
+        with self._lock:
+            if attempts < max_attempts:
+                # Повтор с экспоненциальной задержкой
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated = ?, available_at = ?, lease_until = NULL "
+                    f"WHERE {self._OWNED}",
+                    (QUEUED, error, now, now + backoff * 2 ** (attempts - 1), job_id, attempts),
+                )
+            else:
+                self._db.execute(
+                    "UPDATE jobs SET status = ?, error = ?, payload = NULL, updated = ?, lease_until = NULL "
+                    f"WHERE {self._OWNED}",
+                    (FAILED, error, now, job_id, attempts),
+                )
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, kind, priority, status, result, error, attempts, created, updated, expires_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def housekeeping(self):
+        """Просрочка ожидающих задач, возврат зависших и удаление старых"""
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, payload = NULL, updated = ? "
+                "WHERE status = ? AND expires_at IS NOT NULL AND expires_at <= ?",
+                (EXPIRED, now, QUEUED, now),
+            )
+            # Процесс, взявший задачу, умер и не продлил аренду - возвращаем в очередь
+            self._db.execute(
+                "UPDATE jobs SET status = ?, updated = ?, lease_until = NULL "
+                "WHERE status = ? AND COALESCE(lease_until, updated + ?) < ?",
+                (QUEUED, now, RUNNING, self.lease, now),
+            )
+            self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated < ?",
+                (*FINISHED, now - self.retention),
+            )
+
+    def stats(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            ).fetchall()
+        return {status: count for status, count in rows}
+
+
+class JobRunner:
+    """Воркеры в event loop сервера, которые выполняют задачи из JobStore.
+
+    handlers - словарь kind -> async функция (payload, params) -> dict.
+    Первый воркер берет только интерактивные задачи, чтобы они не ждали
+    за пакетными. Пока задача выполняется, ее аренда продлевается каждую
+    треть lease. Обращения к SQLite идут в потоке, чтобы ожидание
+    блокировки базы другим процессом не останавливало event loop.
+    """
+
+    def __init__(self, store: JobStore, handlers, workers=2, poll_interval=0.5,
+                 housekeeping_interval=60):
+        self.store = store
+        self.handlers = handlers
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self.housekeeping_interval = housekeeping_interval
+        self._tasks = []
+        self._wakeup = None
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        for i in range(self.workers):
+            min_priority = PRIORITY_INTERACTIVE if i == 0 and self.workers > 1 else None
+            self._tasks.append(asyncio.create_task(self._worker(min_priority)))
+        self._tasks.append(asyncio.create_task(self._housekeeping()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """Будит воркеров сразу после постановки задачи"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _keep_lease(self, job):
+        while True:
+            await asyncio.sleep(self.store.lease / 3)
+            if not await asyncio.to_thread(self.store.renew, job["id"], job["attempts"]):
+                print(f"⚠️ Аренда задачи {job['id']} потеряна")
+                return
+
+    async def _worker(self, min_priority):
+        while True:
+            job = await asyncio.to_thread(self.store.claim, min_priority)
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            handler = self.handlers.get(job["kind"])
+            lease = asyncio.create_task(self._keep_lease(job))
+            try:
+                if handler is None:
+                    raise ValueError(f"Неизвестный тип задачи: {job['kind']}")
+                result = await handler(job["payload"], job["params"])
+                await asyncio.to_thread(self.store.complete, job["id"], result, job["attempts"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Ошибка задачи {job['id']}: {e}")
+                await asyncio.to_thread(
+                    self.store.fail, job["id"], str(e) or type(e).__name__, job["attempts"], job["max_attempts"]
+                )
+            finally:
+                lease.cancel()
+
+    async def _housekeeping(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.store.housekeeping)
+            except Exception as e:
+                print(f"❌ Ошибка обслуживания очереди задач: {e}")
+            await asyncio.sleep(self.housekeeping_interval)
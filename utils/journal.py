@@ -0,0 +1,178 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+
+class DetectionJournal:
+    """Журнал детекций в формате JSON Lines только на дозапись.
+
+    Запись идет через фоновый поток: записи копятся в очереди и сбрасываются
+    пачками раз в flush_interval секунд (или когда набралось max_batch).
+    Файлы ротируются по дню и по размеру:
+    detections-20260117-000.jsonl, detections-20260117-001.jsonl, ...
+    Поля из exclude (например, image_base64) в журнал не попадают.
+    """
+
+    def __init__(self, directory, prefix="detections", max_bytes=50 * 1024 * 1024,
+                 flush_interval=1.0, max_batch=256, exclude=("image_base64",)):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.exclude = set(exclude)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+        self.written = 0
+        self.flushes = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._worker, name="journal", daemon=True)
+                self._thread.start()
+
+    def write(self, entry: dict):
+        """Ставит запись в очередь, не дожидаясь записи на диск"""
+        record = {k: v for k, v in entry.items() if k not in self.exclude}
+        record.setdefault("timestamp", datetime.now().isoformat())
+        self._ensure_started()
+        self._queue.put(record)
+
+    def _worker(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._append(batch)
+            except Exception as e:
+                print(f"❌ Ошибка записи журнала: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            # Копим следующую пачку, а не пишем по одной записи
+            if len(batch) < self.max_batch:
+                time.sleep(self.flush_interval)
+
+    def _files_for(self, day):
+        return sorted(self.directory.glob(f"{self.prefix}-{day}-*.jsonl"))
+
+    def _current_path(self, incoming_bytes=0):
+        day = datetime.now().strftime("%Y%m%d")
+        files = self._files_for(day)
+        if files:
+            last = files[-1]
+            if last.stat().st_size + incoming_bytes <= self.max_bytes:
+                return last
+            index = int(last.stem.rsplit("-", 1)[1]) + 1
+        else:
+            index = 0
+        return self.directory / f"{self.prefix}-{day}-{index:03d}.jsonl"
+
+    def _append(self, records):
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        path = self._current_path(len(data))
+        # Одна запись write() на пачку: строки разных процессов не перемешаются
+        with open(path, "ab") as f:
+            f.write(data)
+        self.written += len(records)
+        self.flushes += 1
+
+    def flush(self):
+        """Ждет, пока все поставленные записи окажутся на диске"""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+
+    def files(self):
+        return sorted(self.directory.glob(f"{self.prefix}-*.jsonl"))
+
+    def iter_entries(self):
+        """Читает все записи журнала в хронологическом порядке"""
+        for _, entry in self.read_since():
+            yield entry
+
+    def read_since(self, cursor=None):
+        """Записи после позиции cursor в хронологическом порядке: пары (позиция, запись).
+
+        Позиция - [имя файла, смещение после строки]; ее можно сохранить и
+        после рестарта продолжить с нее, не перечитывая журнал. Недописанная
+        последняя строка (ее еще пишет другой процесс) пропускается и будет
+        прочитана в следующий раз.
+        """
+        name, offset = cursor or (None, 0)
+        for path in self.files():
+            if name is not None and path.name < name:
+                continue
+            position = offset if path.name == name else 0
+            with open(path, "rb") as f:
+                f.seek(position)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    position += len(line)
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Оборванная строка после падения процесса
+                        continue
+                    yield [path.name, position], entry
+
+    def migrate_legacy(self, legacy_path):
+        """Переносит старый detections.json (один JSON-массив) в журнал.
+
+        Старый файл переименовывается в *.migrated, чтобы миграция не повторялась.
+        Возвращает число перенесенных записей.
+        """
+        legacy_path = Path(legacy_path)
+        if not legacy_path.exists():
+            return 0
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except Exception as e:
+            print(f"❌ Не удалось прочитать {legacy_path}: {e}")
+            return 0
+
+        records = [{k: v for k, v in e.items() if k not in self.exclude} for e in entries]
+        for start in range(0, len(records), self.max_batch):
+            self._append(records[start:start + self.max_batch])
+        legacy_path.rename(legacy_path.with_name(legacy_path.name + ".migrated"))
+        print(f"📦 Перенесено {len(records)} записей из {legacy_path.name} в журнал")
+        return len(records)
+
+    def stats(self):
+        return {
+            "pending": self._queue.qsize(),
+            "written": self.written,
+            "flushes": self.flushes,
+            "files": len(self.files()),
+        }
@@ -0,0 +1,254 @@
+import heapq
+import io
+
+from PIL import Image, ImageChops, ImageStat
+
+from utils.imaging import ImageTooLarge, decode_for_model, shrink_for_model
+
+STRATEGIES = ("uniform", "keyframes", "scene")
+AGGREGATES = ("mean", "max", "top_half")
+
+
+class UnsupportedMedia(ValueError):
+    """Файл не картинка и не видео, либо для видео не установлен PyAV"""
+
+
+def media_kind(contents: bytes) -> str:
+    """'video', 'animation' (GIF/APNG/WebP из нескольких кадров), 'image'
+    или 'unknown', если PIL не узнает формат.
+
+    Смотрит только заголовок: кадры не декодируются.
+    """
+    # MP4/MOV (ftyp), WebM/MKV (EBML), AVI
+    if contents[4:8] == b"ftyp" or contents[:4] == b"\x1a\x45\xdf\xa3" or (
+        contents[:4] == b"RIFF" and contents[8:12] == b"AVI "
+    ):
+        return "video"
+    try:
+        with Image.open(io.BytesIO(contents)) as image:
+            return "animation" if getattr(image, "is_animated", False) else "image"
+    except Image.DecompressionBombError:
+        # Картинка, но слишком большая: ошибку с размером даст декодер
+        return "image"
+    except Exception:
+        return "unknown"
+
+
+def _check_pixels(width, height, max_pixels):
+    if max_pixels and width * height > max_pixels:
+        raise ImageTooLarge(f"Слишком большой кадр: {width}x{height} (максимум {max_pixels} пикселей)")
+
+
+def _spread(length, count):
+    """count позиций по центрам равных отрезков [0, length)"""
+    return [length * (i + 0.5) / count for i in range(count)]
+
+
+class _AnimationSource:
+    """Кадры GIF/APNG/WebP. Позиция - номер кадра.
+
+    Кадры GIF хранят разницу с предыдущим, поэтому декодер проходит все кадры
+    до нужного, но в памяти держится только текущий.
+    """
+
+    def __init__(self, contents, min_side, max_pixels):
+        self.image = Image.open(io.BytesIO(contents))
+        _check_pixels(self.image.width, self.image.height, max_pixels)
+        self.min_side = min_side
+        # Для GIF n_frames пролистывает блоки файла без декодирования
+        self.length = getattr(self.image, "n_frames", 1)
+
+    def positions(self, count):
+        return sorted({min(int(p), self.length - 1) for p in _spread(self.length, count)})
+
+    def read(self, positions):
+        wanted = iter(positions)
+        target = next(wanted, None)
+        elapsed = 0.0
+        for index in range(self.length):
+            if target is None:
+                return
+            self.image.seek(index)
+            if index == target:
+                yield index, round(elapsed / 1000, 3), shrink_for_model(self.image, self.min_side)
+                target = next(wanted, None)
+            elapsed += self.image.info.get("duration", 0) or 0
+
+    def keyframes(self, count):
+        # У анимаций нет ключевых кадров: та же равномерная выборка
+        return self.read(self.positions(count))
+
+    def close(self):
+        self.image.close()
+
+
+class _VideoSource:
+    """Кадры видео через PyAV. Позиция - время в секундах.
+
+    Каждый кадр достается перемоткой к ближайшему ключевому кадру и
+    декодированием до нужного времени, поэтому работа зависит от числа
+    кадров в выборке, а не от длины ролика.
+    """
+
+    def __init__(self, contents, min_side, max_pixels):
+        try:
+            import av
+        except ImportError:
+            raise UnsupportedMedia("Для видео на сервере нужен PyAV (pip install av)")
+        try:
+            self.container = av.open(io.BytesIO(contents))
+        except Exception as e:
+            raise UnsupportedMedia(f"Не удалось открыть видео: {e}")
+        if not self.container.streams.video:
+            self.container.close()
+            raise UnsupportedMedia("В файле нет видеодорожки")
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = "AUTO"
+        context = self.stream.codec_context
+        _check_pixels(context.width, context.height, max_pixels)
+
+        if self.stream.duration:
+            self.length = float(self.stream.duration * self.stream.time_base)
+        elif self.container.duration:
+            self.length = self.container.duration / av.time_base
+        else:
+            self.container.close()
+            raise UnsupportedMedia("Неизвестна длительность видео")
+
+        # Кадр сразу уменьшается в декодере до размера, нужного модели
+        scale = max(1.0, min(context.width, context.height) / min_side)
+        self.size = (max(1, round(context.width / scale)), max(1, round(context.height / scale)))
+
+    def _image(self, frame):
+        return frame.to_image(width=self.size[0], height=self.size[1])
+
+    def positions(self, count):
+        return _spread(self.length, count)
+
+    def read(self, positions):
+        for target in positions:
+            self.container.seek(int(target / self.stream.time_base), stream=self.stream, backward=True)
+            for frame in self.container.decode(self.stream):
+                if frame.time is None or frame.time + 1e-3 >= target:
+                    yield round(target, 3), round(frame.time or target, 3), self._image(frame)
+                    break
+
+    def keyframes(self, count):
+        """Первый ключевой кадр в каждом из count равных отрезков ролика.
+
+        Декодер пропускает все остальные кадры, поэтому это дешевле read,
+        но проходит ролик целиком.
+        """
+        self.stream.codec_context.skip_frame = "NONKEY"
+        bounds = iter(self.length * i / count for i in range(1, count + 1))
+        bound = next(bounds)
+        taken = False
+        for frame in self.container.decode(self.stream):
+            time = frame.time or 0.0
+            while time >= bound:
+                bound, taken = next(bounds, None), False
+                if bound is None:
+                    return
+            if not taken:
+                taken = True
+                yield round(time, 3), round(time, 3), self._image(frame)
+
+    def close(self):
+        self.container.close()
+
+
+class _StillSource:
+    """Обычная картинка - ролик из одного кадра"""
+
+    length = 1
+
+    def __init__(self, contents, min_side, max_pixels):
+        self.frame = decode_for_model(contents, min_side, max_pixels)
+
+    def positions(self, count):
+        return [0]
+
+    def read(self, positions):
+        yield 0, 0.0, self.frame
+
+    def keyframes(self, count):
+        return self.read([0])
+
+    def close(self):
+        pass
+
+
+SOURCES = {"video": _VideoSource, "animation": _AnimationSource, "image": _StillSource}
+
+
+def _pick_scenes(candidates, budget):
+    """Из потока кадров оставляет budget с самой большой сменой сцены.
+
+    Смена - средняя разница серых миниатюр 32x32 с предыдущим кадром-кандидатом;
+    первый кадр берется всегда. В памяти не больше budget кадров.
+    """
+    heap, previous = [], None
+    for seq, (position, time, image) in enumerate(candidates):
+        thumb = image.convert("L").resize((32, 32))
+        change = 1.0 if previous is None else ImageStat.Stat(ImageChops.difference(thumb, previous)).mean[0] / 255
+        previous = thumb
+        # -seq: при равной смене остается более ранний кадр, картинки не сравниваются
+        entry = (change, -seq, position, time, image)
+        if len(heap) < budget:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+    return [
+        {"position": position, "time": time, "change": round(change, 4), "image": image}
+        for change, _, position, time, image in sorted(heap, key=lambda e: -e[1])
+    ]
+
+
+def sample_frames(contents: bytes, budget=8, strategy="uniform", min_side=448, max_pixels=None,
+                  scene_oversample=4):
+    """Выборка не больше budget кадров из GIF/видео, уменьшенных для модели.
+
+    uniform   - равномерно по длине ролика;
+    keyframes - ключевые кадры видео (у анимаций - как uniform);
+    scene     - из budget * scene_oversample равномерных кандидатов
+                берутся кадры с самой большой сменой сцены.
+
+    Кадры читаются по одному, поэтому память ограничена budget, а не длиной
+    ролика. Возвращает {"kind", "length", "frames": [{"position", "time", "image"}]},
+    length - число кадров анимации или длительность видео в секундах.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"strategy должен быть одним из: {', '.join(STRATEGIES)}")
+    budget = max(1, int(budget))
+    kind = media_kind(contents)
+    if kind not in SOURCES:
+        raise UnsupportedMedia("Файл не похож ни на картинку, ни на видео")
+    source = SOURCES[kind](contents, min_side, max_pixels)
+    try:
+        if strategy == "scene":
+            candidates = source.read(source.positions(budget * max(1, scene_oversample)))
+            frames = _pick_scenes(candidates, budget)
+        else:
+            stream = source.keyframes(budget) if strategy == "keyframes" else source.read(source.positions(budget))
+            frames = [{"position": position, "time": time, "image": image} for position, time, image in stream]
+    finally:
+        source.close()
+    if not frames:
+        raise UnsupportedMedia("Не удалось прочитать ни одного кадра")
+    return {"kind": kind, "length": source.length, "frames": frames}
+
+
+def aggregate_scores(scores, method="mean"):
+    """Оценка ролика по оценкам кадров (ai_probability 0..1).
+
+    mean - среднее; max - самый подозрительный кадр; top_half - среднее
+    по более подозрительной половине кадров (вставка ИИ в живое видео
+    не растворяется в среднем, а один шумный кадр не решает все).
+    """
+    if method not in AGGREGATES:
+        raise ValueError(f"aggregate должен быть одним из: {', '.join(AGGREGATES)}")
+    if method == "max":
+        return max(scores)
+    if method == "top_half":
+        scores = sorted(scores, reverse=True)[:max(1, (len(scores) + 1) // 2)]
+    return sum(scores) / len(scores)
@@ -0,0 +1,213 @@
+import json
+import os
+import threading
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+HASH_BITS = 64
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def _gray(image: Image.Image, size) -> np.ndarray:
+    # reducing_gap сильно ускоряет уменьшение больших фото
+    small = image.convert("L").resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return np.asarray(small, dtype=np.float64)
+
+
+def _bits_to_int(bits) -> int:
+    value = 0
+    for bit in bits.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    m[0] *= 1 / np.sqrt(2)
+    return m * np.sqrt(2 / n)
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def dhash(image: Image.Image) -> int:
+    """Разностный хэш: сравнение соседних пикселей 9x8"""
+    pixels = _gray(image, (9, 8))
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(image: Image.Image) -> int:
+    """Перцептивный хэш: знаки низких частот DCT 32x32 относительно медианы"""
+    pixels = _gray(image, (32, 32))
+    low = (_DCT32 @ pixels @ _DCT32.T)[:8, :8]
+    # Постоянную составляющую не учитываем в медиане
+    median = np.median(low.flatten()[1:])
+    return _bits_to_int(low > median)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class NearDuplicateIndex:
+    """Индекс перцептивных хэшей с поиском по расстоянию Хэмминга.
+
+    Используется multi-index hashing: 64-битный хэш режется на 4 куска по 16 бит,
+    и по каждому куску строится своя хэш-таблица. Если полное расстояние <= d,
+    то хотя бы один кусок отличается не больше чем на d // 4 бит, поэтому
+    достаточно перебрать соседей каждого куска в этом радиусе. Поиск не
+    зависит от числа записей линейно, в отличие от полного перебора.
+
+    Записи дописываются в JSONL-файл и читаются из него при старте. Рядом
+    (<файл>.cursor) хранится позиция в журнале детекций, до которой индекс
+    уже дозаполнен, чтобы при старте читать только новые записи журнала.
+    """
+
+    def __init__(self, path=None, max_distance=4, model_version=None):
+        self.path = Path(path) if path else None
+        self.max_distance = max_distance
+        self.model_version = model_version
+
+        self._lock = threading.Lock()
+        self._hashes = []
+        self._results = []
+        self._known = set()
+        self._tables = [dict() for _ in range(CHUNKS)]
+        self._probes = self._probe_masks(max_distance // CHUNKS)
+
+        self.lookups = 0
+        self.matches = 0
+
+        if self.path and self.path.exists():
+            self._load()
+
+    @staticmethod
+    def _probe_masks(radius):
+        masks = [0]
+        for r in range(1, radius + 1):
+            for bits in combinations(range(CHUNK_BITS), r):
+                mask = 0
+                for b in bits:
+                    mask |= 1 << b
+                masks.append(mask)
+        return masks
+
+    @staticmethod
+    def _chunks(h):
+        return [(h >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNKS)]
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("v") == self.model_version:
+                    self._insert(int(record["h"], 16), record["r"])
+
+    def _insert(self, h, result):
+        if h in self._known:
+            return False
+        idx = len(self._hashes)
+        self._hashes.append(h)
+        self._results.append(result)
+        self._known.add(h)
+        for table, chunk in zip(self._tables, self._chunks(h)):
+            table.setdefault(chunk, []).append(idx)
+        return True
+
+    def add(self, h: int, result: dict):
+        with self._lock:
+            if not self._insert(h, result):
+                return
+            if self.path:
+                record = {"h": f"{h:016x}", "v": self.model_version, "r": result}
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def search(self, h: int):
+        """Возвращает (результат, расстояние) ближайшей записи или None"""
+        with self._lock:
+            self.lookups += 1
+            best = None
+            seen = set()
+            for table, chunk in zip(self._tables, self._chunks(h)):
+                for mask in self._probes:
+                    for idx in table.get(chunk ^ mask, ()):
+                        if idx in seen:
+                            continue
+                        seen.add(idx)
+                        dist = hamming(h, self._hashes[idx])
+                        if dist <= self.max_distance and (best is None or dist < best[1]):
+                            best = (self._results[idx], dist)
+            if best is not None:
+                self.matches += 1
+            return best
+
+    def _sync_entry(self, entry):
+        h = entry.get("phash")
+        # phash_match - вердикт взят у соседа по индексу, а не посчитан моделью для этого хэша
+        if not h or entry.get("phash_match") or entry.get("model_version") != self.model_version:
+            return False
+        result = {
+            "real_probability": entry["real_probability"],
+            "ai_probability": entry["ai_probability"],
+            "model_version": entry["model_version"],
+        }
+        h = int(h, 16)
+        with self._lock:
+            known = h in self._known
+        if not known:
+            self.add(h, result)
+        return not known
+
+    def sync_from_log(self, entries):
+        """Дозаполняет индекс записями журнала детекций, которых в нем еще нет"""
+        return sum(self._sync_entry(entry) for entry in entries)
+
+    @property
+    def cursor_path(self):
+        return self.path.with_name(self.path.name + ".cursor") if self.path else None
+
+    def _read_cursor(self):
+        try:
+            with open(self.cursor_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # Другая версия модели: записи до позиции в индекс не попадали
+        return saved.get("position") if saved.get("v") == self.model_version else None
+
+    def _write_cursor(self, position):
+        tmp = self.cursor_path.with_name(self.cursor_path.name + f".{os.getpid()}")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"v": self.model_version, "position": position}, f)
+        os.replace(tmp, self.cursor_path)
+
+    def sync_from_journal(self, journal):
+        """Как sync_from_log, но только по записям после сохраненной позиции журнала"""
+        if self.path is None:
+            return self.sync_from_log(journal.iter_entries())
+        start = position = self._read_cursor()
+        added = 0
+        for position, entry in journal.read_since(start):
+            added += self._sync_entry(entry)
+        if position != start:
+            self._write_cursor(position)
+        return added
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._hashes),
+                "max_distance": self.max_distance,
+                "lookups": self.lookups,
+                "matches": self.matches,
+            }
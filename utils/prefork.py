@@ -0,0 +1,147 @@
+import gc
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+
+def memory_usage(pid="self"):
+    """Память процесса в МБ из /proc/<pid>/smaps_rollup (только Linux).
+
+    pss - доля процесса с учетом разделяемых страниц, private - память,
+    которая принадлежит только этому процессу (цена еще одного воркера).
+    """
+    fields = {
+        "Rss": "rss", "Pss": "pss",
+        "Shared_Clean": "shared", "Shared_Dirty": "shared",
+        "Private_Clean": "private", "Private_Dirty": "private",
+    }
+    usage = {"rss": 0.0, "pss": 0.0, "shared": 0.0, "private": 0.0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+            for line in f:
+                name, _, rest = line.partition(":")
+                if name in fields:
+                    usage[fields[name]] += int(rest.split()[0]) / 1024
+    except OSError:
+        return None
+    return {k: round(v, 1) for k, v in usage.items()}
+
+
+def bind_socket(host, port):
+    # proto=IPPROTO_TCP обязателен: иначе asyncio не ставит TCP_NODELAY на принятые
+    # соединения, и ответы ждут ~40 мс из-за Nagle и отложенного ACK
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM,
+                         socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def bind_unix_socket(path):
+    # Старый файл сокета от прошлого запуска мешает bind
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    os.chmod(path, 0o660)
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _limit_torch_threads(threads):
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Можно задать только до первой параллельной операции
+        pass
+
+
+def serve_prefork(app, host, port, workers, preload, threads_per_worker=None,
+                  sockets=None, report_delay=10):
+    """Грузит модели один раз в родителе и форкает workers процессов uvicorn.
+
+    Веса моделей после fork разделяются между воркерами copy-on-write: тензоры
+    только читаются, поэтому их страницы не копируются. gc.freeze() убирает
+    объекты родителя из обхода сборщика мусора, чтобы он не трогал их страницы.
+    Каждый воркер получает cpu_count // workers потоков torch, чтобы воркеры
+    не дрались за ядра.
+    """
+    sockets = sockets or [bind_socket(host, port)]
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+    # В родителе torch работает в один поток: пул потоков OpenMP не переживает fork
+    _limit_torch_threads(1)
+    started = time.perf_counter()
+    preload()
+    parent_memory = memory_usage()
+    print(f"✅ Модели загружены в родителе за {time.perf_counter() - started:.1f} с, память: {parent_memory}")
+
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+    stopping = False
+
+    def spawn(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            os.environ["WORKER_ID"] = str(worker_id)
+            _limit_torch_threads(threads)
+            config = uvicorn.Config(app, log_level="info")
+            uvicorn.Server(config).run(sockets=sockets)
+            os._exit(0)
+        children[pid] = worker_id
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+    print(f"🚀 Запущено воркеров: {workers}, потоков torch на воркер: {threads}")
+
+    report_at = time.monotonic() + report_delay
+    while children:
+        if report_at and time.monotonic() >= report_at:
+            report_at = None
+            for pid, worker_id in sorted(children.items(), key=lambda item: item[1]):
+                usage = memory_usage(pid)
+                if usage:
+                    print(f"📊 Воркер {worker_id} (pid {pid}): собственная память {usage['private']} МБ, "
+                          f"общая {usage['shared']} МБ, PSS {usage['pss']} МБ")
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        if pid == 0:
+            time.sleep(0.5)
+            continue
+
+        worker_id = children.pop(pid, None)
+        if worker_id is not None and not stopping:
+            print(f"⚠️ Воркер {worker_id} (pid {pid}) завершился с кодом {status}, перезапуск")
+            spawn(worker_id)
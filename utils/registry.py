@@ -0,0 +1,172 @@
+import asyncio
+import importlib
+import threading
+import time
+
+
+def load_class(path):
+    """'module:Class' -> класс"""
+    module_name, _, class_name = path.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _batch_fn(detector):
+    if hasattr(detector, "predict_batch"):
+        return detector.predict_batch
+    return lambda images: [detector.predict(image) for image in images]
+
+
+class ModelRegistry:
+    """Именованные детекторы изображений и ансамбли из них.
+
+    Каждая модель идет через свой BatchScheduler. Ансамбль опрашивает
+    участников параллельно и усредняет ai_probability с весами; участник,
+    не уложившийся в свой budget_ms или вернувший ошибку, выбрасывается из
+    ответа. Такой неполный результат помечается partial и не кэшируется.
+
+    Конфиг (JSON):
+        {"default": "ensemble",
+         "models": {"vit": {"class": "model_advanced:AIImageDetector", "budget_ms": 800}},
+         "ensembles": {"ensemble": {"members": {"default": {"weight": 2}, "vit": {"budget_ms": 500}}}}}
+    """
+
+    def __init__(self, make_batcher, default="default"):
+        self.make_batcher = make_batcher
+        self.default = default
+        self.models = {}
+        self.ensembles = {}
+        self._lock = threading.Lock()
+        self._dropped = {}
+
+    def register(self, name, detector, batcher=None, budget_ms=None, weight=1.0):
+        self.models[name] = {
+            "detector": detector,
+            "batcher": batcher or self.make_batcher(_batch_fn(detector), name),
+            "budget_ms": budget_ms,
+            "weight": weight,
+        }
+
+    def add_ensemble(self, name, members, budget_ms=None):
+        if isinstance(members, (list, tuple)):
+            members = {member: {} for member in members}
+        unknown = [member for member in members if member not in self.models]
+        if unknown:
+            raise ValueError(f"Ансамбль {name}: неизвестные модели {unknown}")
+        self.ensembles[name] = {
+            member: {
+                "weight": options.get("weight", self.models[member]["weight"]),
+                "budget_ms": options.get("budget_ms", self.models[member]["budget_ms"] or budget_ms),
+            }
+            for member, options in members.items()
+        }
+
+    def configure(self, config):
+        for name, options in config.get("models", {}).items():
+            detector = load_class(options["class"])(**options.get("kwargs", {}))
+            self.register(name, detector, budget_ms=options.get("budget_ms"), weight=options.get("weight", 1.0))
+        for name, options in config.get("ensembles", {}).items():
+            self.add_ensemble(name, options["members"], options.get("budget_ms"))
+        self.default = config.get("default", self.default)
+        self.resolve(self.default)
+
+    def names(self):
+        return list(self.models) + list(self.ensembles)
+
+    def resolve(self, name=None):
+        name = name or self.default
+        if name not in self.models and name not in self.ensembles:
+            raise KeyError(f"Неизвестная модель: {name}. Доступны: {', '.join(self.names())}")
+        return name
+
+    def version(self, name):
+        """Версия для ключа кэша: у ансамбля зависит от всех участников"""
+        if name in self.models:
+            detector = self.models[name]["detector"]
+            return getattr(detector, "model_version", type(detector).__name__)
+        members = "+".join(f"{member}={self.version(member)}" for member in self.ensembles[name])
+        return f"ensemble:{name}:{members}"
+
+    def detectors(self):
+        return [entry["detector"] for entry in self.models.values()]
+
+    def status(self):
+        models = {}
+        for name, entry in self.models.items():
+            detector = entry["detector"]
+            models[name] = detector.status() if hasattr(detector, "status") else {"state": "ready"}
+        return models
+
+    async def predict(self, name, image):
+        if name in self.models:
+            return await self.models[name]["batcher"].run(image)
+        return await self._predict_ensemble(name, image)
+
+    async def _run_member(self, name, image, budget_ms):
+        started = time.perf_counter()
+        run = self.models[name]["batcher"].run(image)
+        try:
+            result = await (asyncio.wait_for(run, budget_ms / 1000) if budget_ms else run)
+        except asyncio.TimeoutError:
+            return None, "timeout", time.perf_counter() - started
+        except Exception as e:
+            return None, f"error: {e}", time.perf_counter() - started
+        if not isinstance(result, dict) or result.get("model_version") == "fallback":
+            return None, "error: модель не вернула оценку", time.perf_counter() - started
+        return result, None, time.perf_counter() - started
+
+    async def _predict_ensemble(self, name, image):
+        members = self.ensembles[name]
+        outcomes = await asyncio.gather(
+            *(self._run_member(member, image, options["budget_ms"]) for member, options in members.items())
+        )
+
+        report, total, weights, base = {}, 0.0, 0.0, None
+        for (member, options), (result, reason, elapsed) in zip(members.items(), outcomes):
+            report[member] = {"latency_ms": round(elapsed * 1000, 1)}
+            if result is None:
+                report[member]["dropped"] = reason
+                with self._lock:
+                    self._dropped[member] = self._dropped.get(member, 0) + 1
+                continue
+            ai_prob = float(result["ai_probability"])
+            report[member].update(ai_probability=ai_prob, weight=options["weight"])
+            total += ai_prob * options["weight"]
+            weights += options["weight"]
+            base = base or result
+
+        if base is None or weights <= 0:
+            detector = next(
+                (self.models[m]["detector"] for m in members if hasattr(self.models[m]["detector"], "fallback")),
+                None,
+            )
+            if detector is not None:
+                result = detector.fallback(image, "Ни одна модель ансамбля не ответила")
+            else:
+                result = {"real_probability": 0.5, "ai_probability": 0.5, "model_version": "fallback"}
+            result["members"] = report
+            return result
+
+        ai_prob = total / weights
+        real_prob = 1.0 - ai_prob
+        return {
+            **base,
+            "real_probability": real_prob,
+            "ai_probability": ai_prob,
+            "is_real": real_prob > 0.5,
+            "confidence": max(ai_prob, real_prob),
+            "watermark": "Прошло проверку" if real_prob > 0.5 else "AI Генерация",
+            "model_version": f"ensemble:{name}",
+            "members": report,
+            "partial": any("dropped" in r for r in report.values()),
+        }
+
+    def stats(self):
+        with self._lock:
+            dropped = dict(self._dropped)
+        return {
+            "default": self.default,
+            "models": list(self.models),
+            "ensembles": {name: list(members) for name, members in self.ensembles.items()},
+            "dropped": dropped,
+            "batching": {name: entry["batcher"].stats() for name, entry in self.models.items()},
+        }
@@ -0,0 +1,75 @@
+import json
+import uuid
+from urllib.parse import quote
+
+from fastapi.responses import StreamingResponse
+
+# json      - как раньше: оценки + image_base64 в JSON
+# binary    - тело ответа - сам JPEG, оценки в заголовках X-*
+# multipart - multipart/mixed: часть с JSON и часть с JPEG
+# scores    - только оценки, без водяного знака и кодирования JPEG
+RESPONSE_MODES = ("json", "binary", "multipart", "scores")
+
+SCORE_HEADERS = ["X-Real-Probability", "X-AI-Probability", "X-Watermark", "X-Model-Version"]
+
+CHUNK_SIZE = 64 * 1024
+
+
+def choose_mode(mode, accept):
+    """Режим ответа: явный ?mode= важнее заголовка Accept"""
+    if mode:
+        if mode not in RESPONSE_MODES:
+            raise ValueError(f"Неизвестный режим ответа: {mode}")
+        return mode
+    accept = (accept or "").lower()
+    if "image/jpeg" in accept:
+        return "binary"
+    if "multipart/mixed" in accept:
+        return "multipart"
+    return "json"
+
+
+def score_headers(data: dict) -> dict:
+    # Заголовки HTTP - только latin-1, поэтому русский текст кодируем в URL-формат
+    return {
+        "X-Real-Probability": str(data["real_probability"]),
+        "X-AI-Probability": str(data["ai_probability"]),
+        "X-Watermark": quote(data["watermark"]),
+        "X-Model-Version": quote(str(data.get("model_version", ""))),
+    }
+
+
+def _chunks(payload: bytes):
+    view = memoryview(payload)
+    for start in range(0, len(view), CHUNK_SIZE):
+        yield view[start:start + CHUNK_SIZE]
+
+
+def jpeg_response(jpeg_bytes: bytes, data: dict) -> StreamingResponse:
+    headers = score_headers(data)
+    headers["Content-Length"] = str(len(jpeg_bytes))
+    return StreamingResponse(_chunks(jpeg_bytes), media_type="image/jpeg", headers=headers)
+
+
+def multipart_response(jpeg_bytes: bytes, data: dict) -> StreamingResponse:
+    boundary = uuid.uuid4().hex
+
+    def parts():
+        yield (
+            f"--{boundary}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n\r\n"
+        ).encode()
+        yield json.dumps(data, ensure_ascii=False).encode("utf-8")
+        yield (
+            f"\r\n--{boundary}\r\n"
+            "Content-Type: image/jpeg\r\n"
+            'Content-Disposition: attachment; filename="watermarked.jpg"\r\n\r\n'
+        ).encode()
+        yield from _chunks(jpeg_bytes)
+        yield f"\r\n--{boundary}--\r\n".encode()
+
+    return StreamingResponse(
+        parts(),
+        media_type=f"multipart/mixed; boundary={boundary}",
+        headers=score_headers(data),
+    )
@@ -0,0 +1,182 @@
+import asyncio
+import glob
+import logging
+import os
+from collections import Counter
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+class StatsStore:
+    """Счетчики проверок бота: одно соединение SQLite и пакетная запись.
+
+    record_check() только увеличивает счетчики в памяти и дописывает строку
+    "<seq> <user_id>" в журнал. Раз в flush_interval секунд накопленное
+    записывается в базу одной транзакцией вместе с номером последней
+    примененной записи (stats_seq в global_stats), после чего журнал
+    удаляется. Если процесс упал между сбросами, при открытии журнал
+    проигрывается заново, а записи с seq <= stats_seq пропускаются - так
+    ни одна проверка не теряется и не считается дважды.
+    Общее число проверок хранится в памяти и не требует запроса к базе.
+    """
+
+    def __init__(self, db_path, log_path=None, flush_interval=2.0):
+        self.db_path = str(db_path)
+        self.log_path = str(log_path or f"{db_path}-pending")
+        self.flush_interval = flush_interval
+
+        self._db = None
+        self._log = None
+        self._segment = 0
+        self._sealed = []
+        self._seq = 0
+        self._total = 0
+        self._pending = Counter()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+        self.flushes = 0
+        self.flushed_checks = 0
+        self.replayed = 0
+
+    async def open(self):
+        self._db = await aiosqlite.connect(self.db_path)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.execute('''CREATE TABLE IF NOT EXISTS users
+            (id INTEGER PRIMARY KEY, checks_count INTEGER DEFAULT 0)''')
+        await self._db.execute('''CREATE TABLE IF NOT EXISTS global_stats
+            (name TEXT PRIMARY KEY, value INTEGER DEFAULT 0)''')
+        await self._db.execute("INSERT OR IGNORE INTO global_stats (name, value) VALUES ('total_checks', 0)")
+        await self._db.execute("INSERT OR IGNORE INTO global_stats (name, value) VALUES ('stats_seq', 0)")
+        await self._db.commit()
+
+        async with self._db.execute("SELECT name, value FROM global_stats") as cursor:
+            values = dict(await cursor.fetchall())
+        self._total = values["total_checks"]
+        self._seq = values["stats_seq"]
+
+        self._replay()
+        self._open_segment()
+        await self.flush()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    def _segments(self):
+        return sorted(glob.glob(glob.escape(self.log_path) + ".*"))
+
+    def _replay(self):
+        # Журналы, не попавшие в базу из-за падения процесса
+        applied = self._seq
+        for path in self._segments():
+            self._segment = max(self._segment, int(path.rsplit(".", 1)[1]))
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        seq, user_id = map(int, line.split())
+                    except ValueError:
+                        # Недописанная строка в момент падения
+                        continue
+                    self._seq = max(self._seq, seq)
+                    if seq > applied:
+                        self._pending[user_id] += 1
+                        self._total += 1
+                        self.replayed += 1
+            self._sealed.append(path)
+        if self.replayed:
+            logger.info(f"♻️ Восстановлено несохраненных проверок: {self.replayed}")
+
+    def _open_segment(self):
+        if self._log is not None:
+            self._log.close()
+            self._sealed.append(self._log.name)
+        self._segment += 1
+        self._log = open(f"{self.log_path}.{self._segment:06d}", "a", buffering=1)
+
+    def record_check(self, user_id):
+        self._seq += 1
+        self._log.write(f"{self._seq} {user_id}\n")
+        self._pending[user_id] += 1
+        self._total += 1
+
+    def total_checks(self):
+        return self._total
+
+    async def get_user_checks(self, user_id):
+        # Под замком сброса: иначе запись в полете можно посчитать дважды или ни разу
+        async with self._flush_lock:
+            async with self._db.execute("SELECT checks_count FROM users WHERE id = ?", (user_id,)) as cursor:
+                row = await cursor.fetchone()
+            return (row[0] if row else 0) + self._pending[user_id]
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending and not self._sealed:
+                return
+            pending, self._pending = self._pending, Counter()
+            seq = self._seq
+            # Новые проверки пишутся в новый журнал, старые удалим после коммита
+            self._open_segment()
+            sealed, self._sealed = self._sealed, []
+            try:
+                await self._db.executemany(
+                    "INSERT INTO users (id, checks_count) VALUES (?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET checks_count = checks_count + excluded.checks_count",
+                    list(pending.items()),
+                )
+                await self._db.execute(
+                    "UPDATE global_stats SET value = value + ? WHERE name = 'total_checks'",
+                    (sum(pending.values()),),
+                )
+                await self._db.execute(
+                    "UPDATE global_stats SET value = ? WHERE name = 'stats_seq'", (seq,)
+                )
+                await self._db.commit()
+            except Exception:
+                await self._db.rollback()
+                # Вернем в очередь: журналы остались, при падении они тоже проиграются
+                self._pending.update(pending)
+                self._sealed = sealed + self._sealed
+                raise
+            for path in sealed:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self.flushes += 1
+            self.flushed_checks += sum(pending.values())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи статистики: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Проверки, записанные во время await внутри flush, уходят в новый журнал:
+        # сбрасываем, пока они есть, и только потом удаляем последний журнал
+        while True:
+            await self.flush()
+            if not self._pending:
+                break
+        if self._log is not None:
+            self._log.close()
+            os.remove(self._log.name)
+            self._log = None
+        await self._db.close()
+
+    def stats(self):
+        return {
+            "total_checks": self._total,
+            "pending": sum(self._pending.values()),
+            "flushes": self.flushes,
+            "flushed_checks": self.flushed_checks,
+            "replayed": self.replayed,
+        }
@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI
+
+from utils.admission import (
+    AdmissionController, AdmissionMiddleware, TokenBucket, api_key_client, client_id, current_client,
+    parse_trusted_proxies,
+)
+from utils.detector_client import DetectorClient
+
+
+def test_token_bucket_burst_and_refill():
+    bucket = TokenBucket(rate=2.0, burst=3.0, now=0.0)
+    assert [bucket.take(1, 0.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take(1, 0.0) == 0.5
+    # За полсекунды накопился один токен
+    assert bucket.take(1, 0.5) == 0.0
+    # Запас не растет выше burst
+    bucket.take(0, 100.0)
+    assert bucket.tokens == 3.0
+
+
+def test_token_bucket_cost_above_burst_is_capped():
+    bucket = TokenBucket(rate=1.0, burst=2.0, now=0.0)
+    assert bucket.take(10, 0.0) == 0.0
+    assert bucket.take(1, 0.0) == 1.0
+
+
+def test_token_bucket_charge_debt_is_bounded():
+    bucket = TokenBucket(rate=1.0, burst=4.0, now=0.0)
+    bucket.charge(100, 0.0)
+    assert bucket.tokens == -4.0
+    assert bucket.take(1, 0.0) == 5.0
+
+
+def test_controller_limits_each_client_separately():
+    controller = AdmissionController(rate=1.0, burst=2.0, weights={"vip": 3.0})
+    assert [controller.admit("a") for _ in range(3)][-1] > 0
+    assert controller.admit("b") == 0.0
+    assert all(controller.admit("vip") == 0.0 for _ in range(6))
+    stats = controller.stats()
+    assert stats["rejected"] == 1 and stats["top_rejected"] == {"a": 1}
+
+
+def test_controller_evicts_oldest_clients():
+    controller = AdmissionController(rate=1.0, burst=1.0, max_clients=2)
+    for client in ("a", "b", "c"):
+        controller.admit(client)
+    assert controller.stats()["clients"] == 2
+    # Вытесненный клиент начинает с полным ведром
+    assert controller.admit("a") == 0.0
+
+
+def scope(host, **headers):
+    return {
+        "client": (host, 1234) if host else None,
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    }
+
+
+def test_client_id_trusts_forwarded_id_only_from_trusted_proxies():
+    trusted = parse_trusted_proxies("10.0.0.0/8,unix")
+    assert client_id(scope("10.1.2.3", x_client_id="tg:1"), trusted) == "tg:1"
+    assert client_id(scope(None, x_client_id="tg:1"), trusted) == "tg:1"
+    assert client_id(scope("127.0.0.1", x_client_id="tg:1"), trusted) == "ip:127.0.0.1"
+    # Без TRUSTED_PROXIES заголовок не принимается ни от кого
+    assert client_id(scope("10.1.2.3", x_client_id="tg:1")) == "ip:10.1.2.3"
+    assert client_id(scope("8.8.8.8", x_api_key="secret")) == api_key_client("secret")
+
+
+def test_bot_client_id_reaches_server_over_uds(tmp_path):
+    # Путь бота: DetectorClient -> Unix-сокет -> AdmissionMiddleware с TRUSTED_PROXIES по умолчанию
+    app = FastAPI()
+
+    @app.post("/detect-text")
+    async def detect_text():
+        return {"client": current_client()[0]}
+
+    controller = AdmissionController(rate=1, burst=1)
+    wrapped = AdmissionMiddleware(app, controller, {"/detect-text": 1}, parse_trusted_proxies("unix"))
+    path = str(tmp_path / "detector.sock")
+    server = uvicorn.Server(uvicorn.Config(wrapped, uds=path, log_level="warning", lifespan="off"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+
+    async def ask():
+        detector = DetectorClient(uds=path, retries=0)
+        try:
+            first = await detector.detect_text("привет", client="tg:42")
+            second = await detector.detect_text("привет", client="tg:42")
+            other = await detector.detect_text("привет", client="tg:7")
+            return first, second, other
+        finally:
+            await detector.aclose()
+
+    try:
+        deadline = time.monotonic() + 10
+        while not server.started:
+            assert time.monotonic() < deadline, "сервер не запустился"
+            time.sleep(0.02)
+        first, second, other = asyncio.run(ask())
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    assert first.json() == {"client": "tg:42"}
+    # У каждого пользователя Telegram свой бакет, а не общий ip:127.0.0.1
+    assert second.status_code == 429
+    assert other.json() == {"client": "tg:7"}
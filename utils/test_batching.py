@@ -0,0 +1,151 @@
+import threading
+from concurrent.futures import CancelledError
+
+import pytest
+
+from utils.batching import BatchScheduler, FairQueue, TextBatchScheduler
+from utils.executor import Overloaded
+
+
+def blocking_scheduler(**kwargs):
+    """Батчер, который держит первый батч, пока тест не отпустит release"""
+    started, release, seen = threading.Event(), threading.Event(), []
+
+    def batch_fn(items):
+        seen.append(list(items))
+        started.set()
+        release.wait(5)
+        return [item * 10 for item in items]
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=4, max_wait_ms=0, **kwargs)
+    return scheduler, started, release, seen
+
+
+def test_results_keep_order():
+    scheduler = BatchScheduler(lambda items: [item + 1 for item in items], max_batch_size=8, max_wait_ms=20)
+    futures = [scheduler.submit(i) for i in range(5)]
+    assert [f.result(5) for f in futures] == [1, 2, 3, 4, 5]
+    assert scheduler.stats()["items"] == 5
+
+
+def test_cancelled_request_is_skipped():
+    scheduler, started, release, seen = blocking_scheduler()
+    first = scheduler.submit(1)
+    assert started.wait(5)
+    cancelled = scheduler.submit(2)
+    kept = scheduler.submit(3)
+    assert cancelled.cancel()
+    release.set()
+
+    assert first.result(5) == 10
+    assert kept.result(5) == 30
+    with pytest.raises(CancelledError):
+        cancelled.result(0)
+    # Отмененный в очереди запрос не попадает в модель
+    assert [item for batch in seen for item in batch] == [1, 3]
+
+
+def test_full_queue_raises_overloaded():
+    scheduler, started, release, _ = blocking_scheduler(max_queue=1, retry_after=7)
+    running = scheduler.submit(1)
+    assert started.wait(5)
+    queued = scheduler.submit(2)
+    with pytest.raises(Overloaded) as error:
+        scheduler.submit(3)
+    assert error.value.retry_after == 7
+    assert scheduler.stats()["rejected"] == 1
+
+    release.set()
+    assert running.result(5) == 10
+    assert queued.result(5) == 20
+
+
+def test_failed_batch_is_retried_per_item():
+    def batch_fn(items):
+        if "bad" in items:
+            raise ValueError("битый элемент")
+        return [item.upper() for item in items]
+
+    scheduler = BatchScheduler(batch_fn, max_batch_size=8, max_wait_ms=50)
+    futures = [scheduler.submit(item) for item in ("a", "bad", "c")]
+
+    assert futures[0].result(5) == "A"
+    assert futures[2].result(5) == "C"
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert scheduler.stats()["split_batches"] == 1
+
+
+def plan_lengths(scheduler, lengths):
+    entries = [(["t"] * length, None, 0.0) for length in lengths]
+    return [[len(entry[0]) for entry in batch] for batch in scheduler._plan(entries)]
+
+
+def test_text_plan_groups_by_length_bucket():
+    scheduler = TextBatchScheduler(lambda items: items, max_tokens=10_000, bucket_edges=(16, 64, 512))
+    batches = plan_lengths(scheduler, [300, 10, 50, 12, 400, 60])
+    # Короткие корзины первыми, внутри корзины - по возрастанию длины
+    assert batches == [[10, 12], [50, 60], [300, 400]]
+
+
+def test_text_plan_respects_padded_token_budget():
+    scheduler = TextBatchScheduler(lambda items: items, max_tokens=100, bucket_edges=(512,))
+    batches = plan_lengths(scheduler, [30, 10, 20, 40, 25])
+    assert batches == [[10, 20, 25], [30, 40]]
+    for batch in batches:
+        assert max(batch) * len(batch) <= 100
+    stats = scheduler.stats()
+    assert stats["tokens"] == 125
+    assert stats["padded_tokens"] == 25 * 3 + 40 * 2
+
+
+def test_text_plan_keeps_oversized_text_alone():
+    scheduler = TextBatchScheduler(lambda items: items, max_tokens=64, bucket_edges=(512,))
+    assert plan_lengths(scheduler, [500, 8]) == [[8], [500]]
+
+
+def test_text_scheduler_returns_results_per_request():
+    scheduler = TextBatchScheduler(
+        lambda items: [len(item) for item in items], max_tokens=32, max_wait_ms=20, bucket_edges=(4, 16)
+    )
+    futures = [scheduler.submit("x" * n) for n in (3, 12, 2, 15)]
+    assert [f.result(5) for f in futures] == [3, 12, 2, 15]
+    assert scheduler.stats()["batches"] >= 2
+
+
+def drain(fair_queue):
+    items = []
+    while fair_queue.qsize():
+        items.append(fair_queue.get_nowait())
+    return items
+
+
+def test_fair_queue_interleaves_clients():
+    fair_queue = FairQueue()
+    for i in range(6):
+        fair_queue.put(f"A{i}", "A")
+    for i in range(2):
+        fair_queue.put(f"B{i}", "B")
+    # Запросы B не ждут всю очередь A
+    assert drain(fair_queue) == ["A0", "B0", "A1", "B1", "A2", "A3", "A4", "A5"]
+
+
+def test_fair_queue_weights():
+    fair_queue = FairQueue()
+    for i in range(6):
+        fair_queue.put(f"A{i}", "A", weight=2.0)
+        fair_queue.put(f"B{i}", "B", weight=1.0)
+    order = drain(fair_queue)[:6]
+    assert sum(item.startswith("A") for item in order) == 4
+
+
+def test_fair_queue_forgets_idle_client():
+    fair_queue = FairQueue()
+    for i in range(3):
+        fair_queue.put(f"A{i}", "A")
+    assert drain(fair_queue) == ["A0", "A1", "A2"]
+    assert fair_queue.clients() == 0
+    # Прошлые запросы клиента не отодвигают его новый запрос за чужие
+    fair_queue.put("B0", "B")
+    fair_queue.put("A3", "A")
+    assert drain(fair_queue) == ["B0", "A3"]
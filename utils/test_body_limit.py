@@ -0,0 +1,76 @@
+import asyncio
+
+from fastapi import FastAPI, File, UploadFile
+
+from utils.body_limit import BodyLimitMiddleware
+
+CHUNK = b"x" * 1024
+
+
+def make_app():
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    @app.post("/other")
+    async def other(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    return BodyLimitMiddleware(app, limits={"/upload": 8 * 1024})
+
+
+def multipart(size):
+    head = (b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.png\"\r\n"
+            b"Content-Type: image/png\r\n\r\n")
+    return head + b"x" * size + b"\r\n--b--\r\n"
+
+
+def call(app, path, body, content_length=True, chunk=1024):
+    """Прогоняет запрос через ASGI и возвращает (статус, сколько байт тела прочитано)"""
+    headers = [(b"content-type", b"multipart/form-data; boundary=b")]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    scope = {"type": "http", "method": "POST", "path": path, "raw_path": path.encode(),
+             "query_string": b"", "headers": headers, "http_version": "1.1",
+             "scheme": "http", "server": ("test", 80), "client": ("127.0.0.1", 1), "root_path": ""}
+    parts = [body[i:i + chunk] for i in range(0, len(body), chunk)]
+    consumed = 0
+    sent = []
+
+    async def receive():
+        nonlocal consumed
+        if consumed < len(parts):
+            consumed += 1
+            return {"type": "http.request", "body": parts[consumed - 1], "more_body": consumed < len(parts)}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    read = sum(len(part) for part in parts[:consumed])
+    return sent[0]["status"], read
+
+
+def test_declared_length_rejected_before_reading():
+    status, read = call(make_app(), "/upload", multipart(64 * 1024))
+    assert status == 413
+    assert read == 0
+
+
+def test_chunked_body_aborted_at_limit():
+    body = multipart(64 * 1024)
+    status, read = call(make_app(), "/upload", body, content_length=False)
+    assert status == 413
+    # Чтение оборвано на первом куске сверх лимита, остаток тела не прочитан
+    assert read <= 8 * 1024 + 1024
+    assert read < len(body)
+
+
+def test_small_body_and_other_paths_pass():
+    app = make_app()
+    assert call(app, "/upload", multipart(4 * 1024), content_length=False)[0] == 200
+    assert call(app, "/other", multipart(64 * 1024))[0] == 200
+    assert app.rejected == 0
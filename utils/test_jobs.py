@@ -0,0 +1,95 @@
+import threading
+import time
+
+from utils.jobs import DONE, EXPIRED, FAILED, PRIORITY_BULK, PRIORITY_INTERACTIVE, QUEUED, RUNNING, JobStore
+
+
+def make_store(tmp_path, **kwargs):
+    return JobStore(tmp_path / "jobs.db", **kwargs)
+
+
+def test_claim_takes_highest_priority_first(tmp_path):
+    store = make_store(tmp_path)
+    bulk = store.submit("text", b"bulk", priority=PRIORITY_BULK)
+    interactive = store.submit("text", b"short", priority=PRIORITY_INTERACTIVE)
+
+    assert store.claim()["id"] == interactive
+    # Воркер только для интерактивных задач пакетную не берет
+    assert store.claim(min_priority=PRIORITY_INTERACTIVE) is None
+    job = store.claim()
+    assert job["id"] == bulk
+    assert job["attempts"] == 1
+    assert store.get(bulk)["status"] == RUNNING
+    assert store.claim() is None
+
+
+def test_job_is_claimed_once_across_connections(tmp_path):
+    stores = [make_store(tmp_path) for _ in range(4)]
+    ids = {stores[0].submit("text", str(i).encode()) for i in range(20)}
+    claimed, lock = [], threading.Lock()
+
+    def drain(store):
+        while (job := store.claim()) is not None:
+            with lock:
+                claimed.append(job["id"])
+
+    threads = [threading.Thread(target=drain, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(ids)
+
+
+def test_expired_lease_returns_job_to_queue(tmp_path):
+    store = make_store(tmp_path, lease=0.05)
+    job_id = store.submit("text", b"x")
+    first = store.claim()
+    time.sleep(0.1)
+    store.housekeeping()
+    assert store.get(job_id)["status"] == QUEUED
+
+    second = store.claim()
+    assert second["attempts"] == 2
+    # Воркер, у которого отобрали аренду, не перезаписывает результат
+    assert not store.renew(job_id, first["attempts"])
+    store.complete(job_id, {"stale": True}, first["attempts"])
+    assert store.get(job_id)["status"] == RUNNING
+    store.complete(job_id, {"ok": True}, second["attempts"])
+    assert store.get(job_id)["status"] == DONE
+    assert store.get(job_id)["result"] == {"ok": True}
+
+
+def test_renewed_lease_is_kept(tmp_path):
+    store = make_store(tmp_path, lease=0.2)
+    job_id = store.submit("text", b"x")
+    job = store.claim()
+    for _ in range(3):
+        time.sleep(0.1)
+        assert store.renew(job_id, job["attempts"])
+        store.housekeeping()
+    assert store.get(job_id)["status"] == RUNNING
+
+
+def test_fail_retries_then_gives_up(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.submit("text", b"x", max_attempts=2)
+    job = store.claim()
+    store.fail(job_id, "boom", job["attempts"], job["max_attempts"], backoff=0.05)
+    assert store.get(job_id)["status"] == QUEUED
+    # Повтор доступен только после задержки
+    assert store.claim() is None
+    time.sleep(0.1)
+    job = store.claim()
+    store.fail(job_id, "boom", job["attempts"], job["max_attempts"])
+    assert store.get(job_id)["status"] == FAILED
+    assert store.get(job_id)["error"] == "boom"
+
+
+def test_unclaimed_job_expires(tmp_path):
+    store = make_store(tmp_path)
+    job_id = store.submit("text", b"x", ttl=0.05)
+    time.sleep(0.1)
+    assert store.claim() is None
+    store.housekeeping()
+    assert store.get(job_id)["status"] == EXPIRED
@@ -0,0 +1,35 @@
+import io
+
+import pytest
+from PIL import Image
+
+from utils.media import UnsupportedMedia, media_kind, sample_frames
+
+
+def encode(frames, fmt):
+    buf = io.BytesIO()
+    frames[0].save(buf, fmt, save_all=len(frames) > 1, append_images=frames[1:])
+    return buf.getvalue()
+
+
+def test_media_kind_by_header():
+    still = encode([Image.new("RGB", (32, 32), "red")], "PNG")
+    animation = encode([Image.new("RGB", (32, 32), color) for color in ("red", "green", "blue")], "GIF")
+    assert media_kind(still) == "image"
+    assert media_kind(animation) == "animation"
+    assert media_kind(b"\x00\x00\x00\x18ftypmp42") == "video"
+    assert media_kind(b"definitely not an image") == "unknown"
+
+
+def test_garbage_is_unsupported_not_broken_image():
+    # UnsupportedMedia /detect-media отдает как 415, а не 500 от UnidentifiedImageError
+    with pytest.raises(UnsupportedMedia):
+        sample_frames(b"definitely not an image", budget=4)
+
+
+def test_sample_frames_from_animation():
+    animation = encode([Image.new("RGB", (32, 32), (i * 40, 0, 0)) for i in range(6)], "GIF")
+    sample = sample_frames(animation, budget=3, min_side=16)
+    assert sample["kind"] == "animation"
+    assert sample["length"] == 6
+    assert [frame["position"] for frame in sample["frames"]] == [1, 3, 5]
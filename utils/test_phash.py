@@ -0,0 +1,41 @@
+from utils.journal import DetectionJournal
+from utils.phash import NearDuplicateIndex
+
+VERSION = "v2.0"
+
+
+def entry(h, ai, **extra):
+    return {"type": "image", "phash": f"{h:016x}", "model_version": VERSION,
+            "real_probability": 1 - ai, "ai_probability": ai, **extra}
+
+
+def write(journal, *entries):
+    for item in entries:
+        journal.write(item)
+    journal.flush()
+
+
+def test_resync_skips_borrowed_verdicts(tmp_path):
+    journal = DetectionJournal(tmp_path / "logs", flush_interval=0.01)
+    write(
+        journal,
+        entry(0xF0F0, 0.9),
+        # Оценка соседа на расстоянии 1 - в индекс не должна попасть как своя
+        entry(0xF0F1, 0.9, phash_match=True),
+        entry(0x0F0F, 0.1, model_version="old"),
+    )
+    index = NearDuplicateIndex(tmp_path / "phash_index.jsonl", model_version=VERSION)
+
+    assert index.sync_from_journal(journal) == 1
+    assert index.stats()["entries"] == 1
+    assert index.search(0xF0F0)[1] == 0
+
+    # Второй старт читает только новые записи после сохраненной позиции
+    write(journal, entry(0xFF00, 0.2), entry(0xFF01, 0.2, phash_match=True))
+    restarted = NearDuplicateIndex(tmp_path / "phash_index.jsonl", model_version=VERSION)
+    assert restarted.stats()["entries"] == 1
+    assert restarted.sync_from_journal(journal) == 1
+    assert restarted.sync_from_journal(journal) == 0
+    assert restarted.stats()["entries"] == 2
+    assert restarted.search(0xFF01)[1] == 1
+    journal.close()
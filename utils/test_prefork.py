@@ -0,0 +1,80 @@
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Приложение с тем же устройством, что и main.py: журнал пишет фоновый поток
+# раз в flush_interval, а очередь дописывается при остановке в lifespan
+WORKER = textwrap.dedent("""
+    import sys
+    from contextlib import asynccontextmanager
+
+    from fastapi import FastAPI
+
+    from utils.journal import DetectionJournal
+    from utils.prefork import bind_unix_socket, serve_prefork
+
+    journal = DetectionJournal(sys.argv[1], flush_interval=3)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        journal.close()
+
+    app = FastAPI(lifespan=lifespan)
+
+    @app.post("/detect")
+    async def detect(score: int):
+        journal.write({"type": "text", "ai_score": score})
+        return {"success": True}
+
+    serve_prefork(app, None, None, workers=1, preload=lambda: None,
+                  sockets=[bind_unix_socket(sys.argv[2])], report_delay=0)
+""")
+
+
+def journal_lines(tmp_path):
+    return [line for path in sorted((tmp_path / "logs").glob("*.jsonl")) for line in path.read_text().splitlines()]
+
+
+def test_forked_worker_flushes_journal_on_shutdown(tmp_path):
+    script = tmp_path / "worker.py"
+    script.write_text(WORKER)
+    socket_path = str(tmp_path / "detector.sock")
+    parent = subprocess.Popen(
+        [sys.executable, str(script), str(tmp_path / "logs"), socket_path],
+        cwd=ROOT, env={**os.environ, "PYTHONPATH": str(ROOT)},
+    )
+    try:
+        with httpx.Client(transport=httpx.HTTPTransport(uds=socket_path), base_url="http://detector") as client:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    assert client.post("/detect", params={"score": 1}).json() == {"success": True}
+                    break
+                except httpx.TransportError:
+                    assert time.monotonic() < deadline, "воркер не запустился"
+                    time.sleep(0.1)
+            # Первая запись уходит на диск сразу, после нее писатель копит пачку flush_interval секунд
+            while not journal_lines(tmp_path):
+                assert time.monotonic() < deadline, "журнал не записан"
+                time.sleep(0.05)
+            client.post("/detect", params={"score": 2})
+        assert len(journal_lines(tmp_path)) == 1
+        parent.send_signal(signal.SIGTERM)
+        assert parent.wait(timeout=30) == 0
+    finally:
+        if parent.poll() is None:
+            parent.kill()
+
+    # Вторая запись ждала в очереди и дописана при остановке воркера
+    lines = journal_lines(tmp_path)
+    assert len(lines) == 2
+    assert '"ai_score": 2' in lines[1]
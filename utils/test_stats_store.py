@@ -0,0 +1,34 @@
+import asyncio
+
+from utils.stats_store import StatsStore
+
+
+def test_close_keeps_checks_recorded_during_flush(tmp_path):
+    db_path = tmp_path / "stats.db"
+
+    async def run():
+        store = StatsStore(db_path, flush_interval=3600)
+        await store.open()
+        store.record_check(1)
+
+        # Проверка приходит, пока flush ждет коммита в close()
+        commit = store._db.commit
+
+        async def commit_with_check():
+            store._db.commit = commit
+            store.record_check(2)
+            await commit()
+
+        store._db.commit = commit_with_check
+        await store.close()
+
+        reopened = StatsStore(db_path)
+        await reopened.open()
+        counts = (await reopened.get_user_checks(1), await reopened.get_user_checks(2))
+        total = reopened.total_checks()
+        await reopened.close()
+        return counts, total
+
+    assert asyncio.run(run()) == ((1, 1), 2)
+    # После закрытия журналов не остается: все уже в базе
+    assert not list(tmp_path.glob("stats.db-pending.*"))
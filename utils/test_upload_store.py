@@ -0,0 +1,61 @@
+import threading
+
+from utils.upload_store import UploadStore, content_hash
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+def test_known_upload_queues_index_update_only(tmp_path):
+    store = UploadStore(tmp_path / "store")
+    digest = content_hash(PNG)
+    store.put(digest, PNG, {"ai_probability": 0.1}, "v1")
+    store.flush()
+
+    entry = store.lookup(digest)
+    assert entry["hits"] == 1
+    assert store.path_for(digest, entry["ext"]).read_bytes() == PNG
+
+    # Повтор: байты файла не попадают в очередь, обновляется только индекс
+    store.put(digest, PNG, {"ai_probability": 0.2}, "v2", known=True)
+    store.flush()
+    entry = store.lookup(digest)
+    assert (entry["hits"], entry["result"], entry["result_version"]) == (2, {"ai_probability": 0.2}, "v2")
+    assert (store.stored, store.duplicates) == (1, 1)
+
+    # Файл, которого уже нет в индексе, без байтов не сохраняется
+    store.put(content_hash(b"other"), b"other", known=True)
+    store.flush()
+    assert store.lookup(content_hash(b"other")) is None
+    store.close()
+
+
+def test_stats_snapshot_is_reused_within_max_age(tmp_path):
+    store = UploadStore(tmp_path / "store")
+    first = store.stats()
+    store.put(content_hash(PNG), PNG)
+    store.flush()
+    assert store.stats(max_age=60) is first
+    assert store.stats()["entries"] == 1
+    store.close()
+
+
+def test_legacy_uploads_are_copied_once_by_concurrent_workers(tmp_path):
+    legacy = tmp_path / "uploads"
+    legacy.mkdir()
+    for i in range(20):
+        (legacy / f"20260117_{i:02d}_file.png").write_bytes(PNG + bytes([i]))
+
+    # Каждый "воркер" - свое хранилище и свое соединение с общим каталогом
+    stores = [UploadStore(tmp_path / "store") for _ in range(4)]
+    moved = []
+    threads = [threading.Thread(target=lambda s=s: moved.append(s.migrate_legacy(legacy))) for s in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(moved) == [0, 0, 0, 20]
+    assert stores[0].stats()["entries"] == 20
+    assert all(stats["duplicates"] == 0 for stats in (store.stats() for store in stores))
+    # Оригиналы остаются на месте
+    assert len(list(legacy.iterdir())) == 20
@@ -0,0 +1,104 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from utils.metrics import counter, histogram
+
+STAGE_SECONDS = histogram("detector_stage_seconds", "Время этапов обработки запроса", ["stage"])
+REQUESTS = counter("detector_requests_total", "HTTP-запросы", ["endpoint", "method", "status"])
+REQUEST_SECONDS = histogram("detector_request_seconds", "Время ответа на HTTP-запрос", ["endpoint"])
+
+_trace = contextvars.ContextVar("detector_trace", default=None)
+
+
+class Trace:
+    """Этапы одного запроса: имя -> (число вызовов, суммарное время).
+
+    Одноименные этапы складываются, поэтому размер не зависит от числа
+    картинок в пакетном запросе.
+    """
+
+    __slots__ = ("started", "spans")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+
+    def add(self, name, duration):
+        count, total = self.spans.get(name, (0, 0.0))
+        self.spans[name] = (count + 1, total + duration)
+
+    def server_timing(self):
+        """Значение заголовка Server-Timing (видно во вкладке Network браузера)"""
+        parts = []
+        for name, (count, total) in self.spans.items():
+            desc = f';desc="x{count}"' if count > 1 else ""
+            parts.append(f"{name};dur={total * 1000:.1f}{desc}")
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def span(name):
+    """Замер этапа: всегда в гистограмму, и в трейс запроса, если он идет.
+
+    Работает и в потоках пулов: BoundedExecutor переносит контекст запроса.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        STAGE_SECONDS.observe(duration, stage=name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(name, duration)
+
+
+class RequestMetricsMiddleware:
+    """ASGI-middleware: счетчики и время ответа по эндпоинтам, трейс этапов запроса.
+
+    Эндпоинт берется из шаблона маршрута (/jobs/{job_id}), а не из пути,
+    чтобы число меток не росло. При tracing этапы отдаются клиенту в
+    Server-Timing, а запросы дольше slow_ms печатаются в лог.
+    """
+
+    def __init__(self, app, tracing=True, slow_ms=0):
+        self.app = app
+        self.tracing = tracing
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        trace = Trace() if self.tracing else None
+        token = _trace.set(trace)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace is not None and trace.spans:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            duration = time.perf_counter() - started
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or "unmatched"
+            REQUESTS.inc(endpoint=endpoint, method=scope["method"], status=status)
+            REQUEST_SECONDS.observe(duration, endpoint=endpoint)
+            if trace is not None and self.slow_ms and duration * 1000 >= self.slow_ms:
+                print(f"🐢 Медленный запрос {scope['method']} {scope['path']} ({status}): {trace.server_timing()}")
+            _trace.reset(token)
@@ -0,0 +1,347 @@
+import fcntl
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# Сигнатуры форматов для расширения файла в хранилище
+MAGIC = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"BM", "bmp"),
+)
+LEGACY_SUFFIXES = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
+
+
+def content_hash(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+def guess_ext(contents: bytes) -> str:
+    for magic, ext in MAGIC:
+        if contents.startswith(magic):
+            return ext
+    if contents[:4] == b"RIFF" and contents[8:12] == b"WEBP":
+        return "webp"
+    if contents[4:8] == b"ftyp":
+        return "mp4"
+    return "bin"
+
+
+class UploadStore:
+    """Загрузки, адресованные по sha256 содержимого.
+
+    Файл лежит в objects/ab/cd/<sha256>.<ext> (два уровня каталогов по
+    префиксу хэша, чтобы не было огромных плоских списков), одинаковые
+    загрузки хранятся один раз. Индекс в SQLite (index.db) хранит размер,
+    время первой и последней загрузки, число повторов и последний результат
+    детекции, поэтому поиск по хэшу не трогает каталог.
+
+    Запись идет фоновым потоком, как в журнале; если диск не успевает и в
+    очереди уже max_pending файлов, новые не сохраняются. Тот же поток раз в
+    compact_interval секунд удаляет файлы, которые не загружали дольше
+    max_age, и самые старые, пока общий размер больше max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, max_age=30 * 24 * 3600,
+                 compact_interval=600, max_pending=64):
+        self.directory = Path(directory)
+        self.objects = self.directory / "objects"
+        self.tmp = self.directory / "tmp"
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compact_interval = compact_interval
+        self.max_pending = max_pending
+
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.tmp.mkdir(parents=True, exist_ok=True)
+        # Недописанные файлы после падения процесса
+        for leftover in self.tmp.iterdir():
+            leftover.unlink(missing_ok=True)
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._conn = None
+        self._conn_pid = None
+        self._last_compact = time.time()
+        self._stats_snapshot = None
+
+        self.stored = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.compactions = 0
+        self.removed = 0
+        self.removed_bytes = 0
+
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS uploads (
+                sha256 TEXT PRIMARY KEY,
+                ext TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 1,
+                result TEXT,
+                result_version TEXT
+            )"""
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS uploads_last_seen ON uploads (last_seen)")
+
+    @property
+    def _db(self):
+        # Соединение SQLite нельзя использовать после fork - в воркере открываем свое
+        if self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(
+                str(self.directory / "index.db"), check_same_thread=False, isolation_level=None
+            )
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def path_for(self, digest, ext):
+        return self.objects / digest[:2] / digest[2:4] / f"{digest}.{ext}"
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._worker, name="upload-store", daemon=True)
+                self._thread.start()
+
+    def put(self, digest, contents: bytes, result=None, result_version=None, known=False):
+        """Ставит загрузку (и ее результат) в очередь на запись, не дожидаясь диска.
+
+        known=True - файл уже есть в индексе (см. lookup): в очередь идет только
+        обновление индекса, байты файла не держатся в памяти до записи.
+        False, если очередь переполнена и файл не будет сохранен.
+        """
+        if self._queue.qsize() >= self.max_pending:
+            self.dropped += 1
+            return False
+        self._ensure_started()
+        self._queue.put((digest, None if known else contents, result, result_version, time.time()))
+        return True
+
+    def _worker(self):
+        while True:
+            try:
+                entry = self._queue.get(timeout=self.compact_interval)
+            except queue.Empty:
+                entry = None
+            try:
+                if entry is not None:
+                    self._store(*entry)
+                if time.time() - self._last_compact >= self.compact_interval:
+                    self.compact()
+            except Exception as e:
+                print(f"❌ Ошибка хранилища загрузок: {e}")
+            finally:
+                if entry is not None:
+                    self._queue.task_done()
+
+    def _store(self, digest, contents, result, result_version, now):
+        result_json = json.dumps(result, ensure_ascii=False) if result is not None else None
+        with self._lock:
+            row = self._db.execute("SELECT ext FROM uploads WHERE sha256 = ?", (digest,)).fetchone()
+            # Без contents (put с known=True) сохранить файл нечем: если его успели
+            # удалить при сжатии, запись просто пропускается
+            if row is None and contents is None:
+                return False
+            if row is not None and (contents is None or self.path_for(digest, row[0]).exists()):
+                # Дубликат: файл уже есть, обновляем только индекс
+                self._db.execute(
+                    "UPDATE uploads SET last_seen = MAX(last_seen, ?), hits = hits + 1, "
+                    "result = COALESCE(?, result), result_version = COALESCE(?, result_version) "
+                    "WHERE sha256 = ?",
+                    (now, result_json, result_version, digest),
+                )
+                self.duplicates += 1
+                return False
+
+        ext = guess_ext(contents)
+        path = self.path_for(digest, ext)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Через временный файл: читатель не увидит недописанный файл
+        tmp = self.tmp / f"{digest}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "wb") as f:
+            f.write(contents)
+        os.replace(tmp, path)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO uploads (sha256, ext, size, created, last_seen, hits, result, result_version) "
+                "VALUES (?, ?, ?, ?, ?, 1, ?, ?) "
+                "ON CONFLICT(sha256) DO UPDATE SET ext = excluded.ext, size = excluded.size, "
+                "last_seen = excluded.last_seen, hits = hits + 1, "
+                "result = COALESCE(excluded.result, result), "
+                "result_version = COALESCE(excluded.result_version, result_version)",
+                (digest, ext, len(contents), now, now, result_json, result_version),
+            )
+            self.stored += 1
+        return True
+
+    def lookup(self, digest):
+        """Запись индекса по sha256 (с последним результатом детекции) или None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT sha256, ext, size, created, last_seen, hits, result, result_version "
+                "FROM uploads WHERE sha256 = ?",
+                (digest.lower(),),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "sha256": row[0],
+            "ext": row[1],
+            "size": row[2],
+            "created": row[3],
+            "last_seen": row[4],
+            "hits": row[5],
+            "result": json.loads(row[6]) if row[6] else None,
+            "result_version": row[7],
+        }
+
+    def _remove(self, rows):
+        for digest, ext, size in rows:
+            path = self.path_for(digest, ext)
+            path.unlink(missing_ok=True)
+            # Пустые каталоги шардов тоже убираем
+            for parent in (path.parent, path.parent.parent):
+                try:
+                    parent.rmdir()
+                except OSError:
+                    break
+            self.removed += 1
+            self.removed_bytes += size
+        with self._lock:
+            self._db.executemany("DELETE FROM uploads WHERE sha256 = ?", [(row[0],) for row in rows])
+
+    def compact(self, now=None):
+        """Удаляет устаревшие файлы, затем самые старые сверх max_bytes.
+
+        Чистит до 90% лимита, чтобы не запускаться на каждой новой загрузке.
+        Возвращает число удаленных файлов.
+        """
+        now = now or time.time()
+        self._last_compact = now
+        removed = 0
+        if self.max_age:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT sha256, ext, size FROM uploads WHERE last_seen < ?", (now - self.max_age,)
+                ).fetchall()
+            self._remove(rows)
+            removed += len(rows)
+        if self.max_bytes:
+            with self._lock:
+                total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM uploads").fetchone()[0]
+            if total > self.max_bytes:
+                target = total - int(self.max_bytes * 0.9)
+                rows, freed = [], 0
+                with self._lock:
+                    cursor = self._db.execute("SELECT sha256, ext, size FROM uploads ORDER BY last_seen")
+                    for row in cursor:
+                        if freed >= target:
+                            break
+                        rows.append(row)
+                        freed += row[2]
+                self._remove(rows)
+                removed += len(rows)
+        self.compactions += 1
+        if removed:
+            print(f"🧹 Хранилище загрузок: удалено {removed} файлов")
+        return removed
+
+    @property
+    def legacy_marker(self):
+        return self.directory / "legacy-migrated"
+
+    def migrate_legacy(self, directory, delete=False):
+        """Копирует старые плоские загрузки (uploads/20260117_..._file.jpg) в хранилище.
+
+        Время загрузки берется из mtime файла, пустые файлы (оборванные
+        загрузки) пропускаются. Оригиналы остаются на месте, если не задан
+        delete (python -m utils.upload_store uploads --delete); без delete
+        копирование выполняется один раз, дальше его отмечает legacy-migrated.
+        Возвращает число скопированных файлов.
+        """
+        if not delete and self.legacy_marker.exists():
+            return 0
+        # Процессы с общим каталогом (uvicorn --workers, второй контейнер на томе)
+        # копируют по очереди: следующий за замком увидит отметку и выйдет
+        with open(self.directory / "legacy.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if not delete and self.legacy_marker.exists():
+                return 0
+            moved = 0
+            for path in sorted(Path(directory).iterdir()):
+                if not path.is_file() or path.suffix.lower() not in LEGACY_SUFFIXES:
+                    continue
+                contents = path.read_bytes()
+                if contents:
+                    self._store(content_hash(contents), contents, None, None, path.stat().st_mtime)
+                    moved += 1
+                if delete:
+                    path.unlink()
+            self.legacy_marker.touch()
+        if moved:
+            print(f"📦 Скопировано {moved} старых загрузок в {self.objects}")
+        return moved
+
+    def flush(self):
+        """Ждет, пока все поставленные загрузки окажутся на диске"""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.join()
+
+    def close(self):
+        self.flush()
+
+    def stats(self, max_age=0.0):
+        """Статистика хранилища; max_age - можно вернуть снимок не старше стольких секунд
+        (для метрик: одно сканирование индекса на все датчики)"""
+        snapshot = self._stats_snapshot
+        if max_age and snapshot is not None and time.monotonic() - snapshot[0] <= max_age:
+            return snapshot[1]
+        with self._lock:
+            entries, total, hits = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM uploads"
+            ).fetchone()
+        stats = {
+            "entries": entries,
+            "bytes": total,
+            "uploads": hits,
+            "pending": self._queue.qsize(),
+            "stored": self.stored,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+            "compactions": self.compactions,
+            "removed": self.removed,
+            "removed_bytes": self.removed_bytes,
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+        }
+        self._stats_snapshot = (time.monotonic(), stats)
+        return stats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Перенос старых загрузок в хранилище по sha256")
+    parser.add_argument("uploads", help="каталог со старыми загрузками (UPLOAD_DIR)")
+    parser.add_argument("--store", help="каталог хранилища (по умолчанию <uploads>/store)")
+    parser.add_argument("--delete", action="store_true", help="удалить оригиналы после копирования")
+    args = parser.parse_args()
+
+    store = UploadStore(args.store or Path(args.uploads) / "store")
+    store.migrate_legacy(args.uploads, delete=args.delete)
@@ -1,67 +1,113 @@
 from PIL import Image, ImageDraw, ImageFont, ImageOps
+from functools import lru_cache
+import threading
 import os
 
-def add_watermark(image: Image.Image, text: str) -> Image.Image:
-    # 1. Подготовка основы
-    img = image.copy().convert("RGBA")
-    width, height = img.size
-    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    draw = ImageDraw.Draw(overlay)
-    
-    font_size = max(20, width // 30)
-    
-    # 2. Загрузка шрифта
-    font = None
-    font_paths = ["arial.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", "C:\\Windows\\Fonts\\arial.ttf"]
-    for path in font_paths:
+FONT_PATHS = ["arial.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", "C:\\Windows\\Fonts\\arial.ttf"]
+# Путь к файлу с лицом (положи файл face.png рядом с main.py или укажи полный путь)
+FACE_PATH = "face.png"
+PADDING = 20
+# Запас по краям штампа, чтобы сглаживание текста точно не обрезалось
+STAMP_MARGIN = 2
+
+# Шрифты FreeType не стоит использовать из нескольких потоков одновременно
+_render_lock = threading.Lock()
+
+
+@lru_cache(maxsize=32)
+def _load_font(font_size):
+    for path in FONT_PATHS:
         try:
-            font = ImageFont.truetype(path, size=font_size)
-            break
+            return ImageFont.truetype(path, size=font_size)
         except: continue
-    if not font: font = ImageFont.load_default()
-
-    # 3. Работа с лицом (аватаркой)
-    # Путь к файлу с лицом (положи файл face.png рядом с main.py или укажи полный путь)
-    face_path = "face.png" 
-    face_img = None
-    
-    if os.path.exists(face_path):
-        try:
-            face_img = Image.open(face_path).convert("RGBA")
-            # Размер лица пропорционально тексту
-            face_size = font_size + 20
-            face_img = face_img.resize((face_size, face_size), Image.Resampling.LANCZOS)
-            
-            # Делаем лицо круглым
-            mask = Image.new("L", (face_size, face_size), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.ellipse((0, 0, face_size, face_size), fill=255)
-            
-            circular_face = Image.new("RGBA", (face_size, face_size), (0, 0, 0, 0))
-            circular_face.paste(face_img, (0, 0), mask=mask)
-            face_img = circular_face
-        except Exception as e:
-            print(f"Ошибка загрузки лица: {e}")
-
-    # 4. Расчет позиций
-    padding = 20
-    bbox = draw.textbbox((0, 0), text, font=font)
-    text_width = bbox[2] - bbox[0]
-    text_height = bbox[3] - bbox[1]
-
-    # Координаты текста (справа внизу)
-    x_text = width - text_width - padding
-    y_text = height - text_height - padding
-
-    # 5. Наложение элементов
-    if face_img:
-        # Позиция лица слева от текста
-        face_x = int(x_text - face_img.width - 15)
-        face_y = int(y_text - (face_img.height // 4))
-        overlay.paste(face_img, (face_x, face_y), face_img)
-
-    # Рисуем текст (с тенью для читаемости)
-    draw.text((x_text + 1, y_text + 1), text, fill=(0, 0, 0, 180), font=font)
-    draw.text((x_text, y_text), text, fill=(255, 255, 255, 220), font=font)
-
-    return Image.alpha_composite(img, overlay).convert("RGB")
\ No newline at end of file
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=32)
+def _load_face(face_size):
+    if not os.path.exists(FACE_PATH):
+        return None
+    try:
+        face_img = Image.open(FACE_PATH).convert("RGBA")
+        face_img = face_img.resize((face_size, face_size), Image.Resampling.LANCZOS)
+
+        # Делаем лицо круглым
+        mask = Image.new("L", (face_size, face_size), 0)
+        mask_draw = ImageDraw.Draw(mask)
+        mask_draw.ellipse((0, 0, face_size, face_size), fill=255)
+
+        circular_face = Image.new("RGBA", (face_size, face_size), (0, 0, 0, 0))
+        circular_face.paste(face_img, (0, 0), mask=mask)
+        return circular_face
+    except Exception as e:
+        print(f"Ошибка загрузки лица: {e}")
+        return None
+
+
+@lru_cache(maxsize=64)
+def _render_stamp(text, font_size):
+    """Рисует лицо и текст на маленьком прозрачном штампе.
+
+    Возвращает (штамп, (left, top), ширина текста, высота текста), где
+    (left, top) - смещение левого верхнего угла штампа относительно точки,
+    в которую рисуется текст.
+    """
+    with _render_lock:
+        font = _load_font(font_size)
+        # Размер лица пропорционально тексту
+        face_img = _load_face(font_size + 20)
+
+        measure = ImageDraw.Draw(Image.new("RGBA", (1, 1), (0, 0, 0, 0)))
+        bbox = measure.textbbox((0, 0), text, font=font)
+        text_width = bbox[2] - bbox[0]
+        text_height = bbox[3] - bbox[1]
+
+        # Границы всех элементов относительно точки текста (+1 - тень)
+        left, top, right, bottom = bbox[0], bbox[1], bbox[2] + 1, bbox[3] + 1
+        if face_img:
+            # Позиция лица слева от текста
+            face_x = -face_img.width - 15
+            face_y = -(face_img.height // 4)
+            left, top = min(left, face_x), min(top, face_y)
+            right = max(right, face_x + face_img.width)
+            bottom = max(bottom, face_y + face_img.height)
+        left, top = left - STAMP_MARGIN, top - STAMP_MARGIN
+        right, bottom = right + STAMP_MARGIN, bottom + STAMP_MARGIN
+
+        stamp = Image.new("RGBA", (right - left, bottom - top), (0, 0, 0, 0))
+        if face_img:
+            stamp.paste(face_img, (face_x - left, face_y - top), face_img)
+
+        # Рисуем текст (с тенью для читаемости)
+        draw = ImageDraw.Draw(stamp)
+        draw.text((1 - left, 1 - top), text, fill=(0, 0, 0, 180), font=font)
+        draw.text((-left, -top), text, fill=(255, 255, 255, 220), font=font)
+        return stamp, (left, top), text_width, text_height
+
+
+def add_watermark(image: Image.Image, text: str) -> Image.Image:
+    # 1. Готовый штамп из кэша: шрифт, лицо и текст рисуются один раз на (text, font_size)
+    width, height = image.size
+    font_size = max(20, width // 30)
+    stamp, (left, top), text_width, text_height = _render_stamp(text, font_size)
+
+    # 2. Координаты текста (справа внизу) и область штампа на картинке
+    x_text = width - text_width - PADDING
+    y_text = height - text_height - PADDING
+    x0, y0 = x_text + left, y_text + top
+    box = (max(0, x0), max(0, y0), min(width, x0 + stamp.width), min(height, y0 + stamp.height))
+
+    # 3. Вне штампа пиксели не меняются, поэтому в RGBA переводим только его область
+    if image.mode == "RGB":
+        source = image
+        result = image.copy()
+    else:
+        source = image.convert("RGBA")
+        result = source.convert("RGB")
+    if box[2] <= box[0] or box[3] <= box[1]:
+        return result
+
+    region = source.crop(box).convert("RGBA")
+    piece = stamp.crop((box[0] - x0, box[1] - y0, box[2] - x0, box[3] - y0))
+    result.paste(Image.alpha_composite(region, piece).convert("RGB"), box[:2])
+    return result